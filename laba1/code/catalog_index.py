@@ -0,0 +1,150 @@
+import math
+import re
+
+import numpy as np
+
+# Пространственный индекс по каталогу найденных объектов: равномерная сетка ячеек.
+# Точки отсортированы по номеру ячейки, поэтому строка ячеек сетки - это один
+# непрерывный срез массивов, и запрос по прямоугольнику читает по срезу на строку.
+
+OBJECTS_PER_CELL = 4
+CATALOG_LINE = re.compile(
+    r"Координаты: \(([-\d.e+]+), ([-\d.e+]+)\); Яркость: ([-\d.e+]+); Размер: ([-\d.e+]+); Тип: (.+)")
+
+
+class CatalogIndex:
+    # grid - готовая сетка из load: (order, cell_start, x_min, y_min, cell_size, nx, ny)
+    def __init__(self, x, y, columns=None, cell_size=None, grid=None):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+        if grid is not None:
+            self.order, self.cell_start, self.x_min, self.y_min, self.cell_size, self.nx, self.ny = grid
+        else:
+            self._build(cell_size)
+        self.sorted_x = self.x[self.order]
+        self.sorted_y = self.y[self.order]
+
+    def _build(self, cell_size):
+        count = len(self.x)
+        if count:
+            self.x_min, self.y_min = float(self.x.min()), float(self.y.min())
+            x_span = max(float(self.x.max()) - self.x_min, 1.0)
+            y_span = max(float(self.y.max()) - self.y_min, 1.0)
+        else:
+            self.x_min = self.y_min = 0.0
+            x_span = y_span = 1.0
+        # Примерно OBJECTS_PER_CELL объектов на ячейку при равномерном распределении
+        self.cell_size = float(cell_size or math.sqrt(x_span * y_span * OBJECTS_PER_CELL / max(count, 1)))
+        self.nx = int(x_span // self.cell_size) + 1
+        self.ny = int(y_span // self.cell_size) + 1
+        cells = self._cell_ids(self.x, self.y)
+        self.order = np.argsort(cells, kind="stable")
+        self.cell_start = np.searchsorted(cells[self.order], np.arange(self.nx * self.ny + 1))
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cell_ids(self, x, y):
+        cx = np.clip(((x - self.x_min) // self.cell_size).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip(((y - self.y_min) // self.cell_size).astype(np.int64), 0, self.ny - 1)
+        return cy * self.nx + cx
+
+    def _cell_range(self, low, high, origin, cells):
+        first = int(max((low - origin) // self.cell_size, 0))
+        last = int(min((high - origin) // self.cell_size, cells - 1))
+        return first, last
+
+    # Индексы объектов внутри прямоугольника [x0, x1] x [y0, y1]
+    def query_box(self, x0, y0, x1, y1):
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        cx0, cx1 = self._cell_range(x0, x1, self.x_min, self.nx)
+        cy0, cy1 = self._cell_range(y0, y1, self.y_min, self.ny)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+        slices = [slice(self.cell_start[cy * self.nx + cx0], self.cell_start[cy * self.nx + cx1 + 1])
+                  for cy in range(cy0, cy1 + 1)]
+        positions = np.concatenate([np.arange(s.start, s.stop) for s in slices])
+        xs, ys = self.sorted_x[positions], self.sorted_y[positions]
+        inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+        return self.order[positions[inside]]
+
+    # Индексы объектов не дальше radius от точки, по возрастанию расстояния
+    def query_radius(self, x, y, radius):
+        candidates = self.query_box(x - radius, y - radius, x + radius, y + radius)
+        distances = np.hypot(self.x[candidates] - x, self.y[candidates] - y)
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        return candidates[np.argsort(distances, kind="stable")]
+
+    # k ближайших объектов: радиус поиска удваивается, пока в круг не попадет k объектов
+    def query_nearest(self, x, y, k=1):
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        k = min(k, len(self))
+        radius = self.cell_size
+        limit = math.hypot(self.nx * self.cell_size, self.ny * self.cell_size) + \
+            math.hypot(x - self.x_min, y - self.y_min)
+        while True:
+            found = self.query_radius(x, y, radius)
+            if len(found) >= k or radius > limit:
+                return found[:k]
+            radius *= 2
+
+    # Строки каталога по индексам, в виде словарей
+    def rows(self, indices):
+        return [dict({"x": float(self.x[i]), "y": float(self.y[i])},
+                     **{name: values[i].item() for name, values in self.columns.items()})
+                for i in indices]
+
+    def save(self, path):
+        np.savez(path, x=self.x, y=self.y, order=self.order, cell_start=self.cell_start,
+                 grid=np.array([self.x_min, self.y_min, self.cell_size, self.nx, self.ny]),
+                 **{f"column_{name}": values for name, values in self.columns.items()})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            x_min, y_min, cell_size, nx, ny = data["grid"]
+            grid = (data["order"], data["cell_start"], float(x_min), float(y_min), float(cell_size),
+                    int(nx), int(ny))
+            columns = {name[len("column_"):]: data[name] for name in data.files if name.startswith("column_")}
+            return cls(data["x"], data["y"], columns, grid=grid)
+
+    # Индекс по списку объектов в формате cosmic.py ({"x", "y", "brightness", "type", "size"})
+    @classmethod
+    def from_objects(cls, space_objects, cell_size=None):
+        columns = {
+            "brightness": [float(obj["brightness"]) for obj in space_objects],
+            "type": [str(obj["type"]) for obj in space_objects],
+            "size": [float(obj["size"]) for obj in space_objects],
+        }
+        return cls([obj["x"] for obj in space_objects], [obj["y"] for obj in space_objects],
+                   columns, cell_size=cell_size)
+
+
+# Читает текстовый каталог, записанный detection.write_objects
+def read_text_catalog(path):
+    space_objects = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            match = CATALOG_LINE.match(line.strip())
+            if match:
+                x, y, brightness, size, object_type = match.groups()
+                space_objects.append({"x": float(x), "y": float(y), "brightness": float(brightness),
+                                      "size": float(size), "type": object_type})
+    return space_objects
+
+
+# Сопоставляет объекты двух каталогов: для каждого объекта из first ближайший из second не дальше radius
+def cross_match(first, second, radius):
+    matches = []
+    for i in range(len(first)):
+        nearest = second.query_nearest(first.x[i], first.y[i], k=1)
+        if len(nearest):
+            j = int(nearest[0])
+            distance = math.hypot(first.x[i] - second.x[j], first.y[i] - second.y[j])
+            if distance <= radius:
+                matches.append((i, j, distance))
+    return matches
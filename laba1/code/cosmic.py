@@ -1,160 +1,291 @@
-import cv2
-import numpy as np
-from PIL import ImageFont, ImageDraw, Image
-import multiprocessing as mp
-import os
-import tkinter as tk
-from tkinter import messagebox, filedialog
-
-# Глобальные переменные
-file_paths = []  # Список для хранения путей к выбранным изображениям.
-
-# Функция для анализа части изображения, выделения объектов и сохранения результатов
-def analysing(image, number, queue, output_directory):
-    image_with_objects = image.copy()
-    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
-    image = cv2.filter2D(image, -1, kernel)
-
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
-    _, binary_image = cv2.threshold(blurred_image, 200, 255, cv2.THRESH_BINARY)
-    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    space_objects = []
-
-    # Заменяем путь к шрифту на подходящий для macOS
-    font_path = "/Library/Fonts/Arial.ttf"  # Путь к шрифту Arial в macOS
-    font = ImageFont.truetype(font_path, 14)
-
-    for contour in contours:
-        area = cv2.contourArea(contour)
-        x, y, width, height = cv2.boundingRect(contour)
-        center_x = x + width / 2
-        center_y = y + height / 2
-        brightness = np.sum(gray_image[y:y + height, x:x + width])
-        object_type = classified(area, brightness)
-        space_object = {
-            "x": center_x,
-            "y": center_y,
-            "brightness": brightness,
-            "type": object_type,
-            "size": width * height
-        }
-        space_objects.append(space_object)
-        cv2.rectangle(image_with_objects, (x, y), (x + width, y + height), (0, 255, 0), 2)
-
-        # Использование PIL для добавления текста
-        pil_image = Image.fromarray(image_with_objects)
-        draw = ImageDraw.Draw(pil_image)
-        draw.text((x, y - 10), object_type, font=font, fill=(0, 0, 0))
-        image_with_objects = np.array(pil_image)
-
-    os.makedirs(output_directory, exist_ok=True)
-    output2_directory = os.path.join(output_directory, "image_crop")
-    os.makedirs(output2_directory, exist_ok=True)
-    cv2.imwrite(os.path.join(output2_directory, f"{number}.tif"), image_with_objects)
-
-    with open(os.path.join(output_directory, f"{number}.txt"), "w", encoding="utf-8") as file:
-        for obj in space_objects:
-            file.write(f"Координаты: ({obj['x']}, {obj['y']}); Яркость: {obj['brightness']}; Размер: {obj['size']}; Тип: {obj['type']}\n")
-    print(f"Выполнен процесс №{number}")
-    queue.put((image_with_objects, number - 1))
-
-# Классифицирует объекты на основе площади и яркости
-def classified(area, brightness):
-    return {
-        area < 10 and brightness > 100: "звезда",
-        area < 10 and brightness > 50: "комета",
-        area < 10 and brightness > 0: "планета",
-        area > 10000 and brightness > 1000000: "галактика",
-        area < 10000 and brightness > 1000000: "квазар",
-        area >= 10 and brightness > 0: "звезда"
-    }[True]
-
-# Разделяет изображение на части для параллельной обработки
-def split_image(image, num_parts):
-    height, width, _ = image.shape
-    part_width = (width // num_parts) + 1
-    part_height = (height // num_parts) + 1
-    parts = []
-    for chunk_width in range(num_parts):
-        for chunk_height in range(num_parts):
-            part = image[chunk_height * part_height:min((chunk_height + 1) * part_height, len(image))]
-            part = part[:, chunk_width * part_width:(chunk_width + 1) * part_width, :]
-            parts.append(part)
-    return parts
-
-# Обрабатывает изображения параллельно
-def parallel_processing(image_paths):
-    for full_path_to_image in image_paths:
-        output_directory = os.path.join("image_result", os.path.splitext(os.path.basename(full_path_to_image))[0])
-        queue = mp.Manager().Queue()  # Используем Manager для очереди
-        image = cv2.imread(full_path_to_image)
-        num_parts = 4
-        mp_parts = split_image(image, num_parts)
-
-        processes = []
-        number = 0
-
-        for mp_part in mp_parts:
-            number += 1
-            process = mp.Process(target=analysing, args=(mp_part, number, queue, output_directory))
-            process.start()
-            processes.append(process)
-
-        sum_finish = 0
-        image_parts = [0] * len(mp_parts)
-
-        while sum_finish != len(processes):
-            if not queue.empty():
-                sum_finish += 1
-                image_part = queue.get()
-                image_parts[image_part[1]] = image_part[0].copy()
-
-        image_vstack = [image_parts[i] for i in range(0, num_parts ** 2, num_parts)]
-
-        k = 0
-        for i in range(num_parts):
-            for j in range(1, num_parts):
-                image_vstack[i] = np.vstack([image_vstack[i], image_parts[j + k]])
-            k += num_parts
-
-        image_with_objects = np.hstack(image_vstack)
-        cv2.imwrite(os.path.join(output_directory, "new_image.tif"), image_with_objects)
-        messagebox.showinfo("Готово", "Результат сохранен")
-
-
-# Открывает диалоговое окно для выбора изображений
-def select_images():
-    global file_paths
-    try:
-        file_paths = filedialog.askopenfilenames(filetypes=[("TIFF files", "*.tif"), ("JPEG files", "*.jpg"), ("PNG files", "*.png")])
-        if file_paths:
-            messagebox.showinfo("Готово", "Изображения успешно загружены")
-        else:
-            messagebox.showwarning("Внимание", "Изображения не были выбраны.")
-    except Exception as e:
-        messagebox.showerror("Ошибка", f"Не удалось загрузить изображения: {e}")
-
-if __name__ == '__main__':
-    root = tk.Tk()
-    root.title("Параллельная обработка космических изображений")
-    root.geometry("500x300")
-
-    lbl = tk.Label(root, text="Добро пожаловать! Перед началом работы, ознакомьтесь с инструкцией:", font=("Arial", 10))
-    lbl.place(relx=0.01, rely=0.1)
-    lbl = tk.Label(root, text="1. Выберите космические изображения, содержащие необходимые объекты.")
-    lbl.place(relx=0.01, rely=0.2)
-    lbl = tk.Label(root, text="2. Загрузите изображения с помощью кнопки 'Загрузить'.")
-    lbl.place(relx=0.01, rely=0.3)
-    lbl = tk.Label(root, text="3. Нажмите на кнопку 'Провести анализ'.")
-    lbl.place(relx=0.01, rely=0.4)
-    lbl = tk.Label(root, text="4. После завершения всех процессов результат будет доступен в папке 'image_result'.")
-    lbl.place(relx=0.01, rely=0.5)
-
-    choose = tk.Button(root, text="Загрузить изображения", width=30, bg="#DDDDDD", command=select_images)
-    choose.place(relx=0.03, rely=0.65)
-
-    start = tk.Button(root, text="Провести анализ", width=30, bg="#DDDDDD", command=lambda: parallel_processing(file_paths))
-    start.place(relx=0.5, rely=0.65)
-
+import cv2
+import numpy as np
+from PIL import ImageFont, ImageDraw, Image
+import itertools
+import multiprocessing as mp
+import os
+import queue as queue_module
+import time
+import logging
+import tkinter as tk
+from tkinter import messagebox, filedialog
+
+from tile_planner import plan_tiles
+from scratch_arena import peak_rss_mb
+from detection import detect_objects, prescan_tiles, tile_windows, write_objects
+
+# Глобальные переменные
+file_paths = []  # Список для хранения путей к выбранным изображениям.
+NUM_PARTS = None  # Число частей по каждой стороне; None - подобрать по размеру изображения и памяти
+NUM_WORKERS = None  # Число одновременных процессов; None - подобрать по ядрам и памяти
+TILE_TIMEOUT = 300  # Сколько секунд дается процессу на одну часть
+TILE_ATTEMPTS = 2  # Сколько раз запускать часть, прежде чем отложить ее в карантин
+FONT_PATHS = [
+    "/Library/Fonts/Arial.ttf",  # macOS
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Linux
+    "C:\\Windows\\Fonts\\arial.ttf",  # Windows
+]
+
+# Функция для анализа части изображения, выделения объектов и сохранения результатов.
+# job - номер задания, по нему run_tiles отличает результат текущего запуска от опоздавшего.
+# Вместе с результатом отправляется пиковая память процесса, который обработал часть
+def analysing(image, number, queue, output_directory, job=1):
+    image_with_objects = image.copy()
+    space_objects, boxes = detect_objects(image)
+
+    font = load_font(14)
+
+    for x, y, width, height in boxes:
+        cv2.rectangle(image_with_objects, (x, y), (x + width, y + height), (0, 255, 0), 2)
+
+    # Подписи добавляем через PIL одним проходом, без копирования изображения на каждый объект
+    if space_objects:
+        pil_image = Image.fromarray(image_with_objects)
+        draw = ImageDraw.Draw(pil_image)
+        for space_object, (x, y, _, _) in zip(space_objects, boxes):
+            draw.text((x, y - 10), space_object["type"], font=font, fill=(0, 0, 0))
+        image_with_objects = np.array(pil_image)
+
+    os.makedirs(output_directory, exist_ok=True)
+    output2_directory = os.path.join(output_directory, "image_crop")
+    os.makedirs(output2_directory, exist_ok=True)
+    cv2.imwrite(os.path.join(output2_directory, f"{number}.tif"), image_with_objects)
+
+    write_objects(os.path.join(output_directory, f"{number}.txt"), space_objects)
+    print(f"Выполнен процесс №{number}")
+    queue.put((image_with_objects, number - 1, job, os.getpid(), peak_rss_mb()))
+
+# Загружает первый найденный шрифт с кириллицей, иначе встроенный шрифт PIL
+def load_font(size):
+    for font_path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+# Разделяет изображение на части для параллельной обработки
+def split_image(image, num_parts):
+    height, width, _ = image.shape
+    return [image[y0:y1, x0:x1, :] for _, y0, y1, x0, x1 in tile_windows(height, width, num_parts)]
+
+# Постоянный процесс обработки: разбирает части из своей очереди, пока не получит None.
+# Арена буферов (scratch_arena) живет вместе с процессом и переиспользуется для всех
+# его частей, в том числе частей следующих изображений
+def tile_worker(tasks, queue):
+    while (task := tasks.get()) is not None:
+        image, number, output_directory, job = task
+        analysing(image, number, queue, output_directory, job)
+
+
+class TileWorker:
+    def __init__(self, queue):
+        self.tasks = mp.Queue()
+        self.process = mp.Process(target=tile_worker, args=(self.tasks, queue), daemon=True)
+        self.process.start()
+        self.busy = False
+
+
+# Процессы обработки частей на все изображения. Упавший или снятый по времени процесс
+# выбрасывается вместе со своей очередью заданий, вместо него запускается новый
+class TilePool:
+    def __init__(self):
+        self.manager = mp.Manager()
+        self.queue = self.manager.Queue()  # результаты всех процессов
+        self.workers = []
+        self.jobs = itertools.count(1)
+
+    # Свободный процесс, если занятых меньше limit; при нехватке запускается новый
+    def idle(self, limit):
+        self.workers = [worker for worker in self.workers if worker.busy or worker.process.is_alive()]
+        if sum(worker.busy for worker in self.workers) >= limit:
+            return None
+        for worker in self.workers:
+            if not worker.busy:
+                return worker
+        worker = TileWorker(self.queue)
+        self.workers.append(worker)
+        return worker
+
+    def discard(self, worker):
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join()
+        self.workers.remove(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        self.workers.clear()
+        self.manager.shutdown()
+
+
+# Раздает части процессам pool, не более workers частей одновременно.
+# Упавший или зависший процесс заменяется новым, после TILE_ATTEMPTS неудач часть
+# откладывается в карантин и в итоговое изображение попадает без разметки.
+# Части из skip (пустое небо по prescan_tiles) не анализируются: в результат они
+# попадают как есть, а их список объектов остается пустым.
+# Возвращает части, карантин и {pid процесса: его пиковая память, МБ}.
+def run_tiles(mp_parts, pool, output_directory, workers, tile_timeout=None, max_attempts=None, skip=()):
+    tile_timeout = tile_timeout or TILE_TIMEOUT
+    max_attempts = max_attempts or TILE_ATTEMPTS
+    waiting = [number for number in range(1, len(mp_parts) + 1) if number not in skip]
+    attempts = [0] * len(mp_parts)
+    running = {}  # {номер_части: (процесс TileWorker, номер задания, время_запуска)}
+    image_parts = [None] * len(mp_parts)
+    quarantined = []
+    peaks = {}
+
+    os.makedirs(output_directory, exist_ok=True)
+    for number in skip:
+        image_parts[number - 1] = mp_parts[number - 1]
+        write_objects(os.path.join(output_directory, f"{number}.txt"), [])
+
+    def fail(number, reason):
+        print(f"Процесс №{number} завершился с ошибкой: {reason}")
+        if attempts[number - 1] < max_attempts:
+            waiting.append(number)
+        else:
+            quarantined.append((number, reason))
+            image_parts[number - 1] = mp_parts[number - 1]
+
+    while waiting or running:
+        while waiting:
+            worker = pool.idle(workers)
+            if worker is None:
+                break
+            number = waiting.pop(0)
+            attempts[number - 1] += 1
+            job = next(pool.jobs)
+            worker.tasks.put((mp_parts[number - 1], number, output_directory, job))
+            worker.busy = True
+            running[number] = (worker, job, time.monotonic())
+
+        # Сначала запоминаем завершившиеся процессы, потом забираем результаты:
+        # все, что процесс успел отправить до выхода, уже лежит в очереди
+        finished = [number for number, (worker, _, _) in running.items() if not worker.process.is_alive()]
+        try:
+            image_part = pool.queue.get(timeout=0.2)
+            while True:
+                image, index, job, pid, peak = image_part
+                number = index + 1
+                # Результат, который процесс с истекшим временем успел отправить перед terminate,
+                # относится к снятому заданию: его отбрасываем и ждем результата повторного
+                if number in running and running[number][1] == job:
+                    image_parts[number - 1] = image.copy()
+                    running.pop(number)[0].busy = False
+                    peaks[pid] = peak
+                image_part = pool.queue.get_nowait()
+        except queue_module.Empty:
+            pass
+
+        for number in finished:
+            if number in running:
+                worker = running.pop(number)[0]
+                pool.discard(worker)
+                fail(number, f"процесс завершился без результата (код {worker.process.exitcode})")
+
+        now = time.monotonic()
+        for number, (worker, _, started) in list(running.items()):
+            if now - started > tile_timeout:
+                pool.discard(worker)
+                running.pop(number)
+                fail(number, f"превышено время {tile_timeout} с")
+
+    return image_parts, quarantined, peaks
+
+# Обрабатывает изображения параллельно одними и теми же процессами
+def parallel_processing(image_paths, num_parts=None, num_workers=None):
+    pool = TilePool()
+    try:
+        for full_path_to_image in image_paths:
+            process_image(pool, full_path_to_image, num_parts, num_workers)
+    finally:
+        pool.close()
+
+
+# Делит изображение на части, обрабатывает их процессами pool и собирает результат
+def process_image(pool, full_path_to_image, num_parts=None, num_workers=None):
+    output_directory = os.path.join("image_result", os.path.splitext(os.path.basename(full_path_to_image))[0])
+    image = cv2.imread(full_path_to_image)
+    if image is None:
+        print(f"Не удалось прочитать {full_path_to_image}, пропускаем")
+        return
+    plan = plan_tiles(image.shape, image.dtype.itemsize,
+                      num_parts=num_parts or NUM_PARTS, workers=num_workers or NUM_WORKERS)
+    image_num_parts = plan["num_parts"]
+    windows = tile_windows(image.shape[0], image.shape[1], image_num_parts)
+    mp_parts = split_image(image, image_num_parts)
+    busy = prescan_tiles(image, windows)
+    skipped = {number for number, *_ in windows} - busy
+
+    image_parts, quarantined, peaks = run_tiles(mp_parts, pool, output_directory, plan["workers"], skip=skipped)
+
+    image_vstack = [image_parts[i] for i in range(0, image_num_parts ** 2, image_num_parts)]
+
+    k = 0
+    for i in range(image_num_parts):
+        for j in range(1, image_num_parts):
+            image_vstack[i] = np.vstack([image_vstack[i], image_parts[j + k]])
+        k += image_num_parts
+
+    image_with_objects = np.hstack(image_vstack)
+    cv2.imwrite(os.path.join(output_directory, "new_image.tif"), image_with_objects)
+    with open(os.path.join(output_directory, "report.txt"), "w", encoding="utf-8") as file:
+        file.write(f"Частей: {len(mp_parts)}\n")
+        file.write(f"Пропущено как пустые: {len(skipped)}\n")
+        file.write(f"В карантине: {len(quarantined)}\n")
+        # Свой пик каждого процесса, обработавшего части этого изображения (за всю его жизнь)
+        for pid, peak in sorted(peaks.items()):
+            file.write(f"Пиковая память рабочего процесса {pid}, МБ: {peak}\n")
+    print(f"{full_path_to_image}: частей {len(mp_parts)}, пропущено пустых {len(skipped)}")
+    if quarantined:
+        with open(os.path.join(output_directory, "quarantine.txt"), "w", encoding="utf-8") as file:
+            for number, reason in quarantined:
+                file.write(f"Часть №{number}: {reason}\n")
+        messagebox.showwarning("Готово", f"Результат сохранен, не обработано частей: {len(quarantined)} (см. quarantine.txt)")
+    else:
+        messagebox.showinfo("Готово", f"Результат сохранен, пропущено пустых частей: {len(skipped)} из {len(mp_parts)}")
+
+
+# Открывает диалоговое окно для выбора изображений
+def select_images():
+    global file_paths
+    try:
+        file_paths = filedialog.askopenfilenames(filetypes=[("TIFF files", "*.tif"), ("JPEG files", "*.jpg"), ("PNG files", "*.png")])
+        if file_paths:
+            messagebox.showinfo("Готово", "Изображения успешно загружены")
+        else:
+            messagebox.showwarning("Внимание", "Изображения не были выбраны.")
+    except Exception as e:
+        messagebox.showerror("Ошибка", f"Не удалось загрузить изображения: {e}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    root = tk.Tk()
+    root.title("Параллельная обработка космических изображений")
+    root.geometry("500x300")
+
+    lbl = tk.Label(root, text="Добро пожаловать! Перед началом работы, ознакомьтесь с инструкцией:", font=("Arial", 10))
+    lbl.place(relx=0.01, rely=0.1)
+    lbl = tk.Label(root, text="1. Выберите космические изображения, содержащие необходимые объекты.")
+    lbl.place(relx=0.01, rely=0.2)
+    lbl = tk.Label(root, text="2. Загрузите изображения с помощью кнопки 'Загрузить'.")
+    lbl.place(relx=0.01, rely=0.3)
+    lbl = tk.Label(root, text="3. Нажмите на кнопку 'Провести анализ'.")
+    lbl.place(relx=0.01, rely=0.4)
+    lbl = tk.Label(root, text="4. После завершения всех процессов результат будет доступен в папке 'image_result'.")
+    lbl.place(relx=0.01, rely=0.5)
+
+    choose = tk.Button(root, text="Загрузить изображения", width=30, bg="#DDDDDD", command=select_images)
+    choose.place(relx=0.03, rely=0.65)
+
+    start = tk.Button(root, text="Провести анализ", width=30, bg="#DDDDDD", command=lambda: parallel_processing(file_paths))
+    start.place(relx=0.5, rely=0.65)
+
     root.mainloop()  # Запускает главный цикл обработки событий
\ No newline at end of file
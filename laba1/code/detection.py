@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+
+from scratch_arena import process_arena
+
+# Обнаружение объектов без интерфейса: этот модуль импортируют и cosmic.py, и процессы
+# tile_broker.py и frame_stream.py, которым Tk не нужен (например, на сервере без экрана)
+
+DETECTION_THRESHOLD = 200  # Порог яркости после фильтра и размытия, выше которого пиксель - часть объекта
+PRESCAN_BLOCK = 8  # Размер блока уменьшенной копии для предварительного просмотра кадра
+
+SHARPEN_KERNEL = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+
+# Выделяет объекты на фрагменте изображения и возвращает их список вместе с рамками.
+# Промежуточные изображения пишутся в буферы арены процесса и переиспользуются для следующих частей
+def detect_objects(image, arena=None):
+    arena = arena or process_arena()
+    tile_height, tile_width = image.shape[:2]
+    sharpened_image = cv2.filter2D(image, -1, SHARPEN_KERNEL, dst=arena.get("sharpened", image.shape))
+
+    gray_image = cv2.cvtColor(sharpened_image, cv2.COLOR_BGR2GRAY, dst=arena.get("gray", (tile_height, tile_width)))
+    blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0, dst=arena.get("blurred", (tile_height, tile_width)))
+    _, binary_image = cv2.threshold(blurred_image, DETECTION_THRESHOLD, 255, cv2.THRESH_BINARY,
+                                    dst=arena.get("binary", (tile_height, tile_width)))
+    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    space_objects = []
+    boxes = []
+
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        x, y, width, height = cv2.boundingRect(contour)
+        center_x = x + width / 2
+        center_y = y + height / 2
+        brightness = int(np.sum(gray_image[y:y + height, x:x + width]))
+        object_type = classified(area, brightness)
+        space_object = {
+            "x": center_x,
+            "y": center_y,
+            "brightness": brightness,
+            "type": object_type,
+            "size": width * height
+        }
+        space_objects.append(space_object)
+        boxes.append((x, y, width, height))
+    return space_objects, boxes
+
+# Переводит объект из координат фрагмента в координаты кадра и в типы, понятные JSON
+def to_record(space_object, x0, y0):
+    return {
+        "x": float(space_object["x"]) + x0,
+        "y": float(space_object["y"]) + y0,
+        "brightness": int(space_object["brightness"]),
+        "type": space_object["type"],
+        "size": int(space_object["size"])
+    }
+
+# Записывает список объектов в текстовый файл
+def write_objects(file_path, space_objects):
+    with open(file_path, "w", encoding="utf-8") as file:
+        for obj in space_objects:
+            file.write(f"Координаты: ({obj['x']}, {obj['y']}); Яркость: {obj['brightness']}; Размер: {obj['size']}; Тип: {obj['type']}\n")
+
+# Классифицирует объекты на основе площади и яркости
+def classified(area, brightness):
+    return {
+        area < 10 and brightness > 100: "звезда",
+        area < 10 and brightness > 50: "комета",
+        area < 10 and brightness > 0: "планета",
+        area > 10000 and brightness > 1000000: "галактика",
+        area < 10000 and brightness > 1000000: "квазар",
+        area >= 10 and brightness > 0: "звезда"
+    }[True]
+
+# Возвращает границы частей изображения (номер, y0, y1, x0, x1) в порядке split_image
+def tile_windows(height, width, num_parts):
+    part_width = (width // num_parts) + 1
+    part_height = (height // num_parts) + 1
+    windows = []
+    number = 0
+    for chunk_width in range(num_parts):
+        for chunk_height in range(num_parts):
+            number += 1
+            y0 = chunk_height * part_height
+            x0 = chunk_width * part_width
+            windows.append((number, y0, min(y0 + part_height, height), x0, min(x0 + part_width, width)))
+    return windows
+
+# Предварительный просмотр кадра: по уменьшенной копии находит части, где ни один пиксель
+# не может пройти порог обнаружения. Оценка сверху: после фильтра резкости канал пикселя
+# не больше 9 * максимум - 8 * минимум соседей, серый цвет не ярче самого яркого канала,
+# а гауссово размытие не ярче максимума по окрестности 5x5. Возвращает номера частей,
+# которые нужно обрабатывать полностью.
+def prescan_tiles(image, windows, threshold=DETECTION_THRESHOLD, block=PRESCAN_BLOCK):
+    # Максимум и минимум по блокам block x block: морфология с якорем в углу блока,
+    # затем берется каждый block-й пиксель; неполные блоки на краю учитываются сами
+    kernel = np.ones((block, block), np.uint8)
+    block_max = cv2.dilate(image, kernel, anchor=(0, 0))[::block, ::block].max(axis=2).astype(np.int32)
+    block_min = cv2.erode(image, kernel, anchor=(0, 0))[::block, ::block].min(axis=2)
+    # Соседи пикселя на краю блока лежат в соседнем блоке
+    neighbour_min = cv2.erode(block_min, np.ones((3, 3), np.uint8)).astype(np.int32)
+    bound = np.clip(9 * block_max - 8 * neighbour_min, 0, 255).astype(np.uint8)
+    bound = cv2.dilate(bound, np.ones((3, 3), np.uint8))
+
+    busy = []
+    for number, y0, y1, x0, x1 in windows:
+        if y1 <= y0 or x1 <= x0:
+            continue
+        # Запас в единицу на округление при переводе в серый и размытии
+        if bound[y0 // block:(y1 - 1) // block + 1, x0 // block:(x1 - 1) // block + 1].max() >= threshold:
+            busy.append(number)
+    return set(busy)
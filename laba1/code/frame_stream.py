@@ -0,0 +1,218 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from detection import detect_objects, prescan_tiles, tile_windows, to_record
+from tile_planner import plan_tiles
+from scratch_arena import peak_rss_mb
+
+# Потоковая обработка видео или пронумерованной последовательности кадров.
+# Поток-производитель декодирует кадры в кольцевой буфер заранее выделенных массивов,
+# части кадров обрабатываются в пуле процессов, и пока идет анализ одного кадра,
+# следующие уже декодируются и отправляются в пул. Результат - поток каталогов по кадрам.
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".m4v", ".webm")
+IMAGE_EXTENSIONS = (".tif", ".tiff", ".jpg", ".jpeg", ".png")
+
+
+# Номер кадра из имени файла: frame_0012.png -> 12
+def frame_number(path):
+    numbers = re.findall(r"\d+", os.path.basename(path))
+    return int(numbers[-1]) if numbers else -1
+
+
+# Список файлов последовательности: каталог, маска (frames/*.png) или шаблон printf (frame_%04d.png)
+def sequence_files(source):
+    if os.path.isdir(source):
+        files = [os.path.join(source, name) for name in os.listdir(source)]
+    elif "%" in source:
+        # Последовательность может начинаться с 0 или с 1
+        number = 0 if os.path.exists(source % 0) else 1
+        files = []
+        while os.path.exists(source % number):
+            files.append(source % number)
+            number += 1
+        return files
+    else:
+        files = glob.glob(source)
+    files = [path for path in files if path.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(files, key=lambda path: (frame_number(path), path))
+
+
+# Источник кадров: для видео читает прямо в переданный массив, для файлов копирует
+class FrameSource:
+    def __init__(self, source):
+        self.source = source
+        self.capture = None
+        self.files = []
+        if source.lower().endswith(VIDEO_EXTENSIONS):
+            self.capture = cv2.VideoCapture(source)
+            if not self.capture.isOpened():
+                raise ValueError(f"Не удалось открыть видео {source}")
+        else:
+            self.files = sequence_files(source)
+            if not self.files:
+                raise ValueError(f"Не найдено кадров по пути {source}")
+
+    # Размер кадра (высота, ширина, каналы) по первому кадру
+    def frame_shape(self):
+        if self.capture is not None:
+            width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            return height, width, 3
+        return cv2.imread(self.files[0]).shape
+
+    # Записывает очередной кадр в buffer; False, если кадры закончились
+    def read_into(self, buffer, index):
+        if self.capture is not None:
+            ok, frame = self.capture.read(buffer)
+            if ok and frame is not buffer:
+                np.copyto(buffer, frame)
+            return ok
+        if index >= len(self.files):
+            return False
+        frame = cv2.imread(self.files[index])
+        if frame is None or frame.shape != buffer.shape:
+            logging.warning("Кадр %s пропущен: не читается или другого размера", self.files[index])
+            buffer[:] = 0
+        else:
+            np.copyto(buffer, frame)
+        return True
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+# Кольцевой буфер: свободные массивы ждут в free, заполненные кадры - в filled
+class FrameRing:
+    def __init__(self, shape, size):
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(size)]
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for slot in range(size):
+            self.free.put(slot)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+
+# Поток-производитель: декодирует кадры, пока они не кончатся или не придет stop_event
+def decode_frames(source, ring, stop_event, stats):
+    index = 0
+    try:
+        while not stop_event.is_set():
+            started = time.perf_counter()
+            slot = ring.free.get()
+            stats["decode_wait"] += time.perf_counter() - started
+            if stop_event.is_set():
+                break
+            if not source.read_into(ring.buffers[slot], index):
+                ring.free.put(slot)
+                break
+            ring.filled.put((index, slot))
+            index += 1
+    finally:
+        ring.filled.put(None)
+
+
+# Выполняется в процессе пула: поиск объектов на одной части кадра
+def detect_tile(tile, x0, y0):
+    space_objects, _ = detect_objects(tile)
+    return [to_record(obj, x0, y0) for obj in space_objects]
+
+
+# Обрабатывает поток кадров и по порядку выдает (номер кадра, список объектов)
+def stream_catalogs(source, workers=None, num_parts=None, ring_size=None, stats=None):
+    height, width, channels = source.frame_shape()
+    plan = plan_tiles((height, width, channels), num_parts=num_parts, workers=workers)
+    windows = tile_windows(height, width, plan["num_parts"])
+    # В работе одновременно до двух кадров на процесс, плюс кадр, который декодируется
+    depth = max(2, 2 * plan["workers"] // len(windows))
+    ring = FrameRing((height, width, channels), ring_size or depth + 2)
+    stats = stats if stats is not None else {}
+    stats.update(frames=0, objects=0, decode_wait=0.0, fps=0.0, tiles=0, skipped_tiles=0)
+    stop_event = threading.Event()
+    producer = threading.Thread(target=decode_frames, args=(source, ring, stop_event, stats), daemon=True)
+    producer.start()
+
+    in_flight = deque()  # [(номер кадра, ячейка буфера, futures частей)]
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=plan["workers"]) as executor:
+            finished = False
+            while not finished or in_flight:
+                # Досылаем кадры в пул, пока очередь в работе не заполнена
+                while not finished and len(in_flight) < depth:
+                    item = ring.filled.get()
+                    if item is None:
+                        finished = True
+                        break
+                    index, slot = item
+                    frame = ring.buffers[slot]
+                    busy = prescan_tiles(frame, windows)
+                    futures = [executor.submit(detect_tile, frame[y0:y1, x0:x1], x0, y0)
+                               for number, y0, y1, x0, x1 in windows if number in busy]
+                    stats["tiles"] += len(windows)
+                    stats["skipped_tiles"] += len(windows) - len(busy)
+                    in_flight.append((index, slot, futures))
+                if not in_flight:
+                    break
+
+                index, slot, futures = in_flight.popleft()
+                objects = []
+                for future in futures:
+                    objects.extend(future.result())
+                ring.release(slot)
+
+                stats["frames"] += 1
+                stats["objects"] += len(objects)
+                stats["fps"] = stats["frames"] / (time.perf_counter() - started)
+                yield index, objects
+    finally:
+        stop_event.set()
+        # Освобождаем ячейку, если производитель ждет свободный буфер
+        ring.free.put(0)
+        producer.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск объектов в видео или последовательности кадров")
+    parser.add_argument("source", help="видеофайл, каталог кадров, маска (*.png) или шаблон (frame_%%04d.png)")
+    parser.add_argument("--output", default=os.path.join("image_result", "stream"))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--parts", type=int, default=None)
+    parser.add_argument("--report-every", type=int, default=25, help="как часто печатать скорость, кадров")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    os.makedirs(args.output, exist_ok=True)
+    source = FrameSource(args.source)
+    stats = {}
+    try:
+        with open(os.path.join(args.output, "catalog.jsonl"), "w", encoding="utf-8") as catalog:
+            for index, objects in stream_catalogs(source, args.workers, args.parts, stats=stats):
+                catalog.write(json.dumps({"frame": index, "objects": objects}, ensure_ascii=False) + "\n")
+                if stats["frames"] % args.report_every == 0:
+                    print(f"Кадров: {stats['frames']}, {stats['fps']:.2f} кадр/с")
+    finally:
+        source.close()
+    print(f"Обработано кадров: {stats['frames']}, объектов: {stats['objects']}, "
+          f"скорость: {stats['fps']:.2f} кадр/с, ожидание буфера декодером: {stats['decode_wait']:.2f} с, "
+          f"пропущено пустых частей: {stats['skipped_tiles']} из {stats['tiles']}")
+    print(f"Пиковая память: основной процесс {peak_rss_mb()} МБ, процессы пула {peak_rss_mb(children=True)} МБ")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,12 @@ import numpy as np
 from PIL import ImageFont, ImageDraw, Image
 import multiprocessing as mp
 import os
+import logging
 from tkinter import Tk, messagebox, filedialog, Text, Button, Label, ttk, END
 
+from tile_planner import plan_tiles
+from scratch_arena import process_arena, peak_rss_mb
+
 # Функция классификации объекта на основе площади и яркости
 def classify_object(area, brightness):
     if area < 10 and brightness > 100:
@@ -22,16 +26,19 @@ def classify_object(area, brightness):
 
 # Функция анализа одного фрагмента изображения
 def analyse_fragment(image, number, output_directory, font_path):
-    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
-    _, binary_image = cv2.threshold(blurred_image, 200, 255, cv2.THRESH_BINARY)
+    # Процессы пула обрабатывают много фрагментов, промежуточные массивы берем из арены процесса
+    arena = process_arena()
+    shape = image.shape[:2]
+    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=arena.get("gray", shape))
+    blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0, dst=arena.get("blurred", shape))
+    _, binary_image = cv2.threshold(blurred_image, 200, 255, cv2.THRESH_BINARY, dst=arena.get("binary", shape))
     contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     space_objects = []
 
     for contour in contours:
         area = cv2.contourArea(contour)
         x, y, width, height = cv2.boundingRect(contour)
-        brightness = np.sum(gray_image[y:y + height, x:x + width])
+        brightness = int(np.sum(gray_image[y:y + height, x:x + width]))
         object_type = classify_object(area, brightness)
 
         space_objects.append({
@@ -49,26 +56,31 @@ def analyse_fragment(image, number, output_directory, font_path):
     return space_objects
 
 # Основная функция параллельной обработки изображений
-def process_image(file_path, output_directory, num_processes, log_area, progress_bar):
+# num_parts и num_processes можно задать вручную, иначе их подбирает планировщик
+def process_image(file_path, output_directory, log_area, progress_bar, num_parts=None, num_processes=None):
     image = cv2.imread(file_path)
     height, width, _ = image.shape
     font_path = "/Library/Fonts/Arial.ttf"  # Путь к шрифту Arial в macOS
 
+    plan = plan_tiles(image.shape, image.dtype.itemsize, num_parts=num_parts, workers=num_processes)
+    num_parts = plan["num_parts"]
+    log_area.insert(END, f"{os.path.basename(file_path)}: сетка {num_parts}x{num_parts}, процессов {plan['workers']}\n")
+
     # Определение размеров фрагментов
-    fragment_height = height // num_processes
-    fragment_width = width // num_processes
+    fragment_height = height // num_parts
+    fragment_width = width // num_parts
     fragments = []
 
     # Разделение изображения на фрагменты
-    for i in range(num_processes):
-        for j in range(num_processes):
+    for i in range(num_parts):
+        for j in range(num_parts):
             y_start = i * fragment_height
             x_start = j * fragment_width
             fragment = image[y_start:y_start + fragment_height, x_start:x_start + fragment_width]
-            fragments.append((fragment, i * num_processes + j))
+            fragments.append((fragment, i * num_parts + j))
 
     # Параллельная обработка фрагментов
-    with mp.Pool(num_processes) as pool:
+    with mp.Pool(plan["workers"]) as pool:
         results = pool.starmap(analyse_fragment, [(frag[0], frag[1], output_directory, font_path) for frag in fragments])
 
     # Сбор и запись статистики
@@ -78,7 +90,7 @@ def process_image(file_path, output_directory, num_processes, log_area, progress
             for obj in objects:
                 file.write(f"  Координаты: ({obj['x']:.2f}, {obj['y']:.2f}), Яркость: {obj['brightness']}, "
                            f"Размер: {obj['size']}, Тип: {obj['type']}\n")
-    log_area.insert(END, f"Обработка {file_path} завершена.\n")
+    log_area.insert(END, f"Обработка {file_path} завершена. Пиковая память процесса пула: {peak_rss_mb(children=True)} МБ\n")
     progress_bar.step(100 / len(fragments))
 
 # Функция для выбора и обработки изображений
@@ -99,7 +111,7 @@ def select_and_process_images(log_area, progress_bar):
         log_area.insert(END, "Начало обработки изображений...\n")
 
         for file_path in file_paths:
-            process_image(file_path, output_directory, num_processes=4, log_area=log_area, progress_bar=progress_bar)
+            process_image(file_path, output_directory, log_area=log_area, progress_bar=progress_bar)
         
         messagebox.showinfo("Готово", "Анализ завершен. Результаты сохранены в папке 'image_result'.")
         log_area.insert(END, "Анализ завершен.\n")
@@ -137,4 +149,5 @@ def create_gui():
     root.mainloop()
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
     create_gui()
\ No newline at end of file
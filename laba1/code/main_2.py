@@ -1,6 +1,7 @@
+import hashlib
 import os
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageTk
 import numpy as np
@@ -8,9 +9,15 @@ from skimage import measure, morphology
 from skimage.filters import threshold_otsu
 import multiprocessing
 from functools import partial
+import logging
+
+from tile_planner import plan_workers, available_cores
+from catalog_index import CatalogIndex
+from result_view import ResultStore, VirtualTable
 
 # Константы
 RESULTS_FOLDER = 'results'
+MAX_WORKERS = None  # Число процессов на изображение; None - подобрать по ядрам и памяти
 
 def create_results_folder():
     """Создает папку для хранения результатов, если ее нет."""
@@ -105,14 +112,31 @@ def analyze_image(image_path):
         # Функция для параллельной обработки каждого объекта
         process_obj_partial = partial(process_object, image_array=img_array, img_name=img_name)
 
-        # Обрабатываем каждый объект параллельно
-        with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+        # Обрабатываем каждый объект параллельно; каждая задача получает копию изображения
+        workers = plan_workers(len(regions), img_array.nbytes, workers=MAX_WORKERS)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
             results = list(executor.map(process_obj_partial, [region.slice for region in regions]))
 
+        # Пространственный индекс по центрам областей в координатах всего изображения
+        index = CatalogIndex(
+            [region.centroid[1] for region in regions],
+            [region.centroid[0] for region in regions],
+            {
+                'brightness': [stat['object_brightness'] for stat in results],
+                'type': [stat['object_type'] for stat in results],
+            })
+        # Одинаковые имена файлов из разных папок не должны затирать индексы друг друга
+        path_key = hashlib.md5(os.path.abspath(image_path).encode()).hexdigest()[:8]
+        index_path = os.path.join(img_result_folder, f'catalog_index_{path_key}.npz')
+        index.save(index_path)
+
         return {
             'filename': img_name,
+            'path': image_path,
             'objects_analyzed': len(results),
-            'objects_stats': results
+            'objects_stats': results,
+            'index_path': index_path,
+            'index': index  # уже построенный индекс, чтобы не читать его обратно с диска
         }
 
     except Exception as e:
@@ -124,19 +148,56 @@ class AstroDataAnalyzerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Astro Data Analyzer")
-        self.root.geometry("600x400")
+        self.root.geometry("600x620")
 
         # Кнопка загрузки изображений
         self.load_button = tk.Button(root, text="Load Images", command=self.load_images)
         self.load_button.pack(pady=10)
 
-        # Список для отображения результатов анализа
-        self.result_text = tk.Text(root, wrap=tk.WORD, height=15, width=70)
-        self.result_text.pack(pady=10)
+        # Поиск объектов рядом с точкой: "x y радиус"
+        self.search_frame = tk.Frame(root)
+        self.search_frame.pack(pady=5)
+        tk.Label(self.search_frame, text="x y radius:").pack(side=tk.LEFT)
+        self.search_entry = tk.Entry(self.search_frame, width=20)
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_button = tk.Button(self.search_frame, text="Find Nearby", command=self.find_nearby)
+        self.search_button.pack(side=tk.LEFT)
+
+        # Фильтр по типу и яркости
+        self.filter_frame = tk.Frame(root)
+        self.filter_frame.pack(pady=5)
+        tk.Label(self.filter_frame, text="Type:").pack(side=tk.LEFT)
+        self.type_box = ttk.Combobox(self.filter_frame, values=["All"], state="readonly", width=10)
+        self.type_box.current(0)
+        self.type_box.pack(side=tk.LEFT, padx=5)
+        tk.Label(self.filter_frame, text="Brightness from:").pack(side=tk.LEFT)
+        self.min_brightness_entry = tk.Entry(self.filter_frame, width=8)
+        self.min_brightness_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(self.filter_frame, text="to:").pack(side=tk.LEFT)
+        self.max_brightness_entry = tk.Entry(self.filter_frame, width=8)
+        self.max_brightness_entry.pack(side=tk.LEFT, padx=5)
+        self.filter_button = tk.Button(self.filter_frame, text="Apply", command=self.refresh_table)
+        self.filter_button.pack(side=tk.LEFT)
+        self.reset_button = tk.Button(self.filter_frame, text="Reset", command=self.reset_filters)
+        self.reset_button.pack(side=tk.LEFT, padx=5)
+
+        # Журнал анализа
+        self.result_text = tk.Text(root, wrap=tk.WORD, height=5, width=70)
+        self.result_text.pack(pady=5)
+
+        # Таблица объектов: в виджете только видимые строки, данные в ResultStore
+        self.store = ResultStore()
+        self.table = VirtualTable(root, self.store, visible_rows=15)
+        self.table.on_sort = self.refresh_table
+        self.table.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
+        self.table_status = tk.Label(root, text="No objects")
+        self.table_status.pack()
+        self.nearby_rows = None  # строки, найденные поиском по координатам
 
         # Пул процессов для параллельной обработки
-        self.executor = ProcessPoolExecutor(max_workers=multiprocessing.cpu_count())
+        self.executor = ProcessPoolExecutor(max_workers=MAX_WORKERS or available_cores())
         self.images = []
+        self.indexes = {}  # {полный путь к файлу: CatalogIndex}
 
     def load_images(self):
         # Открываем диалоговое окно выбора файлов
@@ -147,6 +208,10 @@ class AstroDataAnalyzerApp:
         # Очищаем список изображений и текстовое поле с результатами
         self.images = image_paths
         self.result_text.delete(1.0, tk.END)
+        self.store.clear()
+        self.indexes.clear()
+        self.nearby_rows = None
+        self.refresh_table()
 
         # Запускаем параллельную обработку изображений
         self.start_analysis()
@@ -168,19 +233,63 @@ class AstroDataAnalyzerApp:
 
         messagebox.showinfo("Analysis Complete", "Analysis of all images is complete.")
 
+    def find_nearby(self):
+        try:
+            x, y, radius = (float(value) for value in self.search_entry.get().split())
+        except ValueError:
+            messagebox.showwarning("Search", "Enter three numbers: x y radius")
+            return
+
+        # Номера строк индекса совпадают с порядком объектов файла в таблице
+        found = [self.store.offsets[path] + index.query_radius(x, y, radius)
+                 for path, index in self.indexes.items()]
+        rows = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        # Внутри файла строки уже по расстоянию; общий порядок - ближайшие из всех файлов первыми
+        columns = self.store.columns
+        distances = np.hypot(columns["center_x"][rows] - x, columns["center_y"][rows] - y)
+        self.nearby_rows = rows[np.argsort(distances, kind="stable")]
+        self.result_text.insert(tk.END, f"{len(self.nearby_rows)} objects within {radius} px of ({x}, {y})\n")
+        self.refresh_table()
+
+    def reset_filters(self):
+        self.type_box.current(0)
+        self.min_brightness_entry.delete(0, tk.END)
+        self.max_brightness_entry.delete(0, tk.END)
+        self.search_entry.delete(0, tk.END)
+        self.nearby_rows = None
+        self.refresh_table()
+
+    def refresh_table(self):
+        def number(entry):
+            try:
+                return float(entry.get())
+            except ValueError:
+                return None
+
+        object_type = self.type_box.get()
+        rows = self.store.view(
+            object_type=None if object_type == "All" else object_type,
+            min_brightness=number(self.min_brightness_entry),
+            max_brightness=number(self.max_brightness_entry),
+            sort_by=self.table.sort_by,
+            descending=self.table.descending,
+            rows=self.nearby_rows)
+        self.table.set_rows(rows)
+        self.table_status.config(text=f"Shown {len(rows)} of {len(self.store)} objects")
+
     def display_result(self, result):
-        # Вывод результатов анализа в текстовое поле
-        self.result_text.insert(tk.END, f"Filename: {result['filename']}\n")
-        self.result_text.insert(tk.END, f"Objects Analyzed: {result['objects_analyzed']}\n\n")
-        for obj_stat in result['objects_stats']:
-            self.result_text.insert(tk.END, f" Object Brightness: {obj_stat['object_brightness']}\n")
-            self.result_text.insert(tk.END, f" Object Center of Mass: {obj_stat['object_center']}\n")
-            self.result_text.insert(tk.END, f" Object Type: {obj_stat['object_type']}\n")
-        self.result_text.insert(tk.END, "\n")
+        # Объекты попадают в таблицу, в текстовое поле - только итог по файлу
+        index = result['index']
+        self.indexes[result['path']] = index
+        self.store.append(result, (index.x, index.y))
+        self.result_text.insert(tk.END, f"Filename: {result['filename']}, Objects Analyzed: {result['objects_analyzed']}\n")
+        self.type_box.config(values=["All"] + self.store.types())
+        self.refresh_table()
 
 
 # Запуск приложения
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
     root = tk.Tk()
     app = AstroDataAnalyzerApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import tkinter as tk
+from tkinter import ttk
+
+import numpy as np
+
+# Табличный просмотр результатов анализа для большого числа объектов.
+# Данные хранятся по столбцам в массивах numpy (ResultStore), сортировка и фильтрация
+# выполняются над массивами, а таблица (VirtualTable) держит в Treeview только видимые строки.
+
+COLUMNS = ("file", "type", "brightness", "center_x", "center_y")
+HEADINGS = {
+    "file": "File",
+    "type": "Type",
+    "brightness": "Brightness",
+    "center_x": "Center X",
+    "center_y": "Center Y",
+}
+
+
+class ResultStore:
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.chunks = {name: [] for name in COLUMNS}
+        self.merged = {name: np.empty(0, dtype=object if name in ("file", "type") else np.float64)
+                       for name in COLUMNS}
+        self.changed = False  # есть куски, еще не склеенные в merged
+        self.offsets = {}  # {полный путь к файлу: номер первой строки файла}
+        self.size = 0
+
+    # Добавляет результаты analyze_image одного изображения; positions - координаты
+    # объектов на всем изображении (x, y), иначе берется центр масс внутри объекта
+    def append(self, result, positions=None):
+        stats = result['objects_stats']
+        if positions is None:
+            positions = ([stat['object_center'][0] for stat in stats], [stat['object_center'][1] for stat in stats])
+        count = len(stats)
+        self.offsets[result['path']] = self.size
+        self.chunks["file"].append(np.full(count, result['filename'], dtype=object))
+        self.chunks["type"].append(np.array([stat['object_type'] for stat in stats], dtype=object))
+        self.chunks["brightness"].append(np.array([stat['object_brightness'] for stat in stats], dtype=np.float64))
+        self.chunks["center_x"].append(np.asarray(positions[0], dtype=np.float64))
+        self.chunks["center_y"].append(np.asarray(positions[1], dtype=np.float64))
+        self.size += count
+        self.changed = True
+
+    # Столбцы целиком. Куски склеиваются при первом запросе после append, а не при каждом
+    # добавлении: загрузка N изображений не копирует уже загруженные строки N раз
+    @property
+    def columns(self):
+        if self.changed:
+            for name in COLUMNS:
+                self.merged[name] = np.concatenate([self.merged[name]] + self.chunks[name])
+                self.chunks[name] = []
+            self.changed = False
+        return self.merged
+
+    def types(self):
+        return sorted(set(self.columns["type"].tolist()))
+
+    # Номера строк, прошедших фильтр, в нужном порядке. rows - только эти строки и в их
+    # порядке (например, ближайшие первыми), если не задана сортировка по столбцу
+    def view(self, object_type=None, min_brightness=None, max_brightness=None,
+             sort_by=None, descending=False, rows=None):
+        mask = np.ones(self.size, dtype=bool)
+        if object_type:
+            mask &= self.columns["type"] == object_type
+        if min_brightness is not None:
+            mask &= self.columns["brightness"] >= min_brightness
+        if max_brightness is not None:
+            mask &= self.columns["brightness"] <= max_brightness
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            indices = rows[mask[rows]]
+        else:
+            indices = np.nonzero(mask)[0]
+        if sort_by:
+            order = np.argsort(self.columns[sort_by][indices], kind="stable")
+            if descending:
+                order = order[::-1]
+            indices = indices[order]
+        return indices
+
+    def row(self, index):
+        return (
+            self.columns["file"][index],
+            self.columns["type"][index],
+            f"{self.columns['brightness'][index]:.2f}",
+            f"{self.columns['center_x'][index]:.1f}",
+            f"{self.columns['center_y'][index]:.1f}",
+        )
+
+
+class VirtualTable(tk.Frame):
+    def __init__(self, master, store, visible_rows=15, **kwargs):
+        super().__init__(master, **kwargs)
+        self.store = store
+        self.visible_rows = visible_rows
+        self.indices = np.empty(0, dtype=np.int64)
+        self.top = 0
+        self.sort_by = None
+        self.descending = False
+        self.on_sort = None
+
+        self.tree = ttk.Treeview(self, columns=COLUMNS, show="headings", height=visible_rows, selectmode="browse")
+        for name in COLUMNS:
+            self.tree.heading(name, text=HEADINGS[name], command=lambda column=name: self.sort(column))
+            self.tree.column(name, width=110 if name == "file" else 90, anchor=tk.W if name in ("file", "type") else tk.E)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # Строки Treeview создаются один раз и дальше только переписываются
+        self.items = [self.tree.insert("", tk.END, values=()) for _ in range(visible_rows)]
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_to(self.top - 3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_to(self.top + 3))
+        self.tree.bind("<Next>", lambda event: self.scroll_to(self.top + self.visible_rows))
+        self.tree.bind("<Prior>", lambda event: self.scroll_to(self.top - self.visible_rows))
+
+    def set_rows(self, indices):
+        self.indices = indices
+        self.scroll_to(0)
+
+    def sort(self, column):
+        self.descending = not self.descending if self.sort_by == column else False
+        self.sort_by = column
+        if self.on_sort:
+            self.on_sort()
+
+    def scroll_to(self, top):
+        self.top = max(0, min(int(top), len(self.indices) - self.visible_rows))
+        visible = self.indices[self.top:self.top + self.visible_rows]
+        for item, index in zip(self.items, visible):
+            self.tree.item(item, values=self.store.row(index))
+        for item in self.items[len(visible):]:
+            self.tree.item(item, values=())
+        total = max(len(self.indices), 1)
+        self.scrollbar.set(self.top / total, min((self.top + self.visible_rows) / total, 1.0))
+        return "break"
+
+    def on_scrollbar(self, action, value, unit=None):
+        if action == tk.MOVETO:
+            self.scroll_to(float(value) * len(self.indices))
+        elif action == tk.SCROLL:
+            step = self.visible_rows if unit == tk.PAGES else 1
+            self.scroll_to(self.top + int(value) * step)
+
+    def on_wheel(self, event):
+        return self.scroll_to(self.top - int(event.delta / 120) * 3)
@@ -0,0 +1,70 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Промежуточные массивы для обработки частей изображения. Процесс, который разбирает
+# много частей подряд, берет буферы из арены по имени шага и форме части, и OpenCV
+# пишет в них через dst=, вместо того чтобы выделять новые массивы на каждую часть.
+
+MAX_SHAPES = 16  # сколько разных форм частей держать одновременно
+
+
+class ScratchArena:
+    def __init__(self, max_shapes=MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self.buffers = OrderedDict()  # {(форма, тип): {имя шага: массив}}
+        self.hits = 0
+        self.misses = 0
+
+    # Буфер для шага name; содержимое не очищается, его перезапишет OpenCV
+    def get(self, name, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        group = self.buffers.get(key)
+        if group is None:
+            group = self.buffers[key] = {}
+            # Формы, которые давно не встречались, освобождаем
+            while len(self.buffers) > self.max_shapes:
+                self.buffers.popitem(last=False)
+        else:
+            self.buffers.move_to_end(key)
+        buffer = group.get(name)
+        if buffer is None:
+            self.misses += 1
+            buffer = group[name] = np.empty(shape, dtype=dtype)
+        else:
+            self.hits += 1
+        return buffer
+
+    def nbytes(self):
+        return sum(buffer.nbytes for group in self.buffers.values() for buffer in group.values())
+
+    def summary(self):
+        return (f"буферов переиспользовано {self.hits}, выделено {self.misses}, "
+                f"занято {self.nbytes() / 2 ** 20:.1f} МБ")
+
+
+_process_arena = None
+
+
+# Арена текущего процесса: создается при первом обращении и живет, пока жив процесс
+def process_arena():
+    global _process_arena
+    if _process_arena is None:
+        _process_arena = ScratchArena()
+    return _process_arena
+
+
+# Пиковый размер резидентной памяти в МБ; children=True - максимум по завершенным дочерним процессам
+def peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # На macOS ru_maxrss в байтах, на Linux - в килобайтах
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss * scale / 2 ** 20, 1)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from catalog_index import CatalogIndex, cross_match, read_text_catalog
+from detection import write_objects
+
+
+def brute_radius(x, y, px, py, radius):
+    distances = np.hypot(x - px, y - py)
+    inside = np.flatnonzero(distances <= radius)
+    return inside[np.argsort(distances[inside], kind="stable")]
+
+
+def test_queries_match_brute_force():
+    rng = np.random.default_rng(1)
+    x, y = rng.uniform(0, 1000, 500), rng.uniform(0, 500, 500)
+    index = CatalogIndex(x, y)
+    for px, py, radius in [(500, 250, 40), (0, 0, 100), (990, 10, 5), (-50, -50, 20)]:
+        assert np.array_equal(index.query_radius(px, py, radius), brute_radius(x, y, px, py, radius))
+    box = index.query_box(100, 100, 300, 200)
+    expected = np.flatnonzero((x >= 100) & (x <= 300) & (y >= 100) & (y <= 200))
+    assert sorted(box) == list(expected)
+    nearest = index.query_nearest(2000, 2000, k=3)
+    assert list(nearest) == list(np.argsort(np.hypot(x - 2000, y - 2000))[:3])
+
+
+def test_empty_index():
+    index = CatalogIndex([], [])
+    assert len(index.query_box(0, 0, 10, 10)) == 0
+    assert len(index.query_nearest(0, 0, k=5)) == 0
+
+
+def test_save_load_and_text_catalog(tmp_path):
+    objects = [{"x": 10.5, "y": 20.0, "brightness": 300, "type": "звезда", "size": 4},
+               {"x": 12.0, "y": 22.5, "brightness": 2000000, "type": "квазар", "size": 900},
+               {"x": 400.0, "y": 5.0, "brightness": 60, "type": "комета", "size": 2}]
+    write_objects(tmp_path / "objects.txt", objects)
+    index = CatalogIndex.from_objects(read_text_catalog(tmp_path / "objects.txt"))
+    index.save(tmp_path / "index.npz")
+
+    loaded = CatalogIndex.load(tmp_path / "index.npz")
+    assert loaded.rows(loaded.query_nearest(11, 21, k=2)) == [
+        {"x": 10.5, "y": 20.0, "brightness": 300.0, "type": "звезда", "size": 4.0},
+        {"x": 12.0, "y": 22.5, "brightness": 2000000.0, "type": "квазар", "size": 900.0},
+    ]
+    shifted = CatalogIndex([11.0, 401.0], [20.0, 5.0])
+    assert [(i, j) for i, j, _ in cross_match(shifted, loaded, radius=2)] == [(0, 0), (1, 2)]
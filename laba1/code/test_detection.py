@@ -0,0 +1,37 @@
+import numpy as np
+
+from detection import detect_objects, prescan_tiles, tile_windows
+
+
+def sky(height, width, stars, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(8, 13, (height, width, 3), dtype=np.uint8)
+    for y, x, size in stars:
+        image[y:y + size, x:x + size] = 255
+    return image
+
+
+def test_windows_cover_the_image_once():
+    height, width = 301, 457
+    covered = np.zeros((height, width), np.int32)
+    windows = tile_windows(height, width, 4)
+    for _, y0, y1, x0, x1 in windows:
+        covered[y0:y1, x0:x1] += 1
+    assert len(windows) == 16 and (covered == 1).all()
+
+
+def test_prescan_keeps_every_tile_with_objects():
+    # Звезды у границ частей и в углу, часть мелкие, часть крупные
+    image = sky(480, 640, [(10, 10, 2), (118, 158, 4), (240, 320, 1), (470, 630, 6), (300, 50, 12)])
+    windows = tile_windows(*image.shape[:2], 4)
+    busy = prescan_tiles(image, windows)
+    detected = {number for number, y0, y1, x0, x1 in windows
+                if detect_objects(np.ascontiguousarray(image[y0:y1, x0:x1]))[0]}
+    assert detected and detected <= busy
+    # Пустое небо можно пропустить
+    assert len(busy) < len(windows)
+
+
+def test_empty_sky_skips_every_tile():
+    image = sky(256, 256, [])
+    assert prescan_tiles(image, tile_windows(256, 256, 3)) == set()
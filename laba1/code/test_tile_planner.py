@@ -0,0 +1,35 @@
+import pytest
+
+from tile_planner import MIN_TILE_SIDE, load_share, plan_tiles, plan_workers
+
+GB = 1024 ** 3
+
+
+@pytest.mark.parametrize("shape", [(4000, 6000, 3), (1080, 1920, 3), (400, 400, 3)])
+@pytest.mark.parametrize("cores", [2, 4, 6, 8, 12])
+@pytest.mark.parametrize("memory", [0.5 * GB, 8 * GB])
+def test_tiles_split_evenly_between_workers(shape, cores, memory):
+    plan = plan_tiles(shape, cores=cores, memory=memory)
+    parts, workers = plan["num_parts"], plan["workers"]
+    assert 1 <= workers <= cores
+    assert parts * parts % workers == 0
+    assert min(shape[:2]) // parts >= MIN_TILE_SIDE
+    assert plan["tile_bytes"] * workers <= plan["budget_bytes"]
+
+
+def test_small_image_still_uses_several_workers():
+    plan = plan_tiles((400, 400, 3), cores=4, memory=8 * GB)
+    assert plan["workers"] > 1
+
+
+def test_manual_values_are_kept():
+    plan = plan_tiles((1080, 1920, 3), cores=8, memory=8 * GB, num_parts=3, workers=5)
+    assert (plan["num_parts"], plan["workers"]) == (3, 5)
+
+
+def test_plan_workers_balances_waves():
+    # 9 задач на 8 ядрах - все равно две волны, поэтому хватает 5 процессов
+    assert plan_workers(9, cores=8, memory=8 * GB) == 5
+    assert plan_workers(1, cores=8, memory=8 * GB) == 1
+    assert plan_workers(100, cores=8, memory=8 * GB) == 8
+    assert load_share(9, 8) == 9 / 16
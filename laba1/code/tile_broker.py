@@ -0,0 +1,309 @@
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from detection import detect_objects, prescan_tiles, tile_windows, to_record, write_objects
+from tile_planner import plan_tiles
+from catalog_index import CatalogIndex
+from scratch_arena import process_arena, peak_rss_mb
+
+# Распределенная обработка: координатор делит кадры на части и раздает их по TCP,
+# рабочие процессы на любых машинах забирают задания, получают пиксели фрагмента
+# и возвращают найденные объекты. Задание, не вернувшееся за job_timeout, ставится в очередь снова.
+
+DEFAULT_PORT = 5050
+FLEET_HINT = 4  # рабочих, на которых рассчитывается сетка, если их число неизвестно
+
+
+# Отправляет сообщение: строка JSON с заголовком, затем необязательные двоичные данные
+def send_message(stream, header, payload=b""):
+    header = dict(header, size=len(payload))
+    stream.write(json.dumps(header).encode() + b"\n")
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+
+# Читает одно сообщение; при закрытом соединении возвращает (None, b"")
+def recv_message(stream):
+    line = stream.readline()
+    if not line:
+        return None, b""
+    header = json.loads(line)
+    payload = stream.read(header["size"]) if header["size"] else b""
+    return header, payload
+
+
+class TileBroker:
+    def __init__(self, host, port, job_timeout=60.0, max_attempts=3):
+        self.host = host
+        self.port = port
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self.lock = threading.Condition()
+        self.images = {}     # {имя_изображения: массив пикселей}
+        self.jobs = {}       # {id_задания: задание}
+        self.pending = deque()  # id заданий, ожидающих рабочего
+        self.in_flight = {}  # {id_задания: срок_выполнения}
+        self.results = {}    # {id_задания: список объектов}
+        self.failed = set()  # задания, исчерпавшие попытки
+        self.closed = False
+        self.server = None
+        self.connected = 0   # подключенных рабочих
+
+    def start(self):
+        broker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                broker.serve_worker(self.rfile, self.wfile, self.client_address)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Координатор запущен на {self.host}:{self.port}")
+
+    def stop(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    # Ставит в очередь части изображения, кроме заведомо пустых
+    def submit_image(self, name, image, num_parts):
+        height, width, _ = image.shape
+        windows = tile_windows(height, width, num_parts)
+        busy = prescan_tiles(image, windows)
+        print(f"Изображение {name}: частей {len(windows)}, пропущено пустых {len(windows) - len(busy)}")
+        job_ids = []
+        with self.lock:
+            self.images[name] = image
+            for number, y0, y1, x0, x1 in windows:
+                if number not in busy:
+                    continue
+                job_id = f"{name}:{number}"
+                self.jobs[job_id] = {"id": job_id, "image": name, "number": number,
+                                     "y0": y0, "y1": y1, "x0": x0, "x1": x1, "attempts": 0}
+                self.pending.append(job_id)
+                job_ids.append(job_id)
+            self.lock.notify_all()
+        return job_ids
+
+    # Возвращает в очередь задания, которые рабочие не вернули вовремя
+    def requeue_expired(self):
+        now = time.monotonic()
+        for job_id, deadline in list(self.in_flight.items()):
+            if deadline > now:
+                continue
+            del self.in_flight[job_id]
+            job = self.jobs[job_id]
+            if job["attempts"] >= self.max_attempts:
+                print(f"Задание {job_id} не выполнено за {job['attempts']} попыток, пропускаем")
+                self.failed.add(job_id)
+                self.lock.notify_all()
+            else:
+                print(f"Задание {job_id} просрочено, возвращаем в очередь")
+                self.pending.append(job_id)
+
+    # Выдает следующее задание или None, если очередь пуста
+    def take_job(self):
+        with self.lock:
+            self.requeue_expired()
+            while self.pending:
+                job_id = self.pending.popleft()
+                if job_id in self.results or job_id in self.failed:
+                    continue
+                job = self.jobs[job_id]
+                job["attempts"] += 1
+                self.in_flight[job_id] = time.monotonic() + self.job_timeout
+                image = self.images[job["image"]]
+                window = np.ascontiguousarray(image[job["y0"]:job["y1"], job["x0"]:job["x1"]])
+                return job, window
+        return None, None
+
+    def complete_job(self, job_id, objects):
+        with self.lock:
+            self.in_flight.pop(job_id, None)
+            # Повторный результат от просроченного рабочего просто отбрасываем
+            if job_id in self.jobs and job_id not in self.results:
+                self.results[job_id] = objects
+                self.failed.discard(job_id)
+                self.lock.notify_all()
+
+    def serve_worker(self, rfile, wfile, addr):
+        print(f"Подключен рабочий {addr[0]}:{addr[1]}")
+        with self.lock:
+            self.connected += 1
+        try:
+            while True:
+                header, _ = recv_message(rfile)
+                if header is None:
+                    break
+                if header["op"] == "get":
+                    if self.closed:
+                        send_message(wfile, {"op": "stop"})
+                        break
+                    job, window = self.take_job()
+                    if job is None:
+                        send_message(wfile, {"op": "wait", "delay": 0.2})
+                        continue
+                    send_message(wfile, {"op": "job", "id": job["id"], "x0": job["x0"], "y0": job["y0"],
+                                         "shape": list(window.shape), "dtype": str(window.dtype)},
+                                 window.tobytes())
+                elif header["op"] == "result":
+                    self.complete_job(header["id"], header["objects"])
+                    send_message(wfile, {"op": "ok"})
+        except (ConnectionError, OSError) as e:
+            print(f"Рабочий {addr[0]}:{addr[1]} отключился: {e}")
+        finally:
+            with self.lock:
+                self.connected -= 1
+
+    # Ждет завершения всех заданий из списка и возвращает объекты в порядке частей
+    def wait_for(self, job_ids):
+        with self.lock:
+            while not all(job_id in self.results or job_id in self.failed for job_id in job_ids):
+                if self.closed:
+                    break
+                self.requeue_expired()
+                self.lock.wait(timeout=0.5)
+            objects = []
+            for job_id in job_ids:
+                objects.extend(self.results.get(job_id, []))
+            return objects
+
+    def forget_image(self, name, job_ids):
+        with self.lock:
+            self.images.pop(name, None)
+            for job_id in job_ids:
+                self.jobs.pop(job_id, None)
+                self.results.pop(job_id, None)
+                self.failed.discard(job_id)
+
+
+# Обрабатывает изображения через рабочих и сохраняет общий каталог объектов для каждого кадра
+# workers - сколько рабочих ожидается; по умолчанию подключенные сейчас, но не меньше FLEET_HINT
+def process_images(broker, image_paths, num_parts=None, output_root="image_result", workers=None):
+    submitted = []
+    for full_path_to_image in image_paths:
+        name = os.path.splitext(os.path.basename(full_path_to_image))[0]
+        image = cv2.imread(full_path_to_image)
+        if image is None:
+            print(f"Не удалось прочитать {full_path_to_image}")
+            continue
+        # Сетку подбираем по размеру кадра и числу рабочих, а не по ядрам координатора:
+        # иначе на одноядерном координаторе кадр не делится и рабочие простаивают
+        fleet = workers or max(broker.connected, FLEET_HINT)
+        plan = plan_tiles(image.shape, image.dtype.itemsize, cores=fleet, num_parts=num_parts, workers=fleet)
+        submitted.append((name, broker.submit_image(name, image, plan["num_parts"])))
+
+    catalogs = {}
+    for name, job_ids in submitted:
+        objects = broker.wait_for(job_ids)
+        output_directory = os.path.join(output_root, name)
+        os.makedirs(output_directory, exist_ok=True)
+        write_objects(os.path.join(output_directory, "catalog.txt"), objects)
+        CatalogIndex.from_objects(objects).save(os.path.join(output_directory, "catalog_index.npz"))
+        broker.forget_image(name, job_ids)
+        catalogs[name] = objects
+        print(f"Изображение {name}: найдено объектов {len(objects)}")
+    return catalogs
+
+
+# Цикл рабочего: забирает задания у координатора, пока тот не попросит остановиться
+def run_worker(host, port, connect_attempts=20):
+    for attempt in range(connect_attempts):
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            time.sleep(0.5)
+    else:
+        print(f"Не удалось подключиться к координатору {host}:{port}")
+        return 0
+
+    processed = 0
+    with sock, sock.makefile("rwb") as stream:
+        try:
+            while True:
+                send_message(stream, {"op": "get"})
+                header, payload = recv_message(stream)
+                if header is None or header["op"] == "stop":
+                    break
+                if header["op"] == "wait":
+                    time.sleep(header["delay"])
+                    continue
+                tile = np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"])
+                space_objects, _ = detect_objects(tile)
+                records = [to_record(obj, header["x0"], header["y0"]) for obj in space_objects]
+                send_message(stream, {"op": "result", "id": header["id"], "objects": records})
+                recv_message(stream)
+                processed += 1
+        except (ConnectionError, OSError):
+            pass
+    print(f"Рабочий {os.getpid()} завершен, обработано частей: {processed}, "
+          f"{process_arena().summary()}, пиковая память {peak_rss_mb()} МБ")
+    return processed
+
+
+# Запускает несколько рабочих на этой машине (для проверки без кластера)
+def spawn_local_workers(count, host, port):
+    workers = [mp.Process(target=run_worker, args=(host, port), daemon=True) for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Распределенная обработка космических изображений")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    coordinator = subparsers.add_parser("coordinator", help="раздать части изображений рабочим")
+    coordinator.add_argument("images", nargs="+")
+    coordinator.add_argument("--host", default="0.0.0.0")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator.add_argument("--parts", type=int, default=None, help="число частей по каждой стороне (по умолчанию подбирается)")
+    coordinator.add_argument("--timeout", type=float, default=60.0, help="время на одну часть, с")
+    coordinator.add_argument("--local-workers", type=int, default=0, help="сколько рабочих запустить локально")
+    coordinator.add_argument("--workers", type=int, default=None,
+                             help="сколько рабочих ожидается, по нему подбирается сетка (по умолчанию подключенные или локальные)")
+
+    worker = subparsers.add_parser("worker", help="обрабатывать части, выданные координатором")
+    worker.add_argument("--host", default="127.0.0.1")
+    worker.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if args.mode == "worker":
+        run_worker(args.host, args.port)
+        return
+
+    broker = TileBroker(args.host, args.port, job_timeout=args.timeout)
+    broker.start()
+    workers = spawn_local_workers(args.local_workers, "127.0.0.1", broker.port)
+    started = time.perf_counter()
+    try:
+        process_images(broker, args.images, num_parts=args.parts, workers=args.workers or args.local_workers or None)
+    finally:
+        broker.stop()
+        for process in workers:
+            process.join(timeout=5)
+    print(f"Обработка завершена за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import logging
+import math
+import os
+
+# Подбор сетки частей и числа процессов по размеру изображения, свободной памяти и ядрам.
+# Любое значение можно задать вручную, тогда планировщик его не меняет, а только проверяет.
+
+logger = logging.getLogger("tile_planner")
+
+MEMORY_SHARE = 0.6      # какую часть свободной памяти разрешено занять обработкой
+MIN_TILE_SIDE = 64      # меньшие части дают больше накладных расходов, чем пользы
+MAX_NUM_PARTS = 32
+
+
+# Возвращает объем свободной оперативной памяти в байтах (psutil, если установлен)
+def available_memory():
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        # На macOS нет SC_AVPHYS_PAGES, считаем свободной половину физической памяти
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (ValueError, OSError, AttributeError):
+        return 2 * 1024 ** 3
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Оценка памяти на обработку одной части: копия для разметки, результат фильтра,
+# серое, размытое и бинарное изображения
+def tile_memory(tile_height, tile_width, channels, itemsize):
+    pixels = tile_height * tile_width
+    return pixels * (3 * channels * itemsize + 3)
+
+
+# Сколько процессов запускать для task_count задач по task_bytes байт каждая
+def plan_workers(task_count, task_bytes=0, cores=None, memory=None, workers=None):
+    cores = cores or available_cores()
+    memory = memory or available_memory()
+    if workers:
+        logger.info("Число процессов задано вручную: %d", workers)
+        return workers
+    budget = int(memory * MEMORY_SHARE)
+    by_memory = budget // task_bytes if task_bytes else cores
+    workers = max(1, min(cores, task_count or 1, by_memory))
+    if task_count:
+        # Столько же волн, но задачи поровну: без последней волны из одной задачи на одном ядре
+        workers = math.ceil(task_count / math.ceil(task_count / workers))
+    logger.info("Процессов: %d (ядер %d, задач %d, по памяти не более %d)",
+                workers, cores, task_count, by_memory)
+    return workers
+
+
+# Доля занятых процессов за все волны обработки: 9 частей на 8 процессов - это две волны,
+# во второй работает одно ядро, и время почти удваивается (доля 9/16)
+def load_share(tiles, workers):
+    return tiles / (math.ceil(tiles / workers) * workers)
+
+
+# Подбирает число частей по каждой стороне (num_parts) и число одновременных процессов
+def plan_tiles(shape, itemsize=1, cores=None, memory=None, num_parts=None, workers=None):
+    height, width = shape[:2]
+    channels = shape[2] if len(shape) > 2 else 1
+    cores = cores or available_cores()
+    memory = memory or available_memory()
+    image_bytes = height * width * channels * itemsize
+    # Исходное изображение и собранный результат остаются в родительском процессе
+    budget = max(int(memory * MEMORY_SHARE) - 2 * image_bytes, 0)
+
+    def tile_cost(parts):
+        return tile_memory(math.ceil(height / parts), math.ceil(width / parts), channels, itemsize)
+
+    def parallel(parts):
+        # Сколько процессов займут ядра и поместятся в память с частями такого размера
+        return workers or max(1, min(cores, budget // tile_cost(parts)))
+
+    if num_parts:
+        logger.info("Сетка задана вручную: %dx%d", num_parts, num_parts)
+    else:
+        # Сетка, при которой в памяти помещается больше всего процессов и части делятся между
+        # ними поровну (число частей кратно числу процессов); при равенстве - более крупные части
+        max_parts = max(1, min(MAX_NUM_PARTS, min(height, width) // MIN_TILE_SIDE))
+        best = None
+        for parts in range(1, max_parts + 1):
+            count = parallel(parts)
+            fits = tile_cost(parts) * min(count, parts ** 2) <= budget
+            score = (fits, round(min(count, parts ** 2) * load_share(parts ** 2, count), 6))
+            if best is None or score > best[0]:
+                best = (score, parts)
+        num_parts = best[1]
+
+    per_tile = tile_cost(num_parts)
+    if workers:
+        logger.info("Число процессов задано вручную: %d", workers)
+    else:
+        workers = min(parallel(num_parts), num_parts ** 2)
+    if per_tile * workers > budget:
+        logger.warning("Обработка может не поместиться в память: нужно %.1f МБ, доступно %.1f МБ",
+                       per_tile * workers / 2 ** 20, budget / 2 ** 20)
+
+    plan = {
+        "num_parts": num_parts,
+        "workers": workers,
+        "tile_bytes": per_tile,
+        "budget_bytes": budget,
+    }
+    logger.info("Изображение %dx%dx%d: сетка %dx%d, процессов %d, %.1f МБ на часть, бюджет %.1f МБ",
+                width, height, channels, num_parts, num_parts, workers,
+                per_tile / 2 ** 20, budget / 2 ** 20)
+    return plan
+
+
+# Проверка: python tile_planner.py печатает сетку и число процессов для нескольких
+# размеров изображения и бюджетов ядер и памяти; в последнем столбце должен быть 0
+if __name__ == "__main__":
+    print("изображение  ядер  память  сетка  процессов  частей % процессов")
+    for shape in [(4000, 6000, 3), (1080, 1920, 3), (400, 400, 3)]:
+        for check_cores in (2, 4, 6, 8, 12):
+            for check_memory in (0.5 * 1024 ** 3, 8 * 1024 ** 3):
+                check = plan_tiles(shape, cores=check_cores, memory=check_memory)
+                parts, count = check["num_parts"], check["workers"]
+                print(f"{shape[1]:>5}x{shape[0]:<5} {check_cores:5} {check_memory / 1024 ** 3:5.1f} ГБ"
+                      f"  {parts}x{parts}  {count:9}  {parts * parts % count}")
+    print("plan_workers на 8 ядрах (задач: процессов):",
+          {tasks: plan_workers(tasks, cores=8, memory=8 * 1024 ** 3) for tasks in (1, 5, 9, 17, 100)})
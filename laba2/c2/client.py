@@ -1,17 +1,34 @@
+import base64
 import socket
 import threading
 import tkinter as tk
-from tkinter import scrolledtext, messagebox
+from tkinter import filedialog, scrolledtext, messagebox
 import logging
+import os
+import queue
+import sys
+import time
 from datetime import datetime
 
-# Настройка логирования на клиенте
-logging.basicConfig(
-    filename="client_log.txt",
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chat_common.compression import COMPRESS_COMMAND, COMPRESSED_PREFIX, ZLIB, decompress_line
+from chat_common.connection import Backoff
+from chat_common.filetransfer import FILE_COMMAND, Download, upload_lines
+from chat_common.heartbeat import PING_LINE, PONG_LINE
+from chat_common.logs import sample, setup_logging
+from chat_common.presence import format_snapshot, parse_rooms
+
+# Настройка логирования на клиенте: запись в файл идет в фоновом потоке пачками,
+# поток приема сообщений только кладет записи в очередь
+setup_logging(filename="client_log.txt", console=False)
+# Отправленные и полученные сообщения пишутся в отдельный логгер на уровне DEBUG и с
+# выборкой: одна запись из MESSAGE_LOG_SAMPLE. При уровне журнала INFO (по умолчанию) они
+# не пишутся и даже не форматируются; для отладки - setup_logging(..., level=logging.DEBUG)
+MESSAGE_LOG_SAMPLE = 100
+message_log = sample("client.messages", MESSAGE_LOG_SAMPLE)
+
+DOWNLOADS_DIR = "downloads"  # куда сохраняются принятые файлы
+FILE_REPLY_TIMEOUT = 10  # секунд ожидания ответа сервера на /file offer и /file resume
 
 class ChatClient:
     def __init__(self, host, port):
@@ -19,55 +36,208 @@ class ChatClient:
         self.port = port
         self.socket = None
         self.username = None
+        self.room = None
         self.connected = False
+        self.closing = False  # нажат Disconnect: переподключаться не нужно
+        self.rooms = {}  # {комната: число участников}, собирается из /rooms и /roomdelta
+        # Отправляют в сокет и поток интерфейса, и поток приема (pong), и поток загрузки файла
+        self.send_lock = threading.Lock()
+        self.accepted = queue.Queue()  # ответы /file accept для потока загрузки
+        self.uploads = {}    # {номер: путь} загруженных файлов, для /resume
+        self.failed_uploads = set()
+        self.available = {}  # {номер: (имя, размер)} из /file available
+        self.downloads = {}  # {номер: Download}
+
+    def send(self, data):
+        with self.send_lock:
+            self.socket.sendall(data)
 
     def connect(self, username, room):
+        self.username = username
+        self.room = room
+        self.closing = False
+        return self.open()
+
+    def open(self):
+        """Подключается и входит в текущую комнату; True или текст ошибки."""
         try:
+            if self.socket is not None:
+                self.socket.close()
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
-            self.username = username
-            self.socket.send(f"/join {room} {username}\n".encode())  # Отправляем команду /join
+            # Просим сжимать длинные сообщения (до /join, чтобы сжатой пришла и история комнаты)
+            self.send(f"{COMPRESS_COMMAND} {ZLIB}\n".encode())
+            self.send(f"/join {self.room} {self.username}\n".encode())  # Отправляем команду /join
             self.connected = True
-            logging.info(f"Connected to server as '{username}' in room '{room}'.")
+            logging.info("Connected to server as '%s' in room '%s'.", self.username, self.room)
             return True
         except Exception as e:
-            logging.error(f"Connection error: {str(e)}")
+            logging.error("Connection error: %s", e)
             return str(e)
 
+    def reconnect(self, callback):
+        """Подключается заново с растущей паузой, пока не получится или пока не нажат Disconnect."""
+        backoff = Backoff()
+        while not self.closing:
+            delay = backoff.next()
+            callback(f"[INFO] Reconnecting in {delay:.1f} s...")
+            time.sleep(delay)
+            if self.closing:
+                break
+            if self.open() is True:
+                callback("[INFO] Reconnected!")
+                return True
+        return False
+
     def send_message(self, message):
+        command = message.split()
+        if len(command) > 1 and command[0] == "/join":
+            self.room = command[1]  # после переподключения войдем в эту комнату
         if self.connected:
             try:
-                self.socket.send(message.encode())
-                logging.info(f"Message sent: {message.strip()}")
+                self.send(message.encode())
+                if message_log.isEnabledFor(logging.DEBUG):
+                    message_log.debug("Message sent: %s", message.strip())
             except:
+                # Поток приема заметит разрыв и переподключится
                 self.connected = False
                 logging.error("Failed to send message. Connection lost.")
-                messagebox.showerror("Error", "Connection lost.")
+                messagebox.showerror("Error", "Connection lost, reconnecting.")
+        else:
+            messagebox.showerror("Error", "Not connected, the client is reconnecting.")
 
     def receive_messages(self, callback, update_rooms_callback):
         def listen():
-            while self.connected:
+            # После разрыва соединение восстанавливается, пока не нажат Disconnect
+            while True:
                 try:
-                    data = self.socket.recv(4096).decode()
-                    if data.startswith("/rooms"):
-                        rooms_data = data.replace("/rooms ", "").strip()
-                        update_rooms_callback(rooms_data)
-                        logging.info(f"Updated room list received: {rooms_data}")
-                    else:
-                        callback(data)
-                        logging.info(f"Message received: {data.strip()}")
+                    self.read_lines(callback, update_rooms_callback)
                 except:
-                    self.connected = False
-                    callback("[INFO] Connection lost.")
-                    logging.warning("Connection lost while listening.")
+                    pass
+                self.connected = False
+                if self.closing:
+                    break
+                callback("[INFO] Connection lost.")
+                logging.warning("Connection lost while listening.")
+                if not self.reconnect(callback):
                     break
 
         threading.Thread(target=listen, daemon=True).start()
 
+    def read_lines(self, callback, update_rooms_callback):
+        # Сервер завершает каждое сообщение переводом строки
+        stream = self.socket.makefile("r", encoding="utf-8", newline="\n")
+        while True:
+            data = stream.readline()
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            if data.encode() == PING_LINE:
+                # Сервер проверяет, что клиент жив
+                self.send(PONG_LINE)
+            elif data.startswith(FILE_COMMAND + " "):
+                self.handle_file(data.rstrip("\n"), callback)
+            elif data.startswith(COMPRESS_COMMAND):
+                logging.info("Compression: %s", data.split()[-1])
+            elif data.encode().startswith(COMPRESSED_PREFIX):
+                # Внутри сжатой строки может быть несколько сообщений
+                for line in decompress_line(data.encode()).decode().splitlines():
+                    self.handle_line(line, callback, update_rooms_callback)
+            else:
+                self.handle_line(data.rstrip("\n"), callback, update_rooms_callback)
+
+    def send_file(self, path, callback):
+        """Загружает файл в комнату. Вызывается в отдельном потоке: sendall сам ждет, пока
+        сервер примет предыдущие куски."""
+        try:
+            self.send(f"/file offer {os.path.getsize(path)} {os.path.basename(path)}\n".encode())
+            self.upload(path, callback)
+        except (OSError, queue.Empty) as e:
+            callback(f"[ERROR] File upload failed: {e}")
+
+    def resume_file(self, number, callback):
+        """Продолжает прерванную загрузку файла с того места, которое сервер уже принял."""
+        if number not in self.uploads:
+            callback(f"[ERROR] No upload {number} to resume.")
+            return
+        try:
+            self.send(f"/file resume {number}\n".encode())
+            self.upload(self.uploads[number], callback)
+        except (OSError, queue.Empty) as e:
+            callback(f"[ERROR] File upload failed: {e}")
+
+    def upload(self, path, callback):
+        number, offset = self.accepted.get(timeout=FILE_REPLY_TIMEOUT)
+        if number is None:
+            return  # сервер отказал, причину уже показал handle_file
+        self.uploads[number] = path
+        self.failed_uploads.discard(number)
+        callback(f"[FILE] Uploading {os.path.basename(path)} from byte {offset}...")
+        for line in upload_lines(number, path, offset):
+            if number in self.failed_uploads or not self.connected:
+                callback(f"[FILE] Upload {number} stopped, type /resume {number} to continue.")
+                return
+            self.send(line)
+        logging.info("File %s uploaded as %s", path, number)
+
+    def download(self, number, callback):
+        if number not in self.available:
+            callback(f"[ERROR] Unknown file {number}.")
+            return
+        name, size = self.available[number]
+        if number not in self.downloads:
+            # Если .part уже есть, прием продолжится с его конца
+            self.downloads[number] = Download(number, name, size, DOWNLOADS_DIR)
+        self.send(self.downloads[number].request())
+
+    def handle_file(self, data, callback):
+        parts = data.split(" ", 4)
+        action = parts[1]
+        if action == "accept":
+            self.accepted.put((int(parts[2]), int(parts[3])))
+        elif action == "available":
+            _, _, number, size, sender, name = data.split(" ", 5)
+            self.available[int(number)] = (name, int(size))
+            callback(f"[FILE] {sender} shared {name} ({size} bytes), type /download {number} to save it")
+        elif action == "data":
+            download = self.downloads.get(int(parts[2]))
+            if download is None:
+                return
+            if not download.feed(int(parts[3]), base64.b64decode(parts[4])) and not download.waiting_resend:
+                # Кусок потерялся (например, переполнилась очередь на сервере): просим с нашего места
+                download.waiting_resend = True
+                self.send(download.request())
+        elif action == "done":
+            download = self.downloads.get(int(parts[2]))
+            if download is None:
+                return
+            if download.finish():
+                del self.downloads[download.number]
+                callback(f"[FILE] Saved {download.path}")
+            elif not download.waiting_resend:
+                download.waiting_resend = True
+                self.send(download.request())
+        elif action == "error":
+            number, reason = parts[2], " ".join(parts[3:])
+            if number == "-":
+                self.accepted.put((None, 0))
+            elif number.isdigit():
+                self.failed_uploads.add(int(number))
+            callback(f"[ERROR] File {number}: {reason}")
+
+    def handle_line(self, data, callback, update_rooms_callback):
+        if parse_rooms(data, self.rooms):
+            rooms_data = format_snapshot(self.rooms).replace("/rooms ", "")
+            update_rooms_callback(rooms_data)
+            message_log.debug("Updated room list received: %s", rooms_data)
+        else:
+            callback(data)
+            message_log.debug("Message received: %s", data)
+
     def disconnect(self):
+        self.closing = True
         if self.connected:
             try:
-                self.socket.send("/quit\n".encode())
+                self.send("/quit\n".encode())
                 self.socket.close()
                 logging.info("Disconnected from server.")
             except:
@@ -119,6 +289,9 @@ class ChatApp:
         self.send_button = tk.Button(self.bottom_frame, text="Send", command=self.send_message, bg="#111111", fg="black")
         self.send_button.pack(side="left", padx=5)
 
+        self.file_button = tk.Button(self.bottom_frame, text="Send file", command=self.send_file, bg="#111111", fg="black")
+        self.file_button.pack(side="left", padx=5)
+
         # Поле для отображения активных комнат
         tk.Label(self.root, text="Active Rooms:", bg="#333333", fg="white").pack()
         self.rooms_list = tk.Listbox(self.root, bg="#444444", fg="white", height=5)
@@ -154,6 +327,14 @@ class ChatApp:
         message = self.message_entry.get().strip()
         recipient = self.private_entry.get().strip()
 
+        # /download N - сохранить файл из комнаты, /resume N - продолжить прерванную загрузку
+        command, _, number = message.partition(" ")
+        if command in ("/download", "/resume") and number.strip().isdigit():
+            action = self.client.download if command == "/download" else self.client.resume_file
+            threading.Thread(target=action, args=(int(number), self.add_message), daemon=True).start()
+            self.message_entry.delete(0, tk.END)
+            return
+
         if message:
             if recipient:
                 self.client.send_message(f"/private {recipient} {message}\n")
@@ -162,6 +343,15 @@ class ChatApp:
             self.message_entry.delete(0, tk.END)
             self.private_entry.delete(0, tk.END)
 
+    def send_file(self):
+        if not self.client or not self.client.connected:
+            messagebox.showerror("Error", "Connect to a room first!")
+            return
+        path = filedialog.askopenfilename()
+        if path:
+            # Загрузка идет в своем потоке, интерфейс не ждет
+            threading.Thread(target=self.client.send_file, args=(path, self.add_message), daemon=True).start()
+
     def add_message(self, message):
         self.messages.configure(state="normal")
         self.messages.insert(tk.END, f"{message}\n")
@@ -1,63 +1,159 @@
-import socket
-import threading
-import time
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chat_common.cluster import BusClient, run_cluster
+from chat_common.compression import COMPRESS_COMMAND, Packed, negotiate
+from chat_common.filetransfer import FILE_COMMAND, FileStore
+from chat_common.heartbeat import PING_LINE, PONG, Heartbeat
+from chat_common.metrics import METRICS, room_gauges, serve_metrics
+from chat_common.outbox import DEFAULT_MAX_MESSAGES, DROP_OLDEST, ClientOutbox
+from chat_common.presence import RoomPresence
+
+# Все соединения обслуживаются одним циклом событий в одном потоке, поэтому общие
+# словари клиентов и комнат меняются без блокировок. Каждая строка от клиента - команда
+# или сообщение, каждая строка от сервера заканчивается переводом строки.
+
+BACKLOG = 4096  # очередь входящих подключений (ядро может ограничить ее net.core.somaxconn)
+USER_TOPIC = "user "  # тема шины для личных сообщений; в имени комнаты пробела быть не может
+METRICS_PORT = 9003  # метрики: http://127.0.0.1:9003/metrics, в кластере у процесса N - 9003 + N
+
+
+def raise_open_files_limit():
+    """Поднимает мягкий лимит открытых файлов до жесткого: каждое соединение - дескриптор."""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
 
 class ChatServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, workers=0, queue_size=DEFAULT_MAX_MESSAGES, overflow=DROP_OLDEST,
+                 metrics_port=None, coalesce_window=0, room_windows=None):
         self.host = host
         self.port = port
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.clients = {}  # {username: (socket, room)}
+        self.clients = {}  # {username: (ClientOutbox, room)}
         self.rooms = {}    # {room: [username1, username2]}
         self.online_users = set()  # Отслеживаем онлайн пользователей для приватных сообщений
+        # В режиме кластера: шина между процессами, комнаты, на которые подписан процесс,
+        # и общее по кластеру число участников комнат
+        self.bus = None
+        self.bus_rooms = set()
+        self.cluster_counts = {}
+        # Список комнат уходит клиентам при подключении и дальше только при изменениях
+        self.presence = RoomPresence(self.rooms, count=self.room_count)
+        # Ping молчащим соединениям и отключение тех, кто не отвечает (полуоткрытые TCP)
+        self.heartbeat = Heartbeat()
+        # Файлы, загруженные в комнаты этого процесса (см. chat_common/filetransfer.py)
+        self.files = FileStore()
+        self.queue_size = queue_size
+        self.overflow = overflow  # DROP_OLDEST или DISCONNECT
+        # Окно склейки исходящих сообщений в секундах (0 - писать сразу) и окна отдельных
+        # комнат {комната: секунды}: граница задержки, которую комната готова отдать за меньшее число записей
+        self.coalesce_window = coalesce_window
+        self.room_windows = room_windows or {}
+        self.metrics_port = metrics_port
+        self.connections = 0
+        METRICS.add_collector(lambda: room_gauges(self.connections, self.rooms))
+        # Обработчики сообщений: функции (username, room, message) -> message.
+        # Если задан workers, они выполняются в пуле процессов и не задерживают цикл событий;
+        # тогда это должны быть функции уровня модуля, чтобы их можно было передать в процесс
+        self.hooks = []
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers else None
 
-    def start(self):
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    async def connect_bus(self, path):
+        self.bus = BusClient(self.on_bus_publish, self.on_bus_count)
+        await self.bus.connect(path)
+
+    async def start(self, reuse_port=False):
+        raise_open_files_limit()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, backlog=BACKLOG,
+                                            reuse_port=reuse_port or None)
         print(f"Server started on {self.host}:{self.port}")
-        threading.Thread(target=self.broadcast_rooms, daemon=True).start()
-
-        while True:
-            client_socket, addr = self.server_socket.accept()
-            threading.Thread(target=self.handle_client, args=(client_socket, addr), daemon=True).start()
-
-    def broadcast_rooms(self):
-        while True:
-            time.sleep(3)  # Интервал обновления списка комнат
-            rooms_list = "/rooms " + ",".join(f"{room} ({len(self.rooms.get(room, []))} users)" for room in self.rooms)
-            for username, (client_socket, _) in self.clients.items():
-                try:
-                    client_socket.send(rooms_list.encode())
-                except:
-                    self.disconnect_client(username)
-
-    def handle_client(self, client_socket, addr):
+        if self.metrics_port:
+            await serve_metrics(self.metrics_port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.presence.close()
+            self.heartbeat.close()
+            self.files.close()
+            if self.pool:
+                self.pool.shutdown(cancel_futures=True)
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        outbox = ClientOutbox(writer, max_messages=self.queue_size, overflow=self.overflow,
+                              coalesce_window=self.coalesce_window)
         username = None
         room = None
+        self.presence.subscribe(outbox)
+        self.heartbeat.add(outbox, lambda: outbox.send(PING_LINE))
+        self.connections += 1
+        METRICS.inc("chat_connections_total")
 
         try:
             while True:
-                data = client_socket.recv(4096).decode().strip()
-                if not data:
+                line = await reader.readline()
+                if not line:
                     break
+                self.heartbeat.touch(outbox)
+                data = line.decode().strip()
+                if not data or data == PONG:
+                    continue
+                METRICS.inc("chat_messages_in_total")
 
                 if data.startswith("/join"):
                     parts = data.split()
+                    if len(parts) < 2:
+                        outbox.send(b"[ERROR] Usage: /join room [username]\n")
+                        continue
+                    # Повторный /join переводит клиента в другую комнату
+                    if username is not None:
+                        self.disconnect_client(username)
                     room = parts[1]
                     username = parts[2] if len(parts) > 2 else f"{addr[0]}:{addr[1]}"
-                    self.clients[username] = (client_socket, room)
+                    self.clients[username] = (outbox, room)
+                    outbox.coalesce_window = self.room_windows.get(room, self.coalesce_window)
                     self.online_users.add(username)
-
-                    if room not in self.rooms:
-                        self.rooms[room] = []
-                    self.rooms[room].append(username)
+                    self.rooms.setdefault(room, []).append(username)
+                    self.room_changed(room)
+                    if self.bus:
+                        self.bus.subscribe(USER_TOPIC + username)
 
                     self.send_to_room(room, f"[INFO] {username} has joined the room {room}")
-                    self.send_current_rooms(client_socket)
 
                 elif data.startswith("/quit"):
                     break
 
+                elif data.startswith(COMPRESS_COMMAND):
+                    # Длинные сообщения этому клиенту будут приходить сжатыми
+                    outbox.compress, reply = negotiate(data)
+                    outbox.send(reply)
+
+                elif data.startswith(FILE_COMMAND + " "):
+                    # Объявление о новом файле получают только клиенты этого процесса:
+                    # в кластере файл хранится там, куда его загрузили
+                    announcement = self.files.command(data, username, room, outbox)
+                    if announcement:
+                        self.deliver_to_room(room, announcement)
+
                 elif data.startswith("/private"):
                     parts = data.split(" ", 2)
                     if len(parts) == 3:
@@ -66,67 +162,147 @@ class ChatServer:
                     else:
                         self.send_to_client(username, "[ERROR] Incorrect /private message format.")
 
-                else:
-                    self.send_to_room(room, f"{username}: {data}")
+                elif room is not None:
+                    message = await self.run_hooks(username, room, data)
+                    if message is not None:
+                        self.send_to_room(room, f"{username}: {message}")
 
-        except Exception as e:
+        except (ConnectionError, OSError, UnicodeDecodeError, ValueError) as e:
             print(f"Error handling client: {e}")
         finally:
+            self.connections -= 1
+            self.heartbeat.remove(outbox)
+            self.presence.unsubscribe(outbox)
+            self.files.cancel_streams(outbox)
             self.disconnect_client(username)
+            await outbox.close()
 
-    def send_current_rooms(self, client_socket):
-        rooms_list = "/rooms " + ",".join(f"{room} ({len(self.rooms[room])} users)" for room in self.rooms)
-        try:
-            client_socket.send(rooms_list.encode())
-        except:
-            pass
+    async def run_hooks(self, username, room, message):
+        """Пропускает сообщение через обработчики; None - сообщение отброшено."""
+        loop = asyncio.get_running_loop()
+        for hook in self.hooks:
+            if self.pool:
+                message = await loop.run_in_executor(self.pool, hook, username, room, message)
+            else:
+                message = hook(username, room, message)
+            if message is None:
+                break
+        return message
 
     def send_to_room(self, room, message):
-        if room in self.rooms:
-            for user in self.rooms[room]:
-                if user in self.clients:
-                    client_socket, _ = self.clients[user]
-                    try:
-                        client_socket.send(message.encode())
-                    except:
-                        self.disconnect_client(user)
+        data = (message + "\n").encode()
+        self.deliver_to_room(room, data)
+        if self.bus:
+            self.bus.publish(room, data)
+
+    def deliver_to_room(self, room, data):
+        # Сжатие, если оно кому-то нужно, выполняется один раз на сообщение
+        packed = Packed(data)
+        for user in self.rooms.get(room, ()):
+            if user in self.clients:
+                outbox = self.clients[user][0]
+                outbox.send(packed.for_outbox(outbox))
 
     def send_private_message(self, sender, recipient, message):
+        data = f"[PRIVATE] {sender}: {message}\n".encode()
         if recipient in self.online_users and recipient in self.clients:
-            client_socket, _ = self.clients[recipient]
-            try:
-                client_socket.send(f"[PRIVATE] {sender}: {message}".encode())
-            except:
-                self.disconnect_client(recipient)
+            self.clients[recipient][0].send(data)
+        elif self.bus:
+            # Получатель может быть подключен к другому процессу кластера
+            self.bus.publish(USER_TOPIC + recipient, data)
         else:
             self.send_to_client(sender, f"[ERROR] User '{recipient}' not found or offline.")
 
     def send_to_client(self, username, message):
         if username in self.clients:
-            client_socket, _ = self.clients[username]
-            try:
-                client_socket.send(message.encode())
-            except:
-                self.disconnect_client(username)
+            self.clients[username][0].send((message + "\n").encode())
+
+    def remove_client(self, username):
+        _, room = self.clients.pop(username)
+        self.online_users.discard(username)
+
+        if room in self.rooms:
+            self.rooms[room].remove(username)
+            if not self.rooms[room]:
+                del self.rooms[room]
+            self.room_changed(room)
+        if self.bus:
+            self.bus.unsubscribe(USER_TOPIC + username)
+        return room
+
+    def room_changed(self, room):
+        if not self.bus:
+            self.presence.mark(room)
+            return
+        # Процесс подписан на комнату, пока в ней есть его клиенты; список комнат
+        # обновится, когда шина пришлет общее число участников
+        local = len(self.rooms.get(room, ()))
+        if local and room not in self.bus_rooms:
+            self.bus_rooms.add(room)
+            self.bus.subscribe(room)
+        elif not local and room in self.bus_rooms:
+            self.bus_rooms.discard(room)
+            self.bus.unsubscribe(room)
+        self.bus.report_count(room, local)
+
+    def room_count(self, room):
+        if self.bus:
+            return self.cluster_counts.get(room, 0)
+        return len(self.rooms.get(room, ()))
+
+    def on_bus_publish(self, topic, data):
+        if topic.startswith(USER_TOPIC):
+            username = topic[len(USER_TOPIC):]
+            if username in self.clients:
+                self.clients[username][0].send(data)
+        else:
+            self.deliver_to_room(topic, data)
+
+    def on_bus_count(self, room, total):
+        if total:
+            self.cluster_counts[room] = total
+        else:
+            self.cluster_counts.pop(room, None)
+        self.presence.mark(room)
 
     def disconnect_client(self, username):
         if username in self.clients:
-            client_socket, room = self.clients[username]
-            try:
-                client_socket.close()
-            except:
-                pass
-            del self.clients[username]
-            self.online_users.discard(username)
-
-            if room in self.rooms:
-                self.rooms[room].remove(username)
-                if not self.rooms[room]:
-                    del self.rooms[room]
-
+            room = self.remove_client(username)
             self.send_to_room(room, f"[INFO] {username} has left the room")
 
 
+def run_worker(host, port, metrics_port, coalesce_window, number, bus_path):
+    """Рабочий процесс кластера: свой цикл событий, общий порт и подключение к шине."""
+    async def main():
+        server = ChatServer(host, port, metrics_port=metrics_port + number if metrics_port else None,
+                            coalesce_window=coalesce_window)
+        await server.connect_bus(bus_path)
+        # Если шина пропала, процесс завершается вместе с ней
+        await asyncio.gather(server.start(reuse_port=True), server.bus.task)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-    server = ChatServer("127.0.0.1", 5003)
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5003)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="число процессов на одном порту (SO_REUSEPORT), комнаты общие через шину")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="0 - без метрик")
+    parser.add_argument("--coalesce-ms", type=float, default=0,
+                        help="окно склейки исходящих сообщений в миллисекундах, например 1; 0 - без склейки")
+    args = parser.parse_args()
+    coalesce_window = args.coalesce_ms / 1000
+    try:
+        if args.processes > 1:
+            run_cluster(run_worker, args.processes,
+                        args=(args.host, args.port, args.metrics_port, coalesce_window))
+        else:
+            asyncio.run(ChatServer(args.host, args.port, metrics_port=args.metrics_port,
+                                   coalesce_window=coalesce_window).start())
+    except KeyboardInterrupt:
+        print("Server shut down.")
@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from chat_common.heartbeat import PING, PONG_LINE
+
+# Нагрузочный тест чат-серверов. Открывает много клиентов, раскладывает их по комнатам,
+# отправляет сообщения с заданной общей частотой и измеряет задержку доставки: в каждом
+# сообщении лежит время отправки, а получатель (тот же процесс) вычитает его из текущего.
+#
+# Протоколы:
+#   join  - c2 и с2: строка "/join комната имя", дальше строки сообщений (порты 5003, 5004)
+#   chat3 - chat_3: строка с именем, строка с номером комнаты, дальше строки сообщений (порт 8080)
+#
+# Пример: python chat_bench.py --protocol chat3 --port 8080 --clients 2000 --rooms 20 --rate 500 \
+#             --server-pid $(pgrep -f chat_server.py)
+
+MARKER = "bench"
+CONNECT_CONCURRENCY = 200  # одновременных подключений при разгоне
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.latencies = []  # секунды, только после прогрева
+        self.errors = 0
+        self.measuring = False
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def process_usage(pid):
+    """(процессорное время в секундах, RSS в МБ) процесса сервера по /proc; None, если недоступно."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+        return cpu, rss
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def own_cpu():
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class BenchClient:
+    def __init__(self, number, room, args, stats):
+        self.name = f"bench{number}"
+        self.room = room
+        self.args = args
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        if self.args.protocol == "join":
+            self.writer.write(f"/join room{self.room} {self.name}\n".encode())
+        else:
+            # Номера комнат chat_3 начинаются с 1
+            self.writer.write(f"{self.name}\n{self.room + 1}\n".encode())
+        await self.writer.drain()
+
+    async def receive(self):
+        stats = self.stats
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                # Молчащим клиентам сервер шлет ping и без ответа отключает их через PING_TIMEOUT
+                if line.strip() == PING.encode():
+                    self.writer.write(PONG_LINE)
+                    continue
+                # "имя: bench <время отправки, нс> <номер>"
+                text = line.decode(errors="replace")
+                position = text.find(MARKER + " ")
+                if position < 0:
+                    continue
+                sent_at = int(text[position + len(MARKER) + 1:].split(" ", 1)[0])
+                stats.received += 1
+                if stats.measuring:
+                    stats.latencies.append((time.perf_counter_ns() - sent_at) / 1e9)
+        except (ConnectionError, OSError, ValueError):
+            stats.errors += 1
+
+    async def send_loop(self, interval, stop_at):
+        # Случайный сдвиг, чтобы клиенты не отправляли одновременно
+        await asyncio.sleep(random.random() * interval)
+        number = 0
+        next_at = time.perf_counter()
+        while next_at < stop_at:
+            padding = "x" * self.args.size
+            self.writer.write(f"{MARKER} {time.perf_counter_ns()} {number} {padding}\n".encode())
+            self.stats.sent += 1
+            number += 1
+            if self.writer.transport.get_write_buffer_size() > 64 * 1024:
+                await self.writer.drain()
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def run(args):
+    stats = Stats()
+    clients = [BenchClient(number, number % args.rooms, args, stats) for number in range(args.clients)]
+
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(client):
+        async with limit:
+            await client.connect()
+
+    results = await asyncio.gather(*(connect(client) for client in clients), return_exceptions=True)
+    failed = [error for error in results if isinstance(error, Exception)]
+    clients = [client for client, error in zip(clients, results) if not isinstance(error, Exception)]
+    print(f"Connected {len(clients)} clients in {time.perf_counter() - started:.2f} s, failed {len(failed)}"
+          + (f" (first error: {failed[0]})" if failed else ""))
+    if not clients:
+        return None
+
+    receivers = [asyncio.create_task(client.receive()) for client in clients]
+    await asyncio.sleep(args.settle)
+
+    senders = clients[:max(1, int(len(clients) * args.senders))]
+    interval = len(senders) / args.rate
+    server_before = process_usage(args.server_pid) if args.server_pid else None
+    cpu_before = own_cpu()
+    begin = time.perf_counter()
+    stop_at = begin + args.warmup + args.duration
+    send_tasks = [asyncio.create_task(client.send_loop(interval, stop_at)) for client in senders]
+
+    await asyncio.sleep(args.warmup)
+    stats.measuring = True
+    sent_before, received_before = stats.sent, stats.received
+    measure_start = time.perf_counter()
+    await asyncio.gather(*send_tasks)
+    measured = time.perf_counter() - measure_start
+    sent, received = stats.sent - sent_before, stats.received - received_before
+    # Ждем хвост доставки
+    await asyncio.sleep(args.drain)
+    stats.measuring = False
+    server_after = process_usage(args.server_pid) if args.server_pid else None
+    client_cpu = own_cpu() - cpu_before
+
+    for client in clients:
+        client.close()
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    latencies = sorted(stats.latencies)
+    report = {
+        "clients": len(clients),
+        "rooms": args.rooms,
+        "duration_s": round(measured, 2),
+        "sent_per_s": round(sent / measured, 1),
+        "delivered_per_s": round(received / measured, 1),
+        "latency_ms": {name: round(percentile(latencies, fraction) * 1000, 3)
+                       for name, fraction in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999), ("max", 1.0))},
+        "receive_errors": stats.errors,
+        "client_cpu_s": round(client_cpu, 2),
+    }
+    if server_before and server_after:
+        report["server_cpu_percent"] = round(100 * (server_after[0] - server_before[0])
+                                             / (time.perf_counter() - begin), 1)
+        report["server_rss_mb"] = round(server_after[1], 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест чат-серверов")
+    parser.add_argument("--protocol", choices=("join", "chat3"), default="join",
+                        help="join - c2 и с2, chat3 - chat_3")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5004)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=200, help="сообщений в секунду от всех клиентов вместе")
+    parser.add_argument("--senders", type=float, default=0.1, help="доля клиентов, которые отправляют")
+    parser.add_argument("--size", type=int, default=64, help="дополнительных байт в сообщении")
+    parser.add_argument("--duration", type=float, default=20, help="секунд измерения")
+    parser.add_argument("--warmup", type=float, default=3, help="секунд прогрева без учета задержек")
+    parser.add_argument("--settle", type=float, default=1, help="пауза после подключения всех клиентов")
+    parser.add_argument("--drain", type=float, default=2, help="ожидание последних доставок")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID сервера для замера CPU и RSS")
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    args = parser.parse_args()
+
+    # Каждый клиент - дескриптор; поднимаем мягкий лимит до жесткого
+    if resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    report = asyncio.run(run(args))
+    if report is None:
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    latency = report["latency_ms"]
+    print(f"Clients: {report['clients']} in {report['rooms']} rooms, measured {report['duration_s']} s")
+    print(f"Sent: {report['sent_per_s']} msg/s, delivered: {report['delivered_per_s']} msg/s")
+    print(f"Latency, ms: p50 {latency['p50']}, p99 {latency['p99']}, p999 {latency['p999']}, max {latency['max']}")
+    if "server_cpu_percent" in report:
+        print(f"Server: CPU {report['server_cpu_percent']}%, RSS {report['server_rss_mb']} MB")
+    print(f"Load generator CPU: {report['client_cpu_s']} s, receive errors: {report['receive_errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Общие части чат-серверов и клиентов лабораторной 2."""
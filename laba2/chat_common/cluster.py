@@ -0,0 +1,248 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import tempfile
+
+from chat_common.framing import encode_frame, read_frame
+
+# Режим кластера: несколько процессов принимают подключения на одном порту (SO_REUSEPORT),
+# а комнаты объединяет шина в родительском процессе, к которой процессы подключаются
+# по Unix-сокету. Процесс подписывается на комнату, пока в ней есть хотя бы один его
+# клиент, и получает от шины только сообщения своих комнат. Кроме того, процессы
+# сообщают шине, сколько у них участников в каждой комнате, а шина рассылает итоговые
+# числа всем, чтобы список комнат у клиентов был общим для кластера.
+
+BUS_SUBSCRIBE = 16     # нагрузка: тема
+BUS_UNSUBSCRIBE = 17   # нагрузка: тема
+BUS_PUBLISH = 18       # нагрузка: тема \0 данные
+BUS_COUNT = 19         # нагрузка: комната \0 число участников (от процесса - свое, от шины - общее)
+
+SEPARATOR = b"\0"
+
+BUS_MAX_BYTES = 64 * 1024 * 1024  # неотправленных байт в одном соединении шины
+BUS_CLOSE_TIMEOUT = 5.0
+
+
+def split_payload(payload):
+    topic, _, data = payload.partition(SEPARATOR)
+    return topic.decode(), data
+
+
+class BusLink:
+    """Очередь отправки одного соединения шины.
+
+    В отличие от ClientOutbox, кадры не выбрасываются (потерянная публикация - это сообщение,
+    пропавшее для всех клиентов процесса) и не учитываются в метриках клиентских соединений.
+    Если получатель отстал больше чем на max_bytes, соединение разрывается целиком.
+    """
+
+    def __init__(self, writer, max_bytes=BUS_MAX_BYTES):
+        self.writer = writer
+        self.max_bytes = max_bytes
+        self.queue = []
+        self.queued_bytes = 0
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def send(self, data):
+        if self.closed:
+            return False
+        if self.queued_bytes + len(data) > self.max_bytes:
+            print(f"Bus queue overflow ({self.queued_bytes} bytes), dropping the bus connection")
+            self.abort()
+            return False
+        self.queue.append(data)
+        self.queued_bytes += len(data)
+        self.wakeup.set()
+        return True
+
+    async def run(self):
+        try:
+            while not self.closed or self.queue:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                batch, self.queue = self.queue, []
+                self.queued_bytes = 0
+                self.writer.writelines(batch)
+                await self.writer.drain()
+        except (ConnectionError, OSError) as e:
+            print(f"Bus write error: {e}")
+            self.abort()
+
+    def abort(self):
+        self.closed = True
+        self.queue.clear()
+        self.queued_bytes = 0
+        self.wakeup.set()
+        if not self.writer.transport.is_closing():
+            self.writer.transport.abort()
+
+    async def close(self, timeout=BUS_CLOSE_TIMEOUT):
+        self.closed = True
+        self.wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            self.abort()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+def default_bus_path():
+    return os.path.join(tempfile.gettempdir(), f"chat-bus-{os.getpid()}.sock")
+
+
+class BusBroker:
+    """Шина в родительском процессе: пересылает публикации подписчикам темы."""
+
+    def __init__(self, path):
+        self.path = path
+        self.subscribers = {}  # {тема: set(BusLink)}
+        self.counts = {}       # {комната: {BusLink: число участников}}
+        self.workers = set()   # очереди всех подключенных процессов
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_worker, self.path)
+
+    async def handle_worker(self, reader, writer):
+        link = BusLink(writer)
+        topics = set()
+        self.workers.add(link)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                msg_type, payload = frame
+                if msg_type == BUS_PUBLISH:
+                    topic, _ = split_payload(payload)
+                    data = encode_frame(BUS_PUBLISH, payload)
+                    for subscriber in self.subscribers.get(topic, ()):
+                        if subscriber is not link:
+                            subscriber.send(data)
+                elif msg_type == BUS_SUBSCRIBE:
+                    topic = payload.decode()
+                    topics.add(topic)
+                    self.subscribers.setdefault(topic, set()).add(link)
+                elif msg_type == BUS_UNSUBSCRIBE:
+                    topic = payload.decode()
+                    topics.discard(topic)
+                    self.unsubscribe(topic, link)
+                elif msg_type == BUS_COUNT:
+                    room, count = split_payload(payload)
+                    self.set_count(room, link, int(count))
+        except (ConnectionError, OSError) as e:
+            print(f"Bus worker error: {e}")
+        finally:
+            self.workers.discard(link)
+            for topic in topics:
+                self.unsubscribe(topic, link)
+            for room in [room for room, counts in self.counts.items() if link in counts]:
+                self.set_count(room, link, 0)
+            await link.close()
+
+    def unsubscribe(self, topic, link):
+        subscribers = self.subscribers.get(topic)
+        if subscribers:
+            subscribers.discard(link)
+            if not subscribers:
+                del self.subscribers[topic]
+
+    def set_count(self, room, link, count):
+        counts = self.counts.setdefault(room, {})
+        if count:
+            counts[link] = count
+        else:
+            counts.pop(link, None)
+        total = sum(counts.values())
+        if not counts:
+            del self.counts[room]
+        data = encode_frame(BUS_COUNT, room.encode() + SEPARATOR + str(total).encode())
+        for worker in self.workers:
+            worker.send(data)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class BusClient:
+    """Подключение рабочего процесса к шине."""
+
+    def __init__(self, on_publish, on_count):
+        self.on_publish = on_publish  # callback(тема, данные) для сообщений других процессов
+        self.on_count = on_count      # callback(комната, общее число участников)
+        self.link = None
+        self.task = None
+
+    async def connect(self, path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        self.link = BusLink(writer)
+        self.task = asyncio.create_task(self.listen(reader))
+
+    async def listen(self, reader):
+        while True:
+            frame = await read_frame(reader)
+            if frame is None:
+                raise ConnectionError("Bus connection closed")
+            msg_type, payload = frame
+            topic, data = split_payload(payload)
+            if msg_type == BUS_PUBLISH:
+                self.on_publish(topic, data)
+            elif msg_type == BUS_COUNT:
+                self.on_count(topic, int(data))
+
+    def subscribe(self, topic):
+        self.link.send(encode_frame(BUS_SUBSCRIBE, topic))
+
+    def unsubscribe(self, topic):
+        self.link.send(encode_frame(BUS_UNSUBSCRIBE, topic))
+
+    def publish(self, topic, data):
+        self.link.send(encode_frame(BUS_PUBLISH, topic.encode() + SEPARATOR + data))
+
+    def report_count(self, room, count):
+        self.link.send(encode_frame(BUS_COUNT, f"{room}\0{count}"))
+
+
+def run_cluster(worker_target, processes, args=(), bus_path=None):
+    """Запускает шину и processes рабочих процессов worker_target(*args, номер процесса, bus_path).
+
+    worker_target должен быть функцией уровня модуля: процессы создаются через spawn.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("Cluster mode needs SO_REUSEPORT, which this platform does not have")
+    bus_path = bus_path or default_bus_path()
+
+    async def main():
+        broker = BusBroker(bus_path)
+        await broker.start()
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=worker_target, args=(*args, number, bus_path), daemon=True)
+                   for number in range(processes)]
+        for worker in workers:
+            worker.start()
+        print(f"Cluster: {processes} worker processes, bus at {bus_path}")
+        try:
+            # Шина живет, пока живы рабочие процессы
+            while any(worker.is_alive() for worker in workers):
+                await asyncio.sleep(1)
+        finally:
+            for worker in workers:
+                worker.terminate()
+            await broker.close()
+
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+import base64
+import zlib
+
+from chat_common.framing import HEADER, MAX_FRAME_SIZE
+from chat_common.metrics import METRICS
+
+# Сжатие длинных сообщений, о котором клиент договаривается при подключении.
+#
+# Строковые протоколы (c2, с2): клиент отправляет "/compress zlib", сервер отвечает
+# "/compress zlib" (или "/compress none", если не умеет) и дальше может присылать вместо
+# строк длиннее THRESHOLD строку "/z <base64 от zlib>"; внутри - одна или несколько
+# исходных строк вместе с переводами строк (так сжимается и история комнаты целиком).
+#
+# Протокол с кадрами (chat_2): клиент отправляет кадр MSG_OPTIONS "compress=zlib", сервер
+# отвечает таким же кадром; у сжатого кадра в типе установлен бит COMPRESSED.
+#
+# Рассылка оборачивает сообщение в Packed: сжатие выполняется не больше одного раза
+# на сообщение, и все договорившиеся получатели получают одни и те же байты.
+
+ZLIB = "zlib"
+THRESHOLD = 512  # байт; короткие сообщения не сжимаются
+LEVEL = 6
+
+COMPRESS_COMMAND = "/compress"
+COMPRESSED_PREFIX = b"/z "
+COMPRESSED = 0x80  # бит в типе кадра
+OPTION_COMPRESS = "compress=" + ZLIB
+
+
+def negotiate(command):
+    """Ответ сервера на "/compress алгоритм..." и включается ли сжатие."""
+    enabled = ZLIB in command.split()[1:]
+    return enabled, f"{COMPRESS_COMMAND} {ZLIB if enabled else 'none'}\n".encode()
+
+
+def compress_line(data):
+    """Сжимает строки (байты с переводом строки на конце); несжимаемое возвращается как есть."""
+    packed = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(data, LEVEL)) + b"\n"
+    return packed if len(packed) < len(data) else data
+
+
+def decompress_line(line, max_size=MAX_FRAME_SIZE):
+    """Исходные байты строки "/z ..."; прочие строки возвращаются без изменений."""
+    if not line.startswith(COMPRESSED_PREFIX):
+        return line
+    return inflate(base64.b64decode(line[len(COMPRESSED_PREFIX):].strip()), max_size)
+
+
+def compress_frame(frame):
+    """Сжимает нагрузку готового кадра и ставит бит COMPRESSED; несжимаемое - как есть."""
+    _, msg_type = HEADER.unpack_from(frame)
+    body = zlib.compress(frame[HEADER.size:], LEVEL)
+    if HEADER.size + len(body) >= len(frame):
+        return frame
+    return HEADER.pack(len(body), msg_type | COMPRESSED) + body
+
+
+def unpack_frame(msg_type, payload, max_size=MAX_FRAME_SIZE):
+    """(тип, нагрузка) прочитанного кадра с распакованной нагрузкой."""
+    if msg_type & COMPRESSED:
+        return msg_type & ~COMPRESSED, inflate(payload, max_size)
+    return msg_type, payload
+
+
+def inflate(data, max_size):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"Compressed message is larger than {max_size} bytes")
+    return result
+
+
+class Packed:
+    """Сообщение для рассылки; сжатый вариант считается один раз и только если он нужен."""
+
+    __slots__ = ("data", "compress", "packed")
+
+    def __init__(self, data, compress=compress_line):
+        self.data = data
+        self.compress = compress
+        self.packed = None
+
+    def for_outbox(self, outbox):
+        if not outbox.compress or len(self.data) < THRESHOLD:
+            return self.data
+        if self.packed is None:
+            self.packed = self.compress(self.data)
+            METRICS.inc("chat_compressions_total")
+        return self.packed
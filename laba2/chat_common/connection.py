@@ -0,0 +1,174 @@
+import asyncio
+import random
+from collections import deque
+
+from chat_common.compression import COMPRESS_COMMAND, COMPRESSED_PREFIX, ZLIB, decompress_line
+from chat_common.heartbeat import PING_LINE, PONG_LINE
+from chat_common.history import JOINED_COMMAND, SEQ_PREFIX, SINCE_COMMAND
+
+# Общее клиентское соединение для строковых протоколов (с2, chat_3, c2). Если сервер
+# пропал, соединение переподключается с растущей паузой (BACKOFF_INITIAL, вдвое больше
+# после каждой неудачи, не больше BACKOFF_MAX, со случайным разбросом, чтобы клиенты не
+# ломились одновременно) и заново выполняет вход. Для каждой комнаты запоминается номер
+# последнего сообщения из строк "/seq <номер> <текст>"; при повторном входе сервер получает
+# "/since <номер>" и присылает только пропущенное, а не всю историю.
+#
+# Служебные строки (ping, сжатые /z, номера /seq, /joined) разбираются здесь; клиенту остается
+# текст сообщений. Набранное без соединения отправится после переподключения.
+
+BACKOFF_INITIAL = 0.5  # секунд
+BACKOFF_MAX = 30.0
+BACKOFF_FACTOR = 2
+PENDING_LIMIT = 100    # строк, которые ждут переподключения
+
+
+class Backoff:
+    """Паузы между попытками подключения; reset после удачного подключения."""
+
+    def __init__(self, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX, factor=BACKOFF_FACTOR):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempt = 0
+
+    def next(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempt)
+        self.attempt += 1
+        return delay * random.uniform(0.8, 1.2)
+
+    def reset(self):
+        self.attempt = 0
+
+
+def join_handshake(room, username):
+    """Вход для протокола c2/с2: сжатие, /since для продолжения и /join."""
+    async def handshake(connection):
+        # connection.room сменится, когда сервер подтвердит вход строкой /joined
+        connection.send_line(f"{COMPRESS_COMMAND} {ZLIB}")
+        connection.send_since(room)
+        connection.send_line(f"/join {room} {username}")
+    return handshake
+
+
+class ReconnectingClient:
+    """Соединение, которое само восстанавливается; запускается корутиной run().
+
+    handshake(connection) - корутина, отправляет строки входа после каждого подключения;
+    connection.room задает она же или подтверждение сервера /joined. on_line(text) -
+    сообщение от сервера; on_status(text) - подключение, разрыв, пропущенные сообщения.
+    """
+
+    def __init__(self, host, port, handshake, on_line, on_status=print, backoff=None):
+        self.host = host
+        self.port = port
+        self.handshake = handshake
+        self.on_line = on_line
+        self.on_status = on_status
+        self.backoff = backoff or Backoff()
+        self.room = None
+        self.sequences = {}  # {комната: номер последнего полученного сообщения}
+        self.writer = None
+        self.pending = deque(maxlen=PENDING_LIMIT)
+        self.closing = False
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    def send_line(self, text):
+        """Отправляет строку; без соединения она ждет переподключения. False - отложена."""
+        if not self.connected:
+            self.pending.append(text)
+            return False
+        self.writer.write((text + "\n").encode())
+        return True
+
+    def join(self, room, username):
+        """Переходит в комнату по протоколу c2/с2; после переподключения вход будет в нее же.
+
+        Без соединения меняется только вход: /since и /join отправит handshake при
+        переподключении, а в pending они попали бы второй раз.
+        """
+        self.handshake = join_handshake(room, username)
+        if not self.connected:
+            return
+        # self.room пока прежняя: ее строки /seq могут еще идти, пока сервер не обработал /join
+        self.send_since(room)
+        self.send_line(f"/join {room} {username}")
+
+    def send_since(self, room=None):
+        last = self.sequences.get(self.room if room is None else room)
+        if last is not None:
+            self.send_line(f"{SINCE_COMMAND} {last}")
+
+    async def drain(self):
+        if self.connected:
+            await self.writer.drain()
+
+    async def run(self):
+        while not self.closing:
+            try:
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                await self.retry(f"Connection failed: {e}")
+                continue
+            try:
+                await self.handshake(self)
+                while self.pending and self.connected:
+                    self.writer.write((self.pending.popleft() + "\n").encode())
+                await self.writer.drain()
+                self.backoff.reset()
+                self.on_status("Connected")
+                await self.read_loop(reader)
+            except (ConnectionError, OSError) as e:
+                self.on_status(f"Connection error: {e}")
+            finally:
+                self.writer.close()
+                self.writer = None
+            if not self.closing:
+                await self.retry("Disconnected from server")
+
+    async def retry(self, reason):
+        delay = self.backoff.next()
+        self.on_status(f"{reason}, reconnecting in {delay:.1f} s")
+        await asyncio.sleep(delay)
+
+    async def read_loop(self, reader):
+        while line := await reader.readline():
+            if line == PING_LINE:
+                self.writer.write(PONG_LINE)
+            elif line.startswith(COMPRESSED_PREFIX):
+                # Внутри может быть несколько строк, например пропущенная история целиком
+                for item in decompress_line(line).splitlines():
+                    self.dispatch(item.decode(errors="replace"))
+            else:
+                self.dispatch(line.decode(errors="replace").rstrip("\r\n"))
+
+    def dispatch(self, text):
+        if text.startswith(SEQ_PREFIX):
+            number, _, text = text[len(SEQ_PREFIX):].partition(" ")
+            seq = int(number)
+            last = self.sequences.get(self.room)
+            if last is not None and seq > last + 1:
+                # Пропущенное успело уйти из истории сервера
+                self.on_status(f"{seq - last - 1} messages were missed")
+            self.sequences[self.room] = seq
+        elif text.startswith(JOINED_COMMAND + " "):
+            self.room = text[len(JOINED_COMMAND) + 1:]
+            return
+        elif text.startswith(COMPRESS_COMMAND):
+            return
+        self.on_line(text)
+
+    async def close(self, goodbye="/quit"):
+        """Закрывает соединение без переподключения; goodbye - прощальная строка серверу."""
+        self.closing = True
+        self.pending.clear()
+        if self.connected:
+            if goodbye:
+                self.writer.write((goodbye + "\n").encode())
+            try:
+                await self.writer.drain()
+            except (ConnectionError, OSError):
+                pass
+            self.writer.close()
@@ -0,0 +1,238 @@
+import asyncio
+import base64
+import binascii
+import itertools
+import os
+import tempfile
+import time
+
+from chat_common.metrics import METRICS
+
+# Передача файлов через комнату. Файл загружается на сервер кусками по CHUNK_SIZE байт,
+# лежит в памяти, пока не превысит SPOOL_MEMORY, потом во временном файле на диске
+# (SpooledTemporaryFile), и раздается участникам комнаты по запросу. Отправка каждому
+# получателю идет своей задачей и кладет следующий кусок в его очередь только тогда, когда
+# там осталось меньше STREAM_WINDOW байт: медленный получатель тормозит только свою загрузку,
+# а файл целиком в памяти не держится ни при приеме, ни при раздаче.
+#
+# Протокол (строки, данные в base64; имя файла - в конце строки и может содержать пробелы):
+#   клиент:  /file offer <размер> <имя>         сервер: /file accept <номер> 0
+#            /file chunk <номер> <смещение> <данные>
+#            /file end <номер>                  комнате: /file available <номер> <размер> <отправитель> <имя>
+#            /file resume <номер>               сервер: /file accept <номер> <сколько уже принято>
+#            /file get <номер> [смещение]       сервер: /file data <номер> <смещение> <данные> ... /file done <номер>
+#   ошибки:  /file error <номер или -> <причина>
+# Прерванную загрузку можно продолжить (resume) с принятого смещения, скачивание - запросом get
+# со смещением, равным уже сохраненной части.
+
+FILE_COMMAND = "/file"
+CHUNK_SIZE = 32 * 1024              # байт данных в одной строке; в base64 строка меньше 64 КБ
+SPOOL_MEMORY = 1024 * 1024          # до этого размера файл держится в памяти
+MAX_FILE_SIZE = 100 * 1024 * 1024
+STREAM_WINDOW = 256 * 1024          # байт в очереди получателя, после которых отправка ждет
+FILE_TTL = 600.0                    # секунд хранения файла после последнего обращения
+
+
+def upload_lines(number, path, offset=0):
+    """Строки /file chunk для отправки файла начиная с offset и завершающая /file end.
+
+    Файл читается по куску, поэтому клиент тоже не держит его в памяти целиком.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while chunk := f.read(CHUNK_SIZE):
+            yield f"/file chunk {number} {offset} ".encode() + base64.b64encode(chunk) + b"\n"
+            offset += len(chunk)
+    yield f"/file end {number}\n".encode()
+
+
+class Download:
+    """Прием файла клиентом: куски дописываются в <имя>.part, с которого можно продолжить."""
+
+    def __init__(self, number, name, size, directory):
+        self.number = number
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, os.path.basename(name) or f"file-{number}")
+        self.part = self.path + ".part"
+        self.file = open(self.part, "ab")  # в режиме дозаписи позиция - конец уже принятой части
+        self.waiting_resend = False
+
+    @property
+    def offset(self):
+        return self.file.tell()
+
+    def request(self):
+        return f"/file get {self.number} {self.offset}\n".encode()
+
+    def feed(self, offset, data):
+        """Записывает кусок; False, если он не на своем месте (предыдущий потерялся)."""
+        if offset != self.offset:
+            return False
+        self.file.write(data)
+        self.waiting_resend = False
+        return True
+
+    def finish(self):
+        """True, если файл принят целиком и переименован из .part."""
+        if self.offset != self.size:
+            return False
+        self.file.close()
+        os.replace(self.part, self.path)
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+class Transfer:
+    def __init__(self, number, name, size, sender, room, spool):
+        self.number = number
+        self.name = name
+        self.size = size
+        self.sender = sender
+        self.room = room
+        self.spool = spool
+        self.received = 0
+        self.complete = False
+        self.readers = 0
+        self.touched = time.monotonic()
+
+
+class FileStore:
+    def __init__(self, spool_dir=None, spool_memory=SPOOL_MEMORY, max_size=MAX_FILE_SIZE, ttl=FILE_TTL):
+        self.spool_dir = spool_dir
+        self.spool_memory = spool_memory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.transfers = {}  # {номер: Transfer}
+        self.numbers = itertools.count(1)
+        self.streams = {}    # {(ClientOutbox, номер): задача отправки}
+
+    def command(self, data, username, room, outbox):
+        """Выполняет строку /file ...; возвращает объявление для комнаты или None."""
+        parts = data.split(" ", 4)
+        action = parts[1] if len(parts) > 1 else ""
+        try:
+            if username is None or room is None:
+                raise ValueError("join a room first")
+            if action == "offer":
+                _, _, size, name = data.split(" ", 3)
+                transfer = self.offer(username, room, name, int(size))
+                outbox.send(f"/file accept {transfer.number} 0\n".encode())
+            elif action == "chunk":
+                transfer = self.find(parts, username, room, own=True)
+                self.write(transfer, int(parts[3]), base64.b64decode(parts[4], validate=True))
+            elif action == "end":
+                transfer = self.find(parts, username, room, own=True)
+                self.finish(transfer)
+                return (f"/file available {transfer.number} {transfer.size} {transfer.sender} "
+                        f"{transfer.name}\n").encode()
+            elif action == "resume":
+                transfer = self.find(parts, username, room, own=True)
+                outbox.send(f"/file accept {transfer.number} {transfer.received}\n".encode())
+            elif action == "get":
+                transfer = self.find(parts, username, room)
+                if not transfer.complete:
+                    raise ValueError("upload is not finished")
+                offset = int(parts[3]) if len(parts) > 3 else 0
+                if not 0 <= offset <= transfer.size:
+                    raise ValueError(f"offset must be between 0 and {transfer.size}")
+                self.start_stream(transfer, outbox, offset)
+            else:
+                raise ValueError("unknown command")
+        except (ValueError, IndexError, binascii.Error, OSError) as e:
+            number = parts[2] if len(parts) > 2 and action != "offer" else "-"
+            outbox.send(f"/file error {number} {e}\n".encode())
+        return None
+
+    def offer(self, sender, room, name, size):
+        if not 0 <= size <= self.max_size:
+            raise ValueError(f"file size must be at most {self.max_size} bytes")
+        name = name.strip().replace("/", "_").replace("\\", "_")
+        if not name:
+            raise ValueError("empty file name")
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_memory, dir=self.spool_dir)
+        transfer = Transfer(next(self.numbers), name, size, sender, room, spool)
+        self.transfers[transfer.number] = transfer
+        asyncio.get_running_loop().call_later(self.ttl, self.expire, transfer.number)
+        return transfer
+
+    def find(self, parts, username, room, own=False):
+        transfer = self.transfers.get(int(parts[2]))
+        if transfer is None or transfer.room != room or (own and transfer.sender != username):
+            raise ValueError("no such file")
+        transfer.touched = time.monotonic()
+        return transfer
+
+    def write(self, transfer, offset, chunk):
+        if transfer.complete:
+            raise ValueError("upload is already finished")
+        if offset != transfer.received:
+            # Кусок потерялся или пришел повторно: клиент продолжит с принятого смещения
+            raise ValueError(f"expected offset {transfer.received}")
+        if transfer.received + len(chunk) > transfer.size:
+            raise ValueError("more data than offered")
+        transfer.spool.seek(offset)
+        transfer.spool.write(chunk)
+        transfer.received += len(chunk)
+
+    def finish(self, transfer):
+        if transfer.received != transfer.size:
+            raise ValueError(f"received {transfer.received} of {transfer.size} bytes")
+        transfer.complete = True
+        METRICS.inc("chat_files_total")
+
+    def start_stream(self, transfer, outbox, offset):
+        # Повторный запрос того же файла (например, после потерянного куска) заменяет прежний
+        key = (outbox, transfer.number)
+        previous = self.streams.get(key)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.create_task(self.stream(transfer, outbox, offset))
+        self.streams[key] = task
+        task.add_done_callback(lambda done: self.streams.pop(key, None) if self.streams.get(key) is done else None)
+
+    def cancel_streams(self, outbox):
+        """Останавливает отправки файлов отключившемуся клиенту."""
+        for key, task in list(self.streams.items()):
+            if key[0] is outbox:
+                task.cancel()
+
+    async def stream(self, transfer, outbox, offset):
+        transfer.readers += 1
+        try:
+            while offset < transfer.size:
+                await outbox.wait_below(STREAM_WINDOW)
+                if outbox.closed:
+                    return
+                # Кусок читается синхронно: небольшое чтение, чаще всего из кэша страниц
+                transfer.spool.seek(offset)
+                chunk = transfer.spool.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                outbox.send(f"/file data {transfer.number} {offset} ".encode() + base64.b64encode(chunk) + b"\n")
+                METRICS.inc("chat_file_bytes_out_total", len(chunk))
+                offset += len(chunk)
+            outbox.send(f"/file done {transfer.number}\n".encode())
+        finally:
+            transfer.readers -= 1
+            transfer.touched = time.monotonic()
+
+    def expire(self, number):
+        transfer = self.transfers.get(number)
+        if transfer is None:
+            return
+        idle = time.monotonic() - transfer.touched
+        if transfer.readers or idle < self.ttl:
+            asyncio.get_running_loop().call_later(max(1.0, self.ttl - idle), self.expire, number)
+            return
+        del self.transfers[number]
+        transfer.spool.close()
+
+    def close(self):
+        for task in list(self.streams.values()):
+            task.cancel()
+        for transfer in self.transfers.values():
+            transfer.spool.close()
+        self.transfers.clear()
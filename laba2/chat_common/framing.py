@@ -0,0 +1,73 @@
+import asyncio
+import struct
+
+# Кадр протокола: 4 байта длины полезной нагрузки (big-endian), 1 байт типа, затем нагрузка.
+# Сообщение всегда приходит целиком, поэтому границы чтения сокета и разрезанные
+# многобайтовые символы UTF-8 больше не влияют на разбор.
+
+HEADER = struct.Struct(">IB")
+MAX_FRAME_SIZE = 1024 * 1024
+
+MSG_TEXT = 1     # сообщение пользователя
+MSG_SYSTEM = 2   # служебное сообщение сервера (приветствие, подключения, ошибки)
+MSG_NAME = 3     # клиент сообщает свое имя
+MSG_PING = 4     # проверка живости от сервера, нагрузка пустая
+MSG_PONG = 5     # ответ клиента на MSG_PING
+MSG_OPTIONS = 6  # договоренность о возможностях соединения, например "compress=zlib"
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(msg_type, payload):
+    """Собирает кадр; строка кодируется в UTF-8."""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload), msg_type) + payload
+
+
+class FrameDecoder:
+    """Инкрементальный разбор кадров из потока байтов произвольной нарезки."""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """Добавляет прочитанные байты и возвращает список полностью пришедших кадров (тип, нагрузка)."""
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Frame too large: {length} bytes")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append((msg_type, bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+
+async def read_frame(reader, max_frame_size=MAX_FRAME_SIZE):
+    """Читает один кадр из asyncio.StreamReader; None, если соединение закрыто."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        length, msg_type = HEADER.unpack(header)
+        if length > max_frame_size:
+            raise ProtocolError(f"Frame too large: {length} bytes")
+        payload = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        return None
+    return msg_type, payload
+
+
+async def write_frame(writer, msg_type, payload):
+    writer.write(encode_frame(msg_type, payload))
+    await writer.drain()
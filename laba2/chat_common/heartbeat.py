@@ -0,0 +1,101 @@
+import asyncio
+import math
+import time
+
+from chat_common.metrics import METRICS
+
+# Проверка живости соединений. Сервер помнит, когда от клиента в последний раз что-то
+# приходило; если соединение молчит PING_INTERVAL секунд, ему отправляется ping, на который
+# клиент отвечает pong. Если за PING_TIMEOUT секунд не пришло ничего, соединение считается
+# мертвым (например, клиент пропал без FIN) и разрывается.
+#
+# Все сессии обслуживает одно колесо таймеров с шагом TICK: сессия лежит в ячейке того шага,
+# когда ее пора проверить. touch только запоминает время и ничего не переставляет, поэтому
+# входящие сообщения почти ничего не стоят; за один шаг обходится только одна ячейка, а
+# мертвые сессии этой ячейки отключаются одной пачкой.
+#
+# Строковые протоколы: сервер отправляет "/ping", клиент отвечает "/pong".
+# Протокол с кадрами: MSG_PING и MSG_PONG из chat_common.framing.
+
+PING_INTERVAL = 15.0  # секунд тишины до ping
+PING_TIMEOUT = 45.0   # секунд тишины до отключения
+TICK = 1.0            # шаг колеса, секунд
+
+PING = "/ping"
+PONG = "/pong"
+PING_LINE = (PING + "\n").encode()
+PONG_LINE = (PONG + "\n").encode()
+
+
+def abort_outboxes(outboxes):
+    """Обработчик по умолчанию: разрывает соединения; очистку делают обработчики клиентов."""
+    print(f"Heartbeat: disconnecting {len(outboxes)} stale connections")
+    for outbox in outboxes:
+        outbox.abort()
+
+
+class Heartbeat:
+    def __init__(self, on_stale=abort_outboxes, interval=PING_INTERVAL, timeout=PING_TIMEOUT, tick=TICK):
+        self.on_stale = on_stale
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self.wheel = [set() for _ in range(math.ceil(max(interval, timeout) / tick) + 1)]
+        self.position = 0
+        self.sessions = {}  # {ключ: [время последних данных, функция ping, номер ячейки]}
+        self.handle = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, key, ping):
+        """Начинает следить за соединением key; ping() отправляет клиенту ping."""
+        self.sessions[key] = [time.monotonic(), ping, None]
+        self.schedule(key, self.interval)
+        if self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(self.tick, self.advance)
+
+    def touch(self, key):
+        """От клиента пришли данные."""
+        session = self.sessions.get(key)
+        if session is not None:
+            session[0] = time.monotonic()
+
+    def remove(self, key):
+        session = self.sessions.pop(key, None)
+        if session is not None:
+            self.wheel[session[2]].discard(key)
+
+    def schedule(self, key, delay):
+        steps = min(len(self.wheel) - 1, max(1, math.ceil(delay / self.tick)))
+        slot = (self.position + steps) % len(self.wheel)
+        self.sessions[key][2] = slot
+        self.wheel[slot].add(key)
+
+    def advance(self):
+        self.position = (self.position + 1) % len(self.wheel)
+        due = self.wheel[self.position]
+        self.wheel[self.position] = set()
+        now = time.monotonic()
+        stale = []
+        for key in due:
+            session = self.sessions[key]
+            idle = now - session[0]
+            if idle >= self.timeout:
+                del self.sessions[key]
+                stale.append(key)
+            elif idle >= self.interval:
+                session[1]()
+                self.schedule(key, self.timeout - idle)
+            else:
+                self.schedule(key, self.interval - idle)
+        self.handle = (asyncio.get_running_loop().call_later(self.tick, self.advance)
+                       if self.sessions else None)
+        if stale:
+            METRICS.inc("chat_heartbeat_evictions_total", len(stale))
+            self.on_stale(stale)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
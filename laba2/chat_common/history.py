@@ -0,0 +1,198 @@
+import asyncio
+import os
+import struct
+from collections import OrderedDict, deque
+
+# История комнат. В памяти - последние сообщения каждой комнаты (кольцевой буфер),
+# на диске - журнал из сегментов, куда сообщения только дописываются. Запись на диск
+# сбрасывается через fsync пачками раз в FSYNC_INTERVAL в отдельном потоке, чтобы
+# цикл событий не ждал диск. При запуске буферы восстанавливаются из журнала.
+# Общий объем истории в памяти ограничен: при превышении выбрасываются самые старые
+# сообщения комнат, в которых дольше всего ничего не писали.
+#
+# У каждого сообщения комнаты есть порядковый номер (1, 2, ...), он хранится в журнале и
+# переживает перезапуск сервера. Переподключившийся клиент получает только сообщения
+# с номерами больше последнего, который он видел (replay с after).
+#
+# Сегмент начинается с SEGMENT_MAGIC, дальше записи: 2 байта длины имени комнаты,
+# 4 байта длины сообщения, 8 байт номера, имя, сообщение. Сегменты прежнего формата
+# (без метки и без номеров в записях) читаются при запуске, их сообщения нумеруются
+# по порядку; новые записи всегда идут в сегменты нового формата.
+
+SEGMENT_MAGIC = b"CHATLOG2"
+RECORD_HEADER = struct.Struct(">HIQ")
+OLD_RECORD_HEADER = struct.Struct(">HI")
+
+# Сообщения с номером уходят клиентам строкой "/seq <номер> <текст>"; клиент, который
+# переподключается, до входа в комнату отправляет "/since <последний номер>"
+SEQ_PREFIX = "/seq "
+SINCE_COMMAND = "/since"
+# Сервер с командой /join подтверждает вход строкой "/joined <комната>" до пропущенной истории:
+# с нее клиент относит номера /seq к новой комнате (строки старой могли быть еще в пути)
+JOINED_COMMAND = "/joined"
+
+PER_ROOM = 50                       # сообщений на комнату
+MAX_MEMORY = 8 * 1024 * 1024        # байт на всю историю в памяти
+FSYNC_INTERVAL = 1.0                # секунд между сбросами журнала на диск
+SEGMENT_SIZE = 16 * 1024 * 1024     # размер сегмента журнала, после которого начинается новый
+MAX_SEGMENTS = 8                    # сколько сегментов хранить
+
+
+def segment_number(path):
+    # segment-000012.log -> 12
+    return int(os.path.basename(path)[len("segment-"):-len(".log")])
+
+
+class RoomHistory:
+    def __init__(self, directory=None, per_room=PER_ROOM, max_memory=MAX_MEMORY,
+                 fsync_interval=FSYNC_INTERVAL, segment_size=SEGMENT_SIZE, max_segments=MAX_SEGMENTS):
+        self.per_room = per_room
+        self.max_memory = max_memory
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.rooms = OrderedDict()  # {комната: deque((номер, сообщение))}, в конце - последние активные
+        self.sequences = {}  # {комната: номер последнего сообщения}
+        self.memory = 0
+        self.directory = directory
+        self.file = None
+        self.flush_handle = None
+        self.flush_task = None
+        self.dirty = False  # в журнал дописано то, что еще не сброшено на диск
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.load()
+            segments = self.segments()
+            self.open_segment(segment_number(segments[-1]) + 1 if segments else 1)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name.endswith(".log"))
+
+    def open_segment(self, number):
+        self.file = open(os.path.join(self.directory, f"segment-{number:06d}.log"), "ab")
+        if self.file.tell() == 0:
+            self.file.write(SEGMENT_MAGIC)
+        segments = self.segments()
+        for name in segments[:max(0, len(segments) - self.max_segments)]:
+            os.remove(os.path.join(self.directory, name))
+
+    def load(self):
+        """Заполняет буферы комнат из журнала; оборванная последняя запись пропускается."""
+        for name in self.segments():
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = f.read()
+            if data.startswith(SEGMENT_MAGIC):
+                self.load_records(data, len(SEGMENT_MAGIC), RECORD_HEADER)
+            else:
+                self.load_records(data, 0, OLD_RECORD_HEADER)
+
+    def load_records(self, data, offset, header):
+        while offset + header.size <= len(data):
+            room_length, length, *seq = header.unpack_from(data, offset)
+            start = offset + header.size
+            end = start + room_length + length
+            if end > len(data):
+                break
+            try:
+                room = data[start:start + room_length].decode()
+            except UnicodeDecodeError:
+                break  # поврежденный сегмент: остаток пропускаем
+            # В записях прежнего формата номера нет: продолжаем нумерацию комнаты
+            seq = seq[0] if seq else self.sequences.get(room, 0) + 1
+            self.remember(room, seq, data[start + room_length:end])
+            self.sequences[room] = max(self.sequences.get(room, 0), seq)
+            offset = end
+
+    def remember(self, room, seq, data):
+        messages = self.rooms.get(room)
+        if messages is None:
+            messages = self.rooms[room] = deque()
+        else:
+            self.rooms.move_to_end(room)
+        messages.append((seq, data))
+        self.memory += len(data)
+        if len(messages) > self.per_room:
+            self.memory -= len(messages.popleft()[1])
+        # Освобождаем память за счет комнат, где дольше всего не писали
+        while self.memory > self.max_memory and self.rooms:
+            oldest_room, oldest = next(iter(self.rooms.items()))
+            self.memory -= len(oldest.popleft()[1])
+            if not oldest:
+                # Вместе с буфером забываем и счетчик, иначе он копится для каждой комнаты,
+                # которая когда-либо была; нумерация комнаты начнется заново с 1
+                del self.rooms[oldest_room]
+                self.sequences.pop(oldest_room, None)
+
+    def next_sequence(self, room):
+        """Выдает номер следующего сообщения комнаты (чтобы вставить его в само сообщение)."""
+        room = str(room)
+        seq = self.sequences[room] = self.sequences.get(room, 0) + 1
+        return seq
+
+    def append(self, room, data, seq=None):
+        """Сохраняет сообщение комнаты (готовые байты, как они уходят клиентам); возвращает номер."""
+        room = str(room)
+        if seq is None:
+            seq = self.next_sequence(room)
+        self.remember(room, seq, data)
+        if self.file is not None:
+            name = room.encode()
+            self.file.write(RECORD_HEADER.pack(len(name), len(data), seq) + name + data)
+            self.dirty = True
+            if self.flush_handle is None and self.flush_task is None:
+                self.schedule_flush()
+        return seq
+
+    def replay(self, room, after=None):
+        """Последние сообщения комнаты одним блоком байтов для одной записи в сокет.
+
+        after - номер последнего сообщения, которое клиент уже видел: тогда только более новые.
+        Если after больше текущего номера комнаты, нумерация началась заново (комната
+        вытеснялась из памяти), и клиент получает все, что есть.
+        """
+        room = str(room)
+        messages = self.rooms.get(room, ())
+        if after is None or after > self.sequences.get(room, 0):
+            return b"".join(data for _, data in messages)
+        return b"".join(data for seq, data in messages if seq > after)
+
+    def schedule_flush(self):
+        self.flush_handle = asyncio.get_running_loop().call_later(self.fsync_interval, self.start_flush)
+
+    def start_flush(self):
+        self.flush_handle = None
+        self.flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        if self.file is None:
+            self.flush_task = None
+            return
+        self.dirty = False
+        try:
+            self.file.flush()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, self.file.fileno())
+            if self.file is not None and self.file.tell() >= self.segment_size:
+                number = segment_number(self.file.name) + 1
+                self.close_segment()
+                self.open_segment(number)
+        except OSError as e:
+            print(f"History log error: {e}")
+        finally:
+            self.flush_task = None
+            # Сообщения, пришедшие во время fsync, уйдут следующей пачкой
+            if self.dirty and self.file is not None:
+                self.schedule_flush()
+
+    def close_segment(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.file is not None:
+            self.close_segment()
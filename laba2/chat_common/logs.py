@@ -0,0 +1,131 @@
+import atexit
+import itertools
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler
+
+# Журнал, который не тормозит обработку сообщений. Логгеры только кладут записи
+# в очередь (QueueHandler), а фоновый поток забирает их пачками до BATCH_SIZE штук
+# или за FLUSH_INTERVAL секунд и пишет каждую пачку в файл и на консоль одной записью
+# с одним flush. Для частых событий (каждое сообщение чата) есть выборка: SampleFilter
+# пропускает одну запись из N, а проверка уровня до форматирования (isEnabledFor или
+# ленивые аргументы %s) ничего не стоит, когда уровень выключен.
+
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5  # секунд
+FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_STOP = object()
+_writer = None
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает одну запись из every; предупреждения и ошибки проходят всегда."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self.counter) % self.every == 0
+
+
+class BatchWriter(threading.Thread):
+    def __init__(self, records, handlers, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        super().__init__(name="log-writer", daemon=True)
+        self.records = records
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            record = self.records.get()
+            if record is _STOP:
+                break
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.records.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            self.write(batch)
+
+    def write(self, batch):
+        for handler in self.handlers:
+            text = "".join(handler.format(record) + "\n" for record in batch if record.levelno >= handler.level)
+            if not text:
+                continue
+            handler.acquire()
+            try:
+                handler.stream.write(text)
+                handler.flush()
+            except (OSError, ValueError):
+                handler.handleError(batch[-1])
+            finally:
+                handler.release()
+
+    def stop(self):
+        self.records.put(_STOP)
+        self.join(timeout=5)
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(filename=None, level=logging.INFO, console=True,
+                  batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+    """Направляет корневой логгер в фоновую запись: в файл filename и/или на консоль."""
+    global _writer
+    if _writer is not None:
+        stop_logging()
+    formatter = logging.Formatter(FORMAT, DATE_FORMAT)
+    handlers = []
+    if filename:
+        handlers.append(logging.FileHandler(filename, encoding="utf-8"))
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(level)
+
+    _writer = BatchWriter(records, handlers, batch_size, flush_interval)
+    _writer.start()
+    return _writer
+
+
+def sample(logger_name, every):
+    """Оставляет в журнале одну запись из every для логгера частых событий."""
+    logger = logging.getLogger(logger_name)
+    for existing in [f for f in logger.filters if isinstance(f, SampleFilter)]:
+        logger.removeFilter(existing)
+    if every > 1:
+        logger.addFilter(SampleFilter(every))
+    return logger
+
+
+def stop_logging():
+    """Дописывает очередь и останавливает фоновый поток."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+atexit.register(stop_logging)
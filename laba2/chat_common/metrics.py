@@ -0,0 +1,136 @@
+import asyncio
+import bisect
+import time
+
+# Метрики сервера в текстовом формате Prometheus, отдаются по HTTP на отдельном локальном порту:
+#   curl http://127.0.0.1:9104/metrics
+# Счетчики только растут (скорость считает тот, кто их собирает), текущие значения
+# (подключения, комнаты, очереди) вычисляются в момент запроса функциями сервера.
+# Один набор метрик на процесс: METRICS.
+
+DRAIN_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+MAX_ROOM_LABELS = 100  # комнат с отдельной строкой chat_room_members, самые большие
+
+COUNTER_HELP = {
+    "chat_messages_in_total": "Messages received from clients",
+    "chat_messages_out_total": "Messages queued to clients",
+    "chat_messages_dropped_total": "Messages dropped because a client queue was full",
+    "chat_overflow_disconnects_total": "Clients disconnected because their queue was full",
+    "chat_connections_total": "Accepted connections",
+    "chat_writes_total": "Batched socket writes made by client outboxes",
+    "chat_throttled_delayed_total": "Messages delayed by rate limits",
+    "chat_throttled_rejected_total": "Messages rejected by rate limits",
+    "chat_throttled_senders_total": "Times a connection went over its rate limit",
+    "chat_compressions_total": "Broadcast messages compressed for clients that negotiated compression",
+    "chat_files_total": "Files uploaded to rooms",
+    "chat_file_bytes_out_total": "File bytes streamed to clients",
+    "chat_heartbeat_evictions_total": "Connections closed because they sent nothing within the heartbeat timeout",
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, help_text):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.total}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTER_HELP, 0)
+        self.drain_wait = Histogram(DRAIN_BUCKETS)
+        self.started = time.time()
+        self.outboxes = set()  # открытые ClientOutbox, для глубины очередей
+        self.collectors = []   # функции сервера, возвращают [(имя, {метка: значение}, значение)]
+
+    def inc(self, name, value=1):
+        self.counters[name] += value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for name, value in self.counters.items():
+            lines += [f"# HELP {name} {COUNTER_HELP[name]}", f"# TYPE {name} counter", f"{name} {value}"]
+        lines += self.drain_wait.render("chat_drain_wait_seconds", "Time spent waiting for socket drain")
+
+        depths = [len(outbox) for outbox in self.outboxes]
+        lines += [
+            "# TYPE chat_outbox_queued_messages gauge",
+            f"chat_outbox_queued_messages {sum(depths)}",
+            "# TYPE chat_outbox_queued_max gauge",
+            f"chat_outbox_queued_max {max(depths, default=0)}",
+            "# TYPE chat_outbox_queued_bytes gauge",
+            f"chat_outbox_queued_bytes {sum(outbox.queued_bytes for outbox in self.outboxes)}",
+            "# TYPE chat_uptime_seconds gauge",
+            f"chat_uptime_seconds {time.time() - self.started:.1f}",
+        ]
+        declared = set()
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                if name not in declared:
+                    lines.append(f"# TYPE {name} gauge")
+                    declared.add(name)
+                if labels:
+                    text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                    lines.append(f"{name}{{{text}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def room_gauges(connections, rooms):
+    """Типовой набор текущих значений: подключения, комнаты и участники самых больших комнат.
+
+    rooms - {комната: участники}.
+    """
+    largest = sorted(rooms.items(), key=lambda item: len(item[1]), reverse=True)[:MAX_ROOM_LABELS]
+    return ([("chat_connections", {}, connections), ("chat_rooms", {}, len(rooms))]
+            + [("chat_room_members", {"room": room}, len(members)) for room, members in largest])
+
+
+async def handle_scrape(reader, writer):
+    try:
+        # Заголовки запроса не нужны; простой TCP-клиент тоже получит ответ
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=1)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    body = METRICS.render().encode()
+    writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                 + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def serve_metrics(port, host="127.0.0.1"):
+    server = await asyncio.start_server(handle_scrape, host, port)
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from collections import deque
+
+from chat_common.metrics import METRICS
+
+# Исходящая очередь клиента. Рассылка только кладет готовые байты в очереди получателей
+# и сразу идет дальше, а в сокет пишет отдельная задача каждого клиента. Поэтому
+# медленный получатель задерживает только свою очередь, а не всю комнату.
+#
+# Склейка (coalesce_window > 0): если предыдущая запись была меньше coalesce_window
+# секунд назад, задача ждет до конца окна или пока в очереди не наберется coalesce_bytes,
+# и отправляет все одним writelines. Редкие сообщения уходят сразу, а в активной комнате
+# задержка не больше окна, зато системных вызовов в разы меньше.
+
+DROP_OLDEST = "drop-oldest"   # при переполнении выбрасывать самые старые сообщения
+DISCONNECT = "disconnect"     # при переполнении отключать клиента
+
+DEFAULT_MAX_MESSAGES = 1000
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+CLOSE_TIMEOUT = 5.0
+COALESCE_WINDOW = 0.001             # секунд, типичное окно склейки (по умолчанию склейка выключена)
+DEFAULT_COALESCE_BYTES = 64 * 1024  # столько байт в очереди отправляются, не дожидаясь конца окна
+
+
+class ClientOutbox:
+    """Ограниченная очередь исходящих сообщений и задача записи для одного соединения."""
+
+    def __init__(self, writer, max_messages=DEFAULT_MAX_MESSAGES, max_bytes=DEFAULT_MAX_BYTES,
+                 overflow=DROP_OLDEST, coalesce_window=0, coalesce_bytes=DEFAULT_COALESCE_BYTES):
+        if overflow not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.writer = writer
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self.compress = False  # клиент согласился получать сжатые сообщения (chat_common/compression.py)
+        self.coalesce_window = coalesce_window
+        self.coalesce_bytes = coalesce_bytes
+        self.last_write = 0.0
+        self.window_waiter = None  # future, которую send завершает досрочно при наборе coalesce_bytes
+        self.space_waiter = None   # future для wait_below, завершается после очередной записи
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        METRICS.outboxes.add(self)
+        self.task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self.queue)
+
+    def send(self, data):
+        """Ставит байты в очередь, не дожидаясь записи. False, если сообщение не принято."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_messages or self.queued_bytes + len(data) > self.max_bytes:
+            if self.overflow == DISCONNECT:
+                print(f"Outbound queue overflow, disconnecting {self.peer()}")
+                METRICS.inc("chat_overflow_disconnects_total")
+                self.abort()
+                return False
+            while self.queue and (len(self.queue) >= self.max_messages
+                                  or self.queued_bytes + len(data) > self.max_bytes):
+                self.queued_bytes -= len(self.queue.popleft())
+                self.dropped += 1
+                METRICS.inc("chat_messages_dropped_total")
+        self.queue.append(data)
+        self.queued_bytes += len(data)
+        METRICS.inc("chat_messages_out_total")
+        self.wakeup.set()
+        if self.window_waiter is not None and self.queued_bytes >= self.coalesce_bytes:
+            self.end_window()
+        return True
+
+    async def wait_below(self, limit):
+        """Ждет, пока в очереди останется не больше limit байт (или соединение закроется).
+
+        Для потоковой отправки больших данных: следующий кусок ставится в очередь, только
+        когда получатель забрал предыдущие.
+        """
+        while self.queued_bytes > limit and not self.closed:
+            if self.space_waiter is None:
+                self.space_waiter = asyncio.get_running_loop().create_future()
+            await self.space_waiter
+
+    def wake_space(self):
+        if self.space_waiter is not None:
+            if not self.space_waiter.done():
+                self.space_waiter.set_result(None)
+            self.space_waiter = None
+
+    def end_window(self):
+        if self.window_waiter is not None and not self.window_waiter.done():
+            self.window_waiter.set_result(None)
+
+    async def wait_window(self):
+        """Ждет конца окна склейки, если предыдущая запись была недавно."""
+        loop = asyncio.get_running_loop()
+        delay = self.last_write + self.coalesce_window - loop.time()
+        if delay <= 0 or self.queued_bytes >= self.coalesce_bytes:
+            return
+        self.window_waiter = loop.create_future()
+        timer = loop.call_later(delay, self.end_window)
+        try:
+            await self.window_waiter
+        finally:
+            timer.cancel()
+            self.window_waiter = None
+
+    async def _run(self):
+        try:
+            while not self.closed or self.queue:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                if self.coalesce_window and not self.closed:
+                    await self.wait_window()
+                    if not self.queue:
+                        continue
+                # Все, что накопилось за время предыдущей записи, уходит одним writelines
+                batch = list(self.queue)
+                self.queue.clear()
+                self.queued_bytes = 0
+                self.writer.writelines(batch)
+                METRICS.inc("chat_writes_total")
+                self.last_write = asyncio.get_running_loop().time()
+                started = time.perf_counter()
+                await self.writer.drain()
+                METRICS.drain_wait.observe(time.perf_counter() - started)
+                self.wake_space()
+        except (ConnectionError, OSError) as e:
+            print(f"Error writing to {self.peer()}: {e}")
+            self.abort()
+        finally:
+            self.wake_space()
+            METRICS.outboxes.discard(self)
+
+    def peer(self):
+        return self.writer.get_extra_info('peername')
+
+    def abort(self):
+        """Разрывает соединение сразу, недоставленные сообщения теряются."""
+        self.closed = True
+        self.queue.clear()
+        self.queued_bytes = 0
+        self.wakeup.set()
+        self.end_window()
+        self.wake_space()
+        transport = self.writer.transport
+        if not transport.is_closing():
+            transport.abort()
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """Дописывает очередь (не дольше timeout секунд) и закрывает соединение."""
+        self.closed = True
+        self.wakeup.set()
+        self.end_window()
+        self.wake_space()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.task), timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            self.abort()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
@@ -0,0 +1,92 @@
+import asyncio
+
+# Список комнат для клиентов. Новый подписчик сразу получает полный список (/rooms),
+# а дальше только изменения (/roomdelta), и только когда кто-то вошел или вышел.
+# Изменения за короткое окно собираются в одну строку: вход и выход в пределах окна
+# не порождают ни одного сообщения, а сервер без активности ничего не рассылает.
+#
+#   /rooms a (2 users),b (1 users)
+#   /roomdelta a=3,b=0              (0 - комната исчезла)
+
+COALESCE_WINDOW = 0.25  # секунд
+
+
+def format_snapshot(counts):
+    return "/rooms " + ",".join(f"{room} ({count} users)" for room, count in counts.items())
+
+
+def format_delta(changes):
+    return "/roomdelta " + ",".join(f"{room}={count}" for room, count in changes)
+
+
+def parse_rooms(line, counts):
+    """Применяет строку /rooms или /roomdelta к словарю {комната: число участников}.
+
+    Возвращает False, если строка не относится к списку комнат.
+    """
+    command, _, body = line.strip().partition(" ")
+    if command == "/rooms":
+        counts.clear()
+        for entry in filter(None, body.split(",")):
+            room, _, users = entry.rpartition(" (")
+            counts[room] = int(users.split()[0])
+        return True
+    if command == "/roomdelta":
+        for entry in filter(None, body.split(",")):
+            room, _, count = entry.rpartition("=")
+            if int(count):
+                counts[room] = int(count)
+            else:
+                counts.pop(room, None)
+        return True
+    return False
+
+
+class RoomPresence:
+    """Рассылка изменений списка комнат подписчикам (ClientOutbox)."""
+
+    def __init__(self, rooms, window=COALESCE_WINDOW, count=None):
+        self.rooms = rooms  # словарь сервера {комната: участники}, читается только len()
+        self.window = window
+        # Число участников комнаты; в кластере его подставляет сервер из общих данных шины
+        self.count = count or (lambda room: len(self.rooms.get(room, ())))
+        self.subscribers = set()
+        self.sent = {}  # {комната: число участников, о котором клиенты уже знают}
+        self.changed = set()
+        self.flush_handle = None
+
+    def subscribe(self, outbox):
+        outbox.send((format_snapshot(self.sent) + "\n").encode())
+        self.subscribers.add(outbox)
+
+    def unsubscribe(self, outbox):
+        self.subscribers.discard(outbox)
+
+    def mark(self, room):
+        """Отмечает, что состав комнаты изменился; рассылка - после окна."""
+        self.changed.add(room)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        changes = []
+        for room in self.changed:
+            count = self.count(room)
+            if count != self.sent.get(room, 0):
+                changes.append((room, count))
+                if count:
+                    self.sent[room] = count
+                else:
+                    del self.sent[room]
+        self.changed.clear()
+        if not changes:
+            return
+        data = (format_delta(changes) + "\n").encode()
+        for outbox in self.subscribers:
+            outbox.send(data)
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
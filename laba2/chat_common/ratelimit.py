@@ -0,0 +1,86 @@
+import time
+
+from chat_common.metrics import METRICS
+
+# Ограничение частоты сообщений корзинами жетонов: у каждого соединения своя корзина,
+# у каждой комнаты - общая на всех отправителей. Сообщение проверяется до рассылки.
+# Превышение сначала задерживается: жетон берется в долг, и сервер перестает читать
+# сокет, пока долг не погасится (клиента тормозит TCP). Если ждать дольше max_delay,
+# сообщение отклоняется. rate=0 - без ограничения.
+
+CLIENT_RATE = 20     # сообщений в секунду от одного соединения
+CLIENT_BURST = 40
+ROOM_RATE = 200      # сообщений в секунду в одну комнату от всех
+ROOM_BURST = 400
+MAX_DELAY = 0.5      # секунд; 0 - отклонять сразу, без задержки
+
+RATE_LIMIT_NOTICE = "[ERROR] Too many messages, slow down."
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.throttled = False  # последнее сообщение соединения было задержано или отклонено
+        self.rejected = 0       # отклонено подряд
+
+    def reserve(self, now):
+        """Берет жетон, возможно в долг; возвращает, сколько секунд ждать погашения долга."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens += 1
+
+
+class RateLimiter:
+    def __init__(self, client_rate=CLIENT_RATE, client_burst=CLIENT_BURST, room_rate=ROOM_RATE,
+                 room_burst=ROOM_BURST, max_delay=MAX_DELAY):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.max_delay = max_delay
+        self.rooms = {}  # {комната: TokenBucket}
+
+    def client_bucket(self):
+        """Корзина для нового соединения; None, если соединения не ограничены."""
+        return TokenBucket(self.client_rate, self.client_burst) if self.client_rate else None
+
+    def room_bucket(self, room):
+        if not self.room_rate or room is None:
+            return None
+        bucket = self.rooms.get(room)
+        if bucket is None:
+            bucket = self.rooms[room] = TokenBucket(self.room_rate, self.room_burst)
+        return bucket
+
+    def forget_room(self, room):
+        self.rooms.pop(room, None)
+
+    def check(self, client, room=None):
+        """Секунды, которые нужно подождать перед рассылкой (обычно 0), или None - отклонить."""
+        buckets = [bucket for bucket in (client, self.room_bucket(room)) if bucket is not None]
+        # Время - после создания корзины комнаты, иначе новая корзина начинает с долга
+        now = time.monotonic()
+        delay = max([bucket.reserve(now) for bucket in buckets], default=0.0)
+        if client is not None:
+            if delay and not client.throttled:
+                METRICS.inc("chat_throttled_senders_total")
+            client.throttled = delay > 0
+        if delay > self.max_delay:
+            for bucket in buckets:
+                bucket.refund()
+            METRICS.inc("chat_throttled_rejected_total")
+            if client is not None:
+                client.rejected += 1
+            return None
+        if client is not None:
+            client.rejected = 0
+        if delay:
+            METRICS.inc("chat_throttled_delayed_total")
+        return delay
@@ -0,0 +1,26 @@
+from chat_common.connection import Backoff, ReconnectingClient
+from chat_common.history import JOINED_COMMAND
+
+
+def test_backoff_grows_to_maximum_and_resets():
+    backoff = Backoff(initial=1, maximum=8, factor=2)
+    delays = [backoff.next() for _ in range(6)]
+    for delay, expected in zip(delays, (1, 2, 4, 8, 8, 8)):
+        assert 0.8 * expected <= delay <= 1.2 * expected
+    backoff.reset()
+    assert 0.8 <= backoff.next() <= 1.2
+
+
+def test_sequences_follow_the_confirmed_room():
+    lines, statuses = [], []
+    client = ReconnectingClient("localhost", 0, None, lines.append, on_status=statuses.append)
+    client.dispatch(f"{JOINED_COMMAND} a")
+    client.dispatch("/seq 1 ant: hi")
+    # /join b уже отправлен, но строки комнаты a еще в пути
+    client.dispatch("/seq 2 ant: still a")
+    client.dispatch(f"{JOINED_COMMAND} b")
+    client.dispatch("/seq 7 bee: history of b")
+    client.dispatch("/seq 9 bee: new")
+    assert client.sequences == {"a": 2, "b": 9}
+    assert lines == ["ant: hi", "ant: still a", "bee: history of b", "bee: new"]
+    assert statuses == ["1 messages were missed"]
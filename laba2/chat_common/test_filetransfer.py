@@ -0,0 +1,83 @@
+import asyncio
+import base64
+
+from chat_common.filetransfer import CHUNK_SIZE, Download, FileStore, upload_lines
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.queued_bytes = 0
+
+    def send(self, data):
+        self.sent.append(data)
+        return True
+
+    async def wait_below(self, limit):
+        await asyncio.sleep(0)
+
+
+def upload(store, outbox, data, path):
+    path.write_bytes(data)
+    store.command(f"/file offer {len(data)} {path.name}", "alice", "1", outbox)
+    for line in upload_lines(1, path):
+        store.command(line.decode().strip(), "alice", "1", outbox)
+
+
+def test_upload_then_download_from_offset(tmp_path):
+    data = bytes(range(256)) * (CHUNK_SIZE // 128)
+
+    async def run():
+        store, outbox = FileStore(), FakeOutbox()
+        upload(store, outbox, data, tmp_path / "a.bin")
+        assert outbox.sent[0] == b"/file accept 1 0\n"
+
+        download = Download(1, "a.bin", len(data), str(tmp_path / "in"))
+        download.feed(0, data[:1000])
+        store.command(download.request().decode().strip(), "bob", "1", outbox)
+        await asyncio.sleep(0.05)
+        for line in outbox.sent[1:]:
+            parts = line.decode().split()
+            if parts[1] == "data":
+                assert download.feed(int(parts[3]), base64.b64decode(parts[4]))
+        assert outbox.sent[-1] == b"/file done 1\n"
+        assert download.finish()
+        store.close()
+
+    asyncio.run(run())
+    assert (tmp_path / "in" / "a.bin").read_bytes() == data
+
+
+def test_bad_offsets_are_rejected_before_streaming(tmp_path):
+    async def run():
+        store, outbox = FileStore(), FakeOutbox()
+        upload(store, outbox, b"x" * 100, tmp_path / "a.bin")
+        outbox.sent.clear()
+        for offset in ("-1", "101", "abc"):
+            store.command(f"/file get 1 {offset}", "bob", "1", outbox)
+        assert all(line.startswith(b"/file error 1 ") for line in outbox.sent)
+        assert len(outbox.sent) == 3 and not store.streams
+        # Другой комнате файл не виден, а загрузку с чужого смещения сервер не принимает
+        store.command("/file get 1", "bob", "2", outbox)
+        store.command("/file chunk 1 5 eHh4", "alice", "1", outbox)
+        assert outbox.sent[3] == b"/file error 1 no such file\n"
+        assert outbox.sent[4].startswith(b"/file error 1 ")
+        store.close()
+
+    asyncio.run(run())
+
+
+def test_cancel_streams_of_a_client(tmp_path):
+    async def run():
+        store, outbox = FileStore(), FakeOutbox()
+        upload(store, outbox, b"x" * (4 * CHUNK_SIZE), tmp_path / "a.bin")
+        store.command("/file get 1", "bob", "1", outbox)
+        task, = store.streams.values()
+        store.cancel_streams(outbox)
+        await asyncio.sleep(0.01)
+        assert task.cancelled() and not store.streams
+        assert b"/file done 1\n" not in outbox.sent
+        store.close()
+
+    asyncio.run(run())
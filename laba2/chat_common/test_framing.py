@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from chat_common.framing import (HEADER, MAX_FRAME_SIZE, MSG_PING, MSG_TEXT, FrameDecoder, ProtocolError,
+                                 encode_frame, read_frame)
+
+
+def test_round_trip_with_any_split():
+    data = encode_frame(MSG_TEXT, "привет") + encode_frame(MSG_PING, b"") + encode_frame(MSG_TEXT, "x" * 1000)
+    # Кадры собираются при любой нарезке потока, в том числе посреди символа UTF-8
+    for step in (1, 2, 3, 7, len(data)):
+        decoder = FrameDecoder()
+        frames = []
+        for start in range(0, len(data), step):
+            frames += decoder.feed(data[start:start + step])
+        assert frames == [(MSG_TEXT, "привет".encode()), (MSG_PING, b""), (MSG_TEXT, b"x" * 1000)]
+        assert not decoder.buffer
+
+
+def test_oversized_frames_are_rejected():
+    with pytest.raises(ProtocolError):
+        encode_frame(MSG_TEXT, b"x" * (MAX_FRAME_SIZE + 1))
+    decoder = FrameDecoder(max_frame_size=10)
+    with pytest.raises(ProtocolError):
+        decoder.feed(HEADER.pack(11, MSG_TEXT))
+
+
+def test_read_frame():
+    async def read_all(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return [await read_frame(reader), await read_frame(reader)]
+
+    assert asyncio.run(read_all(encode_frame(MSG_TEXT, "a"))) == [(MSG_TEXT, b"a"), None]
+    # Оборванный кадр - то же, что закрытое соединение
+    assert asyncio.run(read_all(encode_frame(MSG_TEXT, "abc")[:-1])) == [None, None]
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+from chat_common.history import OLD_RECORD_HEADER, RoomHistory
+
+
+def test_replay_after_sequence():
+    history = RoomHistory(per_room=3)
+    for text in (b"a\n", b"b\n", b"c\n", b"d\n"):
+        history.append("1", text)
+    # В буфере только последние per_room сообщений
+    assert history.replay("1") == b"b\nc\nd\n"
+    assert history.replay(1, after=3) == b"d\n"
+    assert history.replay("1", after=4) == b""
+    assert history.replay("2") == b""
+
+
+def append_all(directory, messages):
+    # С журналом на диске запись сбрасывается задачей цикла событий, как на сервере
+    async def run():
+        history = RoomHistory(directory)
+        for room, data in messages:
+            history.append(room, data)
+        history.close()
+    asyncio.run(run())
+
+
+def test_reload_from_segments(tmp_path):
+    append_all(str(tmp_path), [("1", b"a\n"), ("2", b"b\n"), ("1", b"c\n")])
+
+    reloaded = RoomHistory(str(tmp_path))
+    assert reloaded.replay("1") == b"a\nc\n"
+    assert reloaded.replay("1", after=1) == b"c\n"
+    # Нумерация продолжается с сохраненного номера
+    assert reloaded.next_sequence("1") == 3
+    reloaded.close()
+
+
+def test_old_segments_are_numbered_in_order(tmp_path):
+    with open(os.path.join(tmp_path, "segment-000001.log"), "wb") as f:
+        for text in (b"a\n", b"b\n"):
+            f.write(OLD_RECORD_HEADER.pack(1, len(text)) + b"7" + text)
+        f.write(OLD_RECORD_HEADER.pack(1, 100) + b"7")  # оборванная последняя запись
+
+    history = RoomHistory(str(tmp_path))
+    assert history.replay("7") == b"a\nb\n"
+    assert history.replay("7", after=1) == b"b\n"
+    assert history.next_sequence("7") == 3
+    history.close()
+
+    append_all(str(tmp_path), [("7", b"c\n")])
+
+    reloaded = RoomHistory(str(tmp_path))
+    assert reloaded.replay("7", after=2) == b"c\n"
+    reloaded.close()
+
+
+def test_evicted_room_forgets_its_sequence():
+    history = RoomHistory(max_memory=20)
+    for _ in range(3):
+        history.append("1", b"aaaaa\n")
+    for _ in range(3):
+        history.append("2", b"bbbbbb\n")
+    assert "1" not in history.rooms and "1" not in history.sequences
+    # Нумерация комнаты началась заново: клиент с большим номером получает все, что есть
+    assert history.append("1", b"x\n") == 1
+    assert history.replay("1", after=3) == b"x\n"
@@ -0,0 +1,89 @@
+import asyncio
+
+from chat_common.metrics import METRICS
+from chat_common.outbox import DISCONNECT, DROP_OLDEST, ClientOutbox
+
+
+class FakeTransport:
+    def __init__(self):
+        self.aborted = False
+
+    def is_closing(self):
+        return self.aborted
+
+    def abort(self):
+        self.aborted = True
+
+
+class FakeWriter:
+    """Пишет в список; пока paused не сброшен, drain ждет, как при полном буфере сокета."""
+
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.writes = []
+        self.paused = asyncio.Event()
+        self.paused.set()
+
+    def writelines(self, batch):
+        self.writes.append(b"".join(batch))
+
+    async def drain(self):
+        await self.paused.wait()
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 0)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def test_drop_oldest_keeps_newest_messages():
+    async def run():
+        writer = FakeWriter()
+        writer.paused.clear()
+        outbox = ClientOutbox(writer, max_messages=3, overflow=DROP_OLDEST)
+        outbox.send(b"0")
+        await asyncio.sleep(0)  # первая запись ушла и ждет drain
+        for number in range(1, 6):
+            assert outbox.send(str(number).encode())
+        assert list(outbox.queue) == [b"3", b"4", b"5"]
+        assert outbox.dropped == 2
+        writer.paused.set()
+        await outbox.close()
+        return writer.writes
+
+    assert asyncio.run(run()) == [b"0", b"345"]
+
+
+def test_disconnect_policy_aborts_on_overflow():
+    async def run():
+        writer = FakeWriter()
+        writer.paused.clear()
+        outbox = ClientOutbox(writer, max_bytes=4, overflow=DISCONNECT)
+        assert outbox.send(b"1234")
+        assert not outbox.send(b"5")
+        assert writer.transport.aborted and outbox.closed
+        assert not outbox.send(b"6")
+        await outbox.close()
+
+    asyncio.run(run())
+
+
+def test_coalescing_batches_messages_within_window():
+    async def run():
+        writer = FakeWriter()
+        outbox = ClientOutbox(writer, coalesce_window=0.05)
+        outbox.send(b"a")
+        await asyncio.sleep(0.01)
+        # Следующие сообщения в пределах окна уходят одной записью
+        for data in (b"b", b"c", b"d"):
+            outbox.send(data)
+        await asyncio.sleep(0.1)
+        assert writer.writes == [b"a", b"bcd"]
+        await outbox.close()
+        assert outbox not in METRICS.outboxes
+
+    asyncio.run(run())
@@ -0,0 +1,35 @@
+from chat_common.ratelimit import RateLimiter, TokenBucket
+
+
+def test_bucket_lends_tokens_and_refills():
+    bucket = TokenBucket(rate=10, burst=2)
+    now = bucket.updated
+    assert bucket.reserve(now) == 0.0
+    assert bucket.reserve(now) == 0.0
+    # Третий жетон в долг: погасится через 1 / rate секунд
+    assert abs(bucket.reserve(now) - 0.1) < 1e-9
+    assert bucket.reserve(now + 0.3) == 0.0
+    # Накопление не больше burst
+    bucket.reserve(now + 100)
+    assert bucket.tokens == bucket.burst - 1
+
+
+def test_limiter_rejects_beyond_max_delay():
+    limiter = RateLimiter(client_rate=10, client_burst=1, room_rate=0, max_delay=0.15)
+    client = limiter.client_bucket()
+    assert limiter.check(client) == 0.0
+    assert limiter.check(client) > 0  # задержка в пределах max_delay
+    assert limiter.check(client) is None
+    assert client.rejected == 1
+    # Отклоненное сообщение жетон не тратит
+    assert client.tokens > -2
+
+
+def test_room_bucket_is_shared_and_forgotten():
+    limiter = RateLimiter(client_rate=0, room_rate=1, room_burst=1, max_delay=0)
+    assert limiter.client_bucket() is None
+    assert limiter.check(None, "a") == 0.0
+    assert limiter.check(None, "a") is None
+    assert limiter.check(None, "b") == 0.0
+    limiter.forget_room("a")
+    assert limiter.check(None, "a") == 0.0
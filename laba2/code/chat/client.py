@@ -1,26 +1,44 @@
 import asyncio
+import os
+import sys
 import threading
 import tkinter as tk
 from tkinter import scrolledtext, ttk
 from datetime import datetime
 from PIL import Image, ImageTk
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chat_common.connection import Backoff
+from chat_common.framing import MSG_NAME, MSG_PING, MSG_PONG, MSG_TEXT, encode_frame, read_frame, write_frame
+
 # Глобальные переменные для хранения объектов reader и writer
 reader = None
 writer = None
 
 async def receive_messages(reader, text_widget):
     while True:
-        data = await reader.read(100)
-        message = data.decode()
+        try:
+            frame = await read_frame(reader)
+        except (ConnectionError, OSError):
+            break
+        if frame is None:
+            break
+        if frame[0] == MSG_PING:
+            # Сервер проверяет, что клиент жив
+            await write_frame(writer, MSG_PONG, b"")
+            continue
+        message = frame[1].decode()
         display_message(text_widget, message)
         print(f"Получено сообщение: {message}")
 
-async def send_messages(writer, message):
+async def send_messages():
+    # writer берется глобальный: после переподключения он новый
     while True:
         message = await get_user_input("")
-        writer.write(message.encode())
-        await writer.drain()
+        try:
+            await write_frame(writer, MSG_TEXT, message)
+        except (ConnectionError, OSError):
+            print("Сообщение не отправлено: нет соединения")
 
 async def get_user_input(prompt):
     loop = asyncio.get_event_loop()
@@ -32,7 +50,7 @@ def send_message():
 
     message = entry_widget.get()
     entry_widget.delete(0, tk.END)
-    writer.write(message.encode())
+    writer.write(encode_frame(MSG_TEXT, message))
 
 def display_message(text_widget, message):
     current_time = datetime.now().strftime("%H:%M")
@@ -44,21 +62,40 @@ async def connect_to_server(text_widget):
     global reader
     global writer
 
-    reader, writer = await asyncio.open_connection('127.0.0.1', 8888)
-    print("Подключено к серверу")
-
-    receive_task = asyncio.create_task(receive_messages(reader, text_widget))
-
-    name = "*"
-    message = await get_user_input("")
-    name = message
-    writer.write(message.encode())
-    await writer.drain()
-
-    send_task = asyncio.create_task(send_messages(writer, name))
-
-    await receive_task
-    await send_task
+    # Если сервер пропал, подключаемся заново с растущей паузой и снова называемся тем же именем
+    backoff = Backoff()
+    name = None
+    send_task = None  # чтение ввода, одно на все переподключения
+    try:
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', 8888)
+            except OSError as e:
+                delay = backoff.next()
+                print(f"Не удалось подключиться ({e}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            backoff.reset()
+            print("Подключено к серверу")
+
+            receive_task = asyncio.create_task(receive_messages(reader, text_widget))
+
+            if name is None:
+                name = await get_user_input("")
+                send_task = asyncio.create_task(send_messages())
+            try:
+                await write_frame(writer, MSG_NAME, name)
+            except (ConnectionError, OSError):
+                pass
+
+            await receive_task
+            writer.close()
+            delay = backoff.next()
+            display_message(text_widget, f"Соединение потеряно, переподключение через {delay:.1f} с")
+            await asyncio.sleep(delay)
+    finally:
+        if send_task is not None:
+            send_task.cancel()
 
 def run_client_loop(text_widget):
     asyncio.run(connect_to_server(text_widget))
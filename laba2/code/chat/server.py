@@ -1,54 +1,76 @@
 import asyncio
+import os
+import sys
 import threading
 import tkinter as tk
 from tkinter import scrolledtext, ttk
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chat_common.framing import MSG_PING, MSG_PONG, MSG_SYSTEM, MSG_TEXT, encode_frame, read_frame
+from chat_common.heartbeat import Heartbeat
+from chat_common.outbox import DROP_OLDEST, ClientOutbox
+
+QUEUE_SIZE = 1000  # сообщений в очереди клиента
+OVERFLOW_POLICY = DROP_OLDEST  # или DISCONNECT - отключать клиента, который не успевает читать
+PING_FRAME = encode_frame(MSG_PING, b"")
+
 clients = {}
+outboxes = {}  # {writer: ClientOutbox}
+heartbeat = Heartbeat()  # ping молчащим клиентам, отключение не ответивших
 
 async def handle_client_messages(reader, writer, client_address, connections_widget, messages_widget):
     while True:
-        data = await reader.read(100)
-        if not data:
+        frame = await read_frame(reader)
+        if frame is None:
             break
-        message = data.decode()
+        heartbeat.touch(outboxes[writer])
+        msg_type, payload = frame
+        if msg_type == MSG_PONG:
+            continue
+        message = payload.decode()
         display_message = f"Получено сообщение от {client_address} {clients[writer]}: {message}\n"
         messages_widget.insert(tk.END, display_message)
         messages_widget.see(tk.END)
-        message = f" {clients[writer]} - " + message
+        # Кадр собирается один раз и ставится в очереди всех клиентов без ожидания записи
+        data = encode_frame(MSG_TEXT, f" {clients[writer]} - " + message)
         for client in clients:
-            client.write(message.encode())
-            await client.drain()
-            print("Сообщение отправлено")
+            outboxes[client].send(data)
 
 async def handle_new_client(reader, writer, connections_widget, messages_widget):
     client_address = writer.get_extra_info('peername')
     print(f"Новое подключение: {client_address}")
+    outbox = ClientOutbox(writer, max_messages=QUEUE_SIZE, overflow=OVERFLOW_POLICY)
     
     message = "Добро пожаловать! Пожалуйста, введите свое имя: "
-    writer.write(message.encode())
-    await writer.drain()
+    outbox.send(encode_frame(MSG_SYSTEM, message))
 
-    data = await reader.read(100)
-    message = data.decode()
+    # Первый кадр клиента - его имя
+    frame = await read_frame(reader)
+    if frame is None:
+        await outbox.close()
+        return
+    message = frame[1].decode()
 
     clients[writer] = message
+    outboxes[writer] = outbox
+    heartbeat.add(outbox, lambda: outbox.send(PING_FRAME))
     connections_widget.insert(tk.END, f"{client_address} - {message}\n")
     
     message = f"Ваше имя: {message}"
-    writer.write(message.encode())
-    await writer.drain()
+    outbox.send(encode_frame(MSG_SYSTEM, message))
 
     try:
         await handle_client_messages(reader, writer, client_address, connections_widget, messages_widget)
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
+        heartbeat.remove(outbox)
         if writer in clients.keys():
             clients.pop(writer)
+            outboxes.pop(writer, None)
             connections_widget.delete(1.0, tk.END)
             connections_widget.insert(tk.END, "\n".join([str(client.get_extra_info('peername')) + f" - {clients[client]}" for client in clients]))
-        writer.close()
-        await writer.wait_closed()
+        await outbox.close()
         print(f"Соединение с {client_address} разорвано")
 
 async def start_server(connections_widget, messages_widget):
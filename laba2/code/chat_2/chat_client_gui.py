@@ -2,10 +2,15 @@ import os
 os.environ["TCL_THREADS"] = "1"
 
 import asyncio
+import sys
 import tkinter as tk
 from tkinter.scrolledtext import ScrolledText
 from threading import Thread
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chat_common.compression import OPTION_COMPRESS, unpack_frame
+from chat_common.framing import MSG_OPTIONS, MSG_PING, MSG_PONG, MSG_TEXT, read_frame, write_frame
+
 
 class ChatClient:
     def __init__(self, root):
@@ -52,9 +57,10 @@ class ChatClient:
             self.chat_window.insert(tk.END, "Connected to the server.\n")
             self.chat_window.config(state='disabled')
 
+            # Длинные сообщения сервер будет присылать сжатыми
+            await write_frame(self.writer, MSG_OPTIONS, OPTION_COMPRESS)
             # Присоединение к комнате
-            self.writer.write("/join default_room\n".encode())
-            await self.writer.drain()
+            await write_frame(self.writer, MSG_TEXT, "/join default_room")
 
             asyncio.create_task(self.receive_messages())  # Запуск получения сообщений
 
@@ -66,10 +72,17 @@ class ChatClient:
     async def receive_messages(self):
         while self.running:
             try:
-                data = await self.reader.readline()
-                if not data:
+                frame = await read_frame(self.reader)
+                if frame is None:
                     break
-                message = data.decode().strip()
+                if frame[0] == MSG_PING:
+                    # Сервер проверяет, что клиент жив
+                    await write_frame(self.writer, MSG_PONG, b"")
+                    continue
+                msg_type, payload = unpack_frame(*frame)
+                if msg_type == MSG_OPTIONS:
+                    continue
+                message = payload.decode().strip()
 
                 self.chat_window.config(state='normal') # Включить редактирование
                 self.chat_window.insert(tk.END, f"{message}\n") # Добавить сообщение
@@ -97,8 +110,7 @@ class ChatClient:
 
     async def _send_message(self, message):
         try:
-            self.writer.write(f"{message}\n".encode())
-            await self.writer.drain()
+            await write_frame(self.writer, MSG_TEXT, message)
 
             if message.strip() == "/quit":
                 await self._stop_writer()
@@ -119,8 +131,7 @@ class ChatClient:
 
     async def _stop_writer(self):
         try:
-            self.writer.write("/quit\n".encode())
-            await self.writer.drain()
+            await write_frame(self.writer, MSG_TEXT, "/quit")
 
             self.writer.close()
             await self.writer.wait_closed()
@@ -1,26 +1,59 @@
 import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chat_common.compression import OPTION_COMPRESS, Packed, compress_frame
+from chat_common.framing import MSG_OPTIONS, MSG_PING, MSG_PONG, MSG_SYSTEM, MSG_TEXT, encode_frame, read_frame
+from chat_common.heartbeat import Heartbeat
+from chat_common.metrics import METRICS, room_gauges, serve_metrics
+from chat_common.outbox import DEFAULT_MAX_MESSAGES, DROP_OLDEST, ClientOutbox
+
+METRICS_PORT = 9888  # метрики: http://127.0.0.1:9888/metrics
+PING_FRAME = encode_frame(MSG_PING, b"")
 
 class ChatServer:
-    def __init__(self):
-        self.rooms = {}  # Комнаты: {'room_name': set(client_writer)}
-        self.lock = asyncio.Lock()  # Для синхронизации доступа
+    def __init__(self, queue_size=DEFAULT_MAX_MESSAGES, overflow=DROP_OLDEST, metrics_port=None):
+        # Комнаты: {'room_name': frozenset(ClientOutbox)}. Набор участников не меняется на месте:
+        # вход и выход подставляют новый frozenset, поэтому рассылка обходит снимок без блокировок,
+        # а изменения разных комнат друг друга не ждут
+        self.rooms = {}
+        self.outboxes = {}  # Очереди отправки: {client_writer: ClientOutbox}
+        self.queue_size = queue_size
+        self.overflow = overflow  # DROP_OLDEST или DISCONNECT
+        # Ping молчащим клиентам; не ответившие за таймаут отключаются пачкой
+        self.heartbeat = Heartbeat()
+        self.metrics_port = metrics_port
+        METRICS.add_collector(lambda: room_gauges(len(self.outboxes), self.rooms))
 
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
         print(f"Client connected: {addr}")
+        METRICS.inc("chat_connections_total")
+        outbox = ClientOutbox(writer, max_messages=self.queue_size, overflow=self.overflow)
+        self.outboxes[writer] = outbox
+        self.heartbeat.add(outbox, lambda: outbox.send(PING_FRAME))
         
-        writer.write("Welcome to the chat server!\n".encode())
-        writer.write("Enter '/join room_name' to join a room.\n".encode())
-        writer.write("Enter '/quit' to exit.\n".encode())
-        await writer.drain()
+        outbox.send(encode_frame(MSG_SYSTEM, "Welcome to the chat server!"))
+        outbox.send(encode_frame(MSG_SYSTEM, "Enter '/join room_name' to join a room."))
+        outbox.send(encode_frame(MSG_SYSTEM, "Enter '/quit' to exit."))
 
         room = None  # Текущая комната клиента
         try:
             while True:
-                data = await reader.readline()
-                if not data:
+                frame = await read_frame(reader)
+                if frame is None:
                     break
-                message = data.decode().strip()
+                self.heartbeat.touch(outbox)
+                if frame[0] == MSG_PONG:
+                    continue
+                if frame[0] == MSG_OPTIONS:
+                    # Клиент просит сжимать длинные сообщения; отвечаем, что включено
+                    outbox.compress = frame[1].decode() == OPTION_COMPRESS
+                    outbox.send(encode_frame(MSG_OPTIONS, OPTION_COMPRESS if outbox.compress else "compress=none"))
+                    continue
+                message = frame[1].decode().strip()
+                METRICS.inc("chat_messages_in_total")
                 print(f"Received from {addr}: {message}")  # Лог для отладки
 
                 if message.startswith("/join"):
@@ -32,63 +65,63 @@ class ChatServer:
         except (asyncio.CancelledError, Exception) as e:
             print(f"Error with client {addr}: {e}")
         finally:
+            self.heartbeat.remove(outbox)
             await self.leave_room(writer, room)
-            writer.close()
-            await writer.wait_closed()
+            del self.outboxes[writer]
+            await outbox.close()
             print(f"Client disconnected: {addr}")
 
     async def join_room(self, writer, current_room, command):
         """Переключение клиента в указанную комнату"""
         _, room_name = command.split(maxsplit=1)
-        async with self.lock:
-            # Удалить клиента из текущей комнаты
-            if current_room:
-                self.rooms[current_room].remove(writer)
-                if not self.rooms[current_room]:
-                    del self.rooms[current_room]
-
-            # Добавить клиента в новую комнату
-            if room_name not in self.rooms:
-                self.rooms[room_name] = set()
-            self.rooms[room_name].add(writer)
-
-        writer.write(f"Joined room: {room_name}\n".encode())
-        await writer.drain()
+        outbox = self.outboxes[writer]
+        # Удалить клиента из текущей комнаты
+        if current_room:
+            self.remove_member(current_room, outbox)
+
+        # Добавить клиента в новую комнату
+        self.rooms[room_name] = self.rooms.get(room_name, frozenset()) | {outbox}
+
+        outbox.send(encode_frame(MSG_SYSTEM, f"Joined room: {room_name}"))
         return room_name
 
     async def leave_room(self, writer, room):
         """Удаление клиента из комнаты"""
         if room:
-            async with self.lock:
-                self.rooms[room].remove(writer)
-                if not self.rooms[room]:
-                    del self.rooms[room]
+            self.remove_member(room, self.outboxes[writer])
+
+    def remove_member(self, room, outbox):
+        members = self.rooms[room] - {outbox}
+        if members:
+            self.rooms[room] = members
+        else:
+            del self.rooms[room]
 
     async def send_message(self, room, sender_writer, message):
         """Рассылка сообщения в комнате"""
         if not room:
-            sender_writer.write("You are not in a room. Use /join to enter one.\n".encode())
-            await sender_writer.drain()
+            self.outboxes[sender_writer].send(encode_frame(MSG_SYSTEM, "You are not in a room. Use /join to enter one."))
             return
 
-        async with self.lock:
-            for writer in self.rooms.get(room, []):
-                try:
-                    writer.write(f"{message}\n".encode())
-                    await writer.drain()
-                except Exception as e:
-                    print(f"Error sending message to {writer}: {e}")
+        # Сообщение только ставится в очереди получателей, запись идет в их задачах.
+        # Обходится снимок участников: вход и выход во время рассылки его не меняют
+        # Кадр собирается и, если нужно, сжимается один раз на всю рассылку
+        packed = Packed(encode_frame(MSG_TEXT, message), compress_frame)
+        for outbox in self.rooms.get(room, ()):
+            outbox.send(packed.for_outbox(outbox))
 
     async def run_server(self, host='127.0.0.1', port=8888):
         server = await asyncio.start_server(self.handle_client, host, port)
         addr = server.sockets[0].getsockname()
         print(f"Server running on {addr}")
+        if self.metrics_port:
+            await serve_metrics(self.metrics_port)
         async with server:
             await server.serve_forever()
 
 
 if __name__ == "__main__":
-    server = ChatServer()
+    server = ChatServer(metrics_port=METRICS_PORT)
     try:
         asyncio.run(server.run_server())
     except KeyboardInterrupt:
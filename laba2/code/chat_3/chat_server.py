@@ -1,24 +1,73 @@
 import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chat_common.heartbeat import PING_LINE, PONG, Heartbeat
+from chat_common.history import SEQ_PREFIX, SINCE_COMMAND, RoomHistory
+from chat_common.logs import sample, setup_logging
+from chat_common.metrics import METRICS, room_gauges, serve_metrics
+from chat_common.outbox import DEFAULT_MAX_MESSAGES, DROP_OLDEST, ClientOutbox
+from chat_common.ratelimit import RATE_LIMIT_NOTICE, RateLimiter
+
+# Журнал истории комнат
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+METRICS_PORT = 9080  # метрики: http://127.0.0.1:9080/metrics
+# Рассылки пишутся в журнал на уровне DEBUG и с выборкой: одна запись из BROADCAST_LOG_SAMPLE
+BROADCAST_LOG_SAMPLE = 100
+
+log = logging.getLogger("chat_3")
+broadcast_log = logging.getLogger("chat_3.broadcast")
+
+# Текстовые смайлы, которые заменяются на эмодзи в сообщениях
+EMOJIS = {
+    ":)": "🙂",
+    ":(": "🙁",
+    ":D": "😄",
+    ";)": "😉",
+    "<3": "❤️",
+}
 
 class ChatServer:
-    def __init__(self):
+    def __init__(self, queue_size=DEFAULT_MAX_MESSAGES, overflow=DROP_OLDEST, history_dir=HISTORY_DIR,
+                 metrics_port=None, coalesce_window=0, limiter=None):
         # Храним клиентов в формате: {адрес: (номер_комнаты, writer, имя)}
         self.clients = dict()  # Все подключенные клиенты
         # Храним информацию о комнатах
         self.rooms = dict()  # {room_number: [client1, client2, ...]}
+        # Индекс для рассылки: {room_number: {адрес: ClientOutbox}}, обновляется при входе и выходе
+        self.room_outboxes = dict()
+        self.queue_size = queue_size
+        self.overflow = overflow  # DROP_OLDEST или DISCONNECT
+        # Окно склейки исходящих сообщений в секундах, 0 - писать сразу (см. chat_common/outbox.py)
+        self.coalesce_window = coalesce_window
+        # Ограничение частоты сообщений соединения и комнаты, проверяется до рассылки
+        self.limiter = limiter or RateLimiter()
+        # Последние сообщения комнат, которые получает вошедший; history_dir=None - только в памяти
+        self.history = RoomHistory(history_dir)
+        # Ping молчащим клиентам; не ответившие за таймаут отключаются пачкой
+        self.heartbeat = Heartbeat()
+        self.metrics_port = metrics_port
+        METRICS.add_collector(lambda: room_gauges(len(self.clients), self.rooms))
 
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
         addr_str = f"{addr[0]}:{addr[1]}"
-        print(f"Client {addr_str} connected", flush=True)
+        log.info("Client %s connected", addr_str)
+        METRICS.inc("chat_connections_total")
 
         name = None
         room_number = None
+        since = None  # номер последнего сообщения, которое видел переподключившийся клиент
 
         try:
-            # Регистрация клиента
+            # Регистрация клиента: [/since номер], имя, номер комнаты
             await writer.drain()
             name = (await reader.readline()).decode().strip()
+            if name.startswith(SINCE_COMMAND + " "):
+                since = int(name.split()[1])
+                name = (await reader.readline()).decode().strip()
             if not name:
                 raise ValueError("Name cannot be empty.")
 
@@ -28,57 +77,89 @@ class ChatServer:
                 raise ValueError("Room number must be a valid integer.")
             room_number = int(room_number)
 
-            print(f"Client {addr_str} joined room {room_number}! His name is {name}", flush=True)
+            log.info("Client %s joined room %s! His name is %s", addr_str, room_number, name)
         except Exception as e:
-            print(f"Error during registration: {e}", flush=True)
+            log.warning("Error during registration: %s", e)
             writer.write("Error during registration. Please try again.\n".encode())
             await writer.drain()
             writer.close()
             await writer.wait_closed()
             return
 
+        outbox = ClientOutbox(writer, max_messages=self.queue_size, overflow=self.overflow,
+                              coalesce_window=self.coalesce_window)
+        limit = self.limiter.client_bucket()
+        self.heartbeat.add(outbox, lambda: outbox.send(PING_LINE))
         try:
             # Добавляем клиента в списки
             self.clients[addr_str] = (room_number, writer, name)
+            # Сначала история комнаты одним блоком (после переподключения - только пропущенное),
+            # потом новые сообщения
+            backlog = self.history.replay(room_number, after=since)
+            if backlog:
+                outbox.send(backlog)
             if room_number not in self.rooms:
                 self.rooms[room_number] = []
+                self.room_outboxes[room_number] = dict()
             self.rooms[room_number].append(name)
+            self.room_outboxes[room_number][addr_str] = outbox
             await self.broadcast(f"{name} has joined the room!", room_number)
 
             # Основной цикл обработки сообщений
             while True:
                 data = await reader.readline()
+                self.heartbeat.touch(outbox)
                 message = data.decode().strip()
 
                 if not message:  # Клиент разорвал соединение
                     break
+                if message == PONG:
+                    continue
+                METRICS.inc("chat_messages_in_total")
 
                 if message.lower() == "/quit":
                     await self.broadcast(f"{name} has left the room.", room_number)
                     break
 
-                elif message.lower() == "/help":
-                    await self.send_help(writer)
+                delay = self.limiter.check(limit, room_number)
+                if delay is None:
+                    # Одно предупреждение на серию отклоненных сообщений; без ограничения
+                    # соединения (client_rate=0) отклоняет только комната, и предупреждения нет
+                    if limit is not None and limit.rejected == 1:
+                        outbox.send((RATE_LIMIT_NOTICE + "\n").encode())
+                    continue
+                if delay:
+                    # Пока ждем, сокет не читается, и отправителя тормозит TCP
+                    await asyncio.sleep(delay)
+
+                if message.lower() == "/help":
+                    await self.send_help(outbox)
                 elif message.lower() == "/listrooms":
-                    await self.list_rooms(writer)
+                    await self.list_rooms(outbox)
                 else:
                     message = self.replace_emojis(message)
-                    await self.broadcast(f"{name}: {message}", room_number)
+                    await self.broadcast(f"{name}: {message}", room_number, keep=True)
         except Exception as e:
-            print(f"Error handling messages for {addr_str}: {e}", flush=True)
+            log.warning("Error handling messages for %s: %s", addr_str, e)
         finally:
             # Отключение клиента
-            print(f"Client {addr_str} disconnected", flush=True)
+            log.info("Client %s disconnected", addr_str)
+            self.heartbeat.remove(outbox)
             if addr_str in self.clients:
                 del self.clients[addr_str]
-            if room_number in self.rooms and name in self.rooms[room_number]:
-                self.rooms[room_number].remove(name)
-                if not self.rooms[room_number]:  # Удаляем комнату, если она пустая
-                    del self.rooms[room_number]
-            writer.close()
-            await writer.wait_closed()
-
-    async def send_help(self, writer):
+            # Убираем из комнаты только то, что зарегистрировало это соединение: при ошибке до
+            # регистрации в комнате может быть другой клиент с тем же именем
+            outboxes = self.room_outboxes.get(room_number)
+            if outboxes is not None and outboxes.pop(addr_str, None) is not None:
+                if name in self.rooms.get(room_number, ()):
+                    self.rooms[room_number].remove(name)
+                if not outboxes:  # Удаляем комнату, если она пустая
+                    self.rooms.pop(room_number, None)
+                    del self.room_outboxes[room_number]
+                    self.limiter.forget_room(room_number)
+            await outbox.close()
+
+    async def send_help(self, outbox):
         """Отправка инструкции пользователю."""
         help_text = (
             "Welcome to the chat server! Here are some commands you can use:\n"
@@ -86,10 +167,9 @@ class ChatServer:
             "/listrooms - List all rooms and the users inside\n"
             "/quit - Exit the chat\n"
         )
-        writer.write(help_text.encode())
-        await writer.drain()
+        outbox.send(help_text.encode())
 
-    async def list_rooms(self, writer):
+    async def list_rooms(self, outbox):
         """Отправка списка всех комнат и пользователей в них."""
         message = "List of rooms:\n"
         for room_number, users in self.rooms.items():
@@ -98,30 +178,48 @@ class ChatServer:
         if not message.strip():
             message = "No rooms available.\n"
         
-        writer.write(message.encode())
-        await writer.drain()
-
-    async def broadcast(self, message, room_number):
-        """Отправка сообщения всем клиентам в указанной комнате."""
-        print(f"Broadcasting message in room {room_number}: {message}", flush=True)
-        for addr, (client_room, client_writer, client_name) in self.clients.items():
-            if client_room == room_number:
-                try:
-                    print(f"Sending to {client_name} in room {room_number}", flush=True)
-                    client_writer.write((message + "\n").encode())
-                    await client_writer.drain()
-                except Exception as e:
-                    print(f"Error broadcasting to {addr}: {e}", flush=True)
-
-
+        outbox.send(message.encode())
+
+    async def broadcast(self, message, room_number, keep=False):
+        """Отправка сообщения всем клиентам в указанной комнате; keep - сохранить в истории."""
+        # Сообщение кодируется один раз, обходятся только участники комнаты.
+        # Запись в сокеты идет в задачах ClientOutbox, здесь сообщение только ставится в очереди
+        if keep:
+            # Сохраняемые сообщения идут с номером, по которому клиент продолжит после переподключения
+            seq = self.history.next_sequence(room_number)
+            data = f"{SEQ_PREFIX}{seq} {message}\n".encode()
+            self.history.append(room_number, data, seq)
+        else:
+            data = (message + "\n").encode()
+        outboxes = self.room_outboxes.get(room_number, {})
+        for outbox in outboxes.values():
+            outbox.send(data)
+        if broadcast_log.isEnabledFor(logging.DEBUG):
+            broadcast_log.debug("Broadcast in room %s to %d clients: %s", room_number, len(outboxes), message)
+
+    def replace_emojis(self, message):
+        """Замена текстовых смайлов на эмодзи."""
+        for text, emoji in EMOJIS.items():
+            if text in message:
+                message = message.replace(text, emoji)
+        return message
 
     async def main(self):
         server = await asyncio.start_server(self.handle_client, '0.0.0.0', 8080)
-        print('Server started and listening on 0.0.0.0:8080', flush=True)
-        async with server:
-            await server.serve_forever()
+        log.info('Server started and listening on 0.0.0.0:8080')
+        if self.metrics_port:
+            await serve_metrics(self.metrics_port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.heartbeat.close()
+            self.history.close()
 
 if __name__ == "__main__":
-    print('Server starting...', flush=True)
-    chat_server = ChatServer()
+    # Журнал на консоль через фоновый поток; для отладки рассылок - level=logging.DEBUG
+    setup_logging()
+    sample("chat_3.broadcast", BROADCAST_LOG_SAMPLE)
+    log.info('Server starting...')
+    chat_server = ChatServer(metrics_port=METRICS_PORT)
     asyncio.run(chat_server.main())
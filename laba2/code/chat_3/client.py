@@ -1,4 +1,5 @@
 import sys
+import os
 import asyncio
 import logging
 from PyQt5.QtWidgets import (
@@ -7,6 +8,9 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import QTimer
 from qasync import QEventLoop, asyncSlot
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from chat_common.connection import ReconnectingClient
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -62,29 +66,24 @@ class ChatClient(QWidget):
         self.input_layout.addWidget(self.send_button)
         self.layout.addLayout(self.input_layout)
 
-        # Инициализация соединения
-        self.reader = None
-        self.writer = None
-        self.receive_task = None
+        # Соединение переподключается само; после переподключения сервер присылает
+        # только пропущенные сообщения комнаты
+        self.connection = None
+        self.connection_task = None
         self.name = None
         self.room_number = None
 
+    def registration(self, name, room_number):
+        """Вход на сервер chat_3: [/since номер], имя, номер комнаты."""
+        async def handshake(connection):
+            connection.room = room_number
+            connection.send_since()
+            connection.send_line(name)
+            connection.send_line(room_number)
+        return handshake
+
     @asyncSlot()
     async def connect_to_server(self):
-        if self.receive_task:
-            self.receive_task.cancel()
-            try:
-                await self.receive_task
-            except asyncio.CancelledError:
-                self.log_message("Previous message receiving task cancelled.", level="info")
-        
-        if self.writer:
-            self.writer.close()
-            try:
-                await self.writer.wait_closed()
-            except Exception as e:
-                self.log_message(f"Error closing previous connection: {e}", level="error")
-
         self.name = self.name_field.text().strip()
         self.room_number = self.room_field.text().strip()
 
@@ -92,59 +91,31 @@ class ChatClient(QWidget):
             self.log_message("Name and room number must be provided.", level="warning")
             return
 
-        try:
-            self.reader, self.writer = await asyncio.open_connection("localhost", 8080)
-            self.update_status("Connected")
-            self.log_message("Successfully connected to the server.")
-
-            self.writer.write(f"{self.name}\n".encode())
-            self.writer.write(f"{self.room_number}\n".encode())
-            await self.writer.drain()
+        await self.close_connection()
+        self.connection = ReconnectingClient("localhost", 8080, self.registration(self.name, self.room_number),
+                                             self.log_message, on_status=self.on_status)
+        self.connection_task = asyncio.create_task(self.connection.run())
 
-            response = await self.reader.readline()
-            self.log_message(f"Server response: {response.decode().strip()}")
-
-            self.receive_task = asyncio.create_task(self.receive_messages())
-        except Exception as e:
-            self.log_message(f"Error: {e}", level="error")
-            self.update_status("Disconnected")
-            if self.writer:
-                self.writer.close()
-                await self.writer.wait_closed()
+    def on_status(self, status):
+        self.log_message(status)
+        self.update_status("Connected" if self.connection and self.connection.connected else "Reconnecting")
 
     async def close_connection(self):
         """Корректно завершает соединение с сервером."""
-        if self.receive_task and not self.receive_task.done():
-            self.receive_task.cancel()
-            try:
-                await self.receive_task
-            except asyncio.CancelledError:
-                self.log_message("Message receiving task cancelled.", level="info")
-
-        if self.writer:
-            self.writer.close()
-            try:
-                await self.writer.wait_closed()
-            except Exception as e:
-                self.log_message(f"Error while closing writer: {e}", level="error")
-
-    async def receive_messages(self):
+        if self.connection is None:
+            return
+        await self.connection.close()
+        self.connection_task.cancel()
         try:
-            while True:
-                message = await self.reader.readline()
-                if not message:
-                    break
-                self.log_message(message.decode().strip())
+            await self.connection_task
         except asyncio.CancelledError:
-            self.log_message("Message receiving task was cancelled.", level="info")
-        except Exception as e:
-            self.log_message(f"Error receiving messages: {e}", level="error")
-        finally:
-            self.update_status("Disconnected")
+            pass
+        self.connection = None
+        self.update_status("Disconnected")
 
     @asyncSlot()
     async def send_message(self):
-        if not self.writer:
+        if not self.connection:
             self.log_message("Not connected to the server.", level="warning")
             return
 
@@ -153,8 +124,9 @@ class ChatClient(QWidget):
             return
 
         try:
-            self.writer.write(f"{message}\n".encode())
-            await self.writer.drain()
+            # Без соединения сообщение отправится после переподключения
+            if self.connection.send_line(message):
+                await self.connection.drain()
             self.input_field.clear()
             self.log_message(f"Message sent: {message}")
         except Exception as e:
@@ -1,55 +1,50 @@
 import asyncio
+import os
+import sys
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
 import threading
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chat_common.connection import ReconnectingClient, join_handshake
+
 
 class ChatClient:
     def __init__(self, host, port):
         self.host = host
         self.port = port
-        self.reader = None
-        self.writer = None
         self.username = None
-        self.connected = False
-
-    async def connect(self, username, room):
-        try:
-            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
-            self.username = username
-            self.writer.write(f"/join {room} {username}\n".encode())
-            await self.writer.drain()
-            self.connected = True
-        except Exception as e:
-            raise ConnectionError(f"Failed to connect: {e}")
+        self.connection = None
+        self.task = None
+
+    @property
+    def connected(self):
+        return self.connection is not None and self.connection.connected
+
+    async def connect(self, username, room, callback):
+        # The connection keeps reconnecting with backoff until disconnect(); after a reconnect
+        # the server sends only the room messages this client has not seen yet
+        self.username = username
+        self.connection = ReconnectingClient(self.host, self.port, join_handshake(room, username), callback,
+                                             on_status=lambda text: callback(f"[INFO] {text}"))
+        self.task = asyncio.create_task(self.connection.run())
 
     async def send_message(self, message):
-        if self.connected:
-            self.writer.write(message.encode())
-            await self.writer.drain()
-
-    async def receive_messages(self, callback):
-        try:
-            while self.connected:
-                data = await self.reader.readline()
-                if data:
-                    callback(data.decode().strip())
-                else:
-                    break
-        except Exception as e:
-            callback(f"[ERROR] {e}")
-            self.connected = False
+        if self.connection is None:
+            return
+        command = message.split()
+        if command and command[0] == "/join" and len(command) > 1:
+            self.connection.join(command[1], self.username)
+        else:
+            # While reconnecting the line waits and is sent right after the next join
+            self.connection.send_line(message)
+        await self.connection.drain()
 
     async def disconnect(self):
-        if self.connected:
-            try:
-                self.writer.write("/quit\n".encode())
-                await self.writer.drain()
-                self.writer.close()
-                await self.writer.wait_closed()
-            except:
-                pass
-        self.connected = False
+        if self.connection is not None:
+            await self.connection.close()
+            self.task.cancel()
+            self.connection = None
 
 
 class ChatApp:
@@ -57,6 +52,9 @@ class ChatApp:
         self.root = root
         self.root.title("Chat Application")
         self.client = ChatClient("127.0.0.1", 5004)
+        # All network work runs on one event loop in a background thread
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
 
         self.setup_ui()
 
@@ -104,25 +102,9 @@ class ChatApp:
             messagebox.showerror("Error", "Username and room are required!")
             return
 
-        async def connect():
-            try:
-                await self.client.connect(username, room)
-                self.add_message("[INFO] Connected!")
-                self.disconnect_button.config(state=tk.NORMAL)
-                self.connect_button.config(state=tk.DISABLED)
-                asyncio.create_task(self.run_receive_loop())
-            except ConnectionError as e:
-                messagebox.showerror("Connection Error", str(e))
-
-        def start_async_task():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)  # Устанавливаем новый цикл событий
-            loop.run_until_complete(connect())
-
-        threading.Thread(target=start_async_task, daemon=True).start()
-
-    async def run_receive_loop(self):
-        await self.client.receive_messages(self.add_message)
+        asyncio.run_coroutine_threadsafe(self.client.connect(username, room, self.add_message), self.loop)
+        self.disconnect_button.config(state=tk.NORMAL)
+        self.connect_button.config(state=tk.DISABLED)
 
     def on_disconnect(self):
         async def disconnect():
@@ -131,32 +113,22 @@ class ChatApp:
             self.disconnect_button.config(state=tk.DISABLED)
             self.connect_button.config(state=tk.NORMAL)
 
-        asyncio.run_coroutine_threadsafe(disconnect(), asyncio.get_event_loop())
+        asyncio.run_coroutine_threadsafe(disconnect(), self.loop)
 
     def on_send_message(self):
         message = self.message_entry.get().strip()
         if message:
             async def send():
                 try:
-                    await self.client.send_message(message + "\n")
-                    self.message_entry.delete(0, tk.END)
-                except ConnectionError:
-                    messagebox.showerror("Error", "Failed to send message.")
-
-            asyncio.run_coroutine_threadsafe(send(), asyncio.get_event_loop())
-
+                    await self.client.send_message(message)
+                except (ConnectionError, OSError):
+                    self.add_message("[INFO] Not sent, the connection was lost.")
 
-def start_asyncio_loop():
-    asyncio.set_event_loop(asyncio.new_event_loop())
-    loop = asyncio.get_event_loop()
-    loop.run_forever()
+            self.message_entry.delete(0, tk.END)
+            asyncio.run_coroutine_threadsafe(send(), self.loop)
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = ChatApp(root)
-
-    # Запуск asyncio в отдельном потоке
-    threading.Thread(target=start_asyncio_loop, daemon=True).start()
-
     root.mainloop()
@@ -1,56 +1,127 @@
 import asyncio
+import os
+import sys
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from chat_common.compression import COMPRESS_COMMAND, Packed, negotiate
+from chat_common.heartbeat import PING_LINE, PONG, Heartbeat
+from chat_common.history import JOINED_COMMAND, SEQ_PREFIX, SINCE_COMMAND, RoomHistory
+from chat_common.metrics import METRICS, room_gauges, serve_metrics
+from chat_common.outbox import DEFAULT_MAX_MESSAGES, DROP_OLDEST, ClientOutbox
+from chat_common.presence import RoomPresence
+from chat_common.ratelimit import RATE_LIMIT_NOTICE, RateLimiter
+
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history")
+METRICS_PORT = 9004  # scrape http://127.0.0.1:9004/metrics
+
 
 class ChatServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, queue_size=DEFAULT_MAX_MESSAGES, overflow=DROP_OLDEST, history_dir=HISTORY_DIR,
+                 metrics_port=None, coalesce_window=0, limiter=None):
         self.host = host
         self.port = port
+        self.queue_size = queue_size
+        self.overflow = overflow  # DROP_OLDEST or DISCONNECT
+        # Seconds an outbox may hold messages to write them together (0 - write at once)
+        self.coalesce_window = coalesce_window
+        # Per-connection and per-room token buckets, checked before anything is fanned out
+        self.limiter = limiter or RateLimiter()
         self.clients = {}  # {username: (writer, room)}
+        self.outboxes = {}  # {username: ClientOutbox}, writes happen in the outbox task
         self.rooms = defaultdict(list)  # {room: [username1, username2]}
         self.online_users = set()  # Keeps track of online users for private messages
+        # Room list: full snapshot on connect, then coalesced deltas only when membership changes
+        self.presence = RoomPresence(self.rooms)
+        # Pings quiet connections; ones that stay silent past the timeout are aborted together
+        self.heartbeat = Heartbeat()
+        # Recent messages per room, replayed to new members; history_dir=None keeps it in memory only
+        self.history = RoomHistory(history_dir)
+        self.metrics_port = metrics_port
+        self.connections = 0
+        METRICS.add_collector(lambda: room_gauges(self.connections, self.rooms))
 
     async def start(self):
         server = await asyncio.start_server(self.handle_client, self.host, self.port)
         print(f"Server started on {self.host}:{self.port}")
-        await self.broadcast_rooms()
-
-        async with server:
-            await server.serve_forever()
-
-    async def broadcast_rooms(self):
-        while True:
-            await asyncio.sleep(3)
-            rooms_list = "/rooms " + ",".join(self.rooms.keys())
-            for username, (writer, _) in list(self.clients.items()):
-                try:
-                    writer.write(rooms_list.encode() + b'\n')
-                    await writer.drain()
-                except:
-                    await self.disconnect_client(username)
+        if self.metrics_port:
+            await serve_metrics(self.metrics_port)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.heartbeat.close()
+            self.history.close()
 
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
         username = None
         room = None
+        since = None  # last sequence number the client saw, sent before /join on reconnect
+        outbox = ClientOutbox(writer, max_messages=self.queue_size, overflow=self.overflow,
+                              coalesce_window=self.coalesce_window)
+        limit = self.limiter.client_bucket()
+        self.presence.subscribe(outbox)
+        self.heartbeat.add(outbox, lambda: outbox.send(PING_LINE))
+        self.connections += 1
+        METRICS.inc("chat_connections_total")
 
         try:
             while data := await reader.readline():
+                self.heartbeat.touch(outbox)
                 data = data.decode().strip()
                 if not data:
                     break
+                if data == PONG:
+                    continue
+                METRICS.inc("chat_messages_in_total")
+
+                if data.startswith("/quit"):
+                    break
+                # Only chat and /private messages are limited: a dropped /join, /since or /compress
+                # (e.g. replayed by a reconnecting client) would leave the client outside any room
+                if not data.startswith(("/join", SINCE_COMMAND + " ", COMPRESS_COMMAND)):
+                    delay = self.limiter.check(limit, room)
+                    if delay is None:
+                        # One notice per run of rejected messages, the rest are dropped silently;
+                        # without a per-connection limit only the room bucket rejects, and no notice
+                        if limit is not None and limit.rejected == 1:
+                            outbox.send(RATE_LIMIT_NOTICE.encode() + b'\n')
+                        continue
+                    if delay:
+                        # Not reading the socket meanwhile slows the sender down through TCP
+                        await asyncio.sleep(delay)
 
                 if data.startswith("/join"):
                     parts = data.split()
+                    # A repeated /join moves the connection: drop the previous identity first (the
+                    # username may change too), so the old room is told it left and the user is
+                    # never listed twice or sent every message twice
+                    if username is not None:
+                        await self.disconnect_client(username)
                     room = parts[1]
                     username = parts[2] if len(parts) > 2 else f"{addr[0]}:{addr[1]}"  # Allow username specification
                     self.clients[username] = (writer, room)
+                    self.outboxes[username] = outbox
                     self.online_users.add(username)
+                    # Confirmed before the backlog: from here on the client keys /seq numbers by this room
+                    outbox.send(f"{JOINED_COMMAND} {room}\n".encode())
+                    backlog = self.history.replay(room, after=since)
+                    since = None
+                    if backlog:
+                        outbox.send(Packed(backlog).for_outbox(outbox))
                     self.rooms[room].append(username)
+                    self.presence.mark(room)
                     await self.send_to_room(room, f"[INFO] {username} has joined the room {room}")
 
-                elif data.startswith("/quit"):
-                    break
+                elif data.startswith(SINCE_COMMAND + " "):
+                    # The client reconnects: the next /join replays only messages it has not seen
+                    since = int(data.split()[1])
+
+                elif data.startswith(COMPRESS_COMMAND):
+                    outbox.compress, reply = negotiate(data)
+                    outbox.send(reply)
 
                 elif data.startswith("/private"):
                     parts = data.split(" ", 2)  # Split into command, recipient, message
@@ -61,60 +132,66 @@ class ChatServer:
                         await self.send_to_client(username, "[ERROR] Incorrect /private message format.")
 
                 else:
-                    await self.send_to_room(room, f"{username}: {data}")
+                    await self.send_to_room(room, f"{username}: {data}", keep=True)
 
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
+            self.connections -= 1
+            self.heartbeat.remove(outbox)
+            self.presence.unsubscribe(outbox)
             await self.disconnect_client(username)
+            await outbox.close()
 
-    async def send_to_room(self, room, message):
+    async def send_to_room(self, room, message, keep=False):
+        # The message is encoded (and compressed, if anyone asked for it) once and only queued;
+        # a slow reader delays its own outbox only
         if room in self.rooms:
+            if keep:
+                # Kept messages carry their room sequence number so clients can resume after it
+                seq = self.history.next_sequence(room)
+                data = f"{SEQ_PREFIX}{seq} {message}\n".encode()
+                self.history.append(room, data, seq)
+            else:
+                data = message.encode() + b'\n'
+            packed = Packed(data)
             for user in self.rooms[room]:
-                if user in self.clients:
-                    writer, _ = self.clients[user]
-                    try:
-                        writer.write(message.encode() + b'\n')
-                        await writer.drain()
-                    except:
-                        await self.disconnect_client(user)
+                if user in self.outboxes:
+                    outbox = self.outboxes[user]
+                    outbox.send(packed.for_outbox(outbox))
 
     async def send_private_message(self, sender, recipient, message):
-        if recipient in self.online_users and recipient in self.clients:
-            writer, _ = self.clients[recipient]
-            try:
-                writer.write(f"[PRIVATE] {sender}: {message}".encode() + b'\n')
-                await writer.drain()
-            except:
-                await self.disconnect_client(recipient)
+        if recipient in self.online_users and recipient in self.outboxes:
+            self.outboxes[recipient].send(f"[PRIVATE] {sender}: {message}".encode() + b'\n')
         else:
             await self.send_to_client(sender, f"[ERROR] User '{recipient}' not found or offline.")
 
     async def send_to_client(self, username, message):
-        if username in self.clients:
-            writer, _ = self.clients[username]
-            try:
-                writer.write(message.encode() + b'\n')
-                await writer.drain()
-            except:
-                await self.disconnect_client(username)
+        if username in self.outboxes:
+            self.outboxes[username].send(message.encode() + b'\n')
+
+    def leave_room(self, username, room):
+        if room in self.rooms and username in self.rooms[room]:
+            self.rooms[room].remove(username)
+            if not self.rooms[room]:
+                del self.rooms[room]
+                self.limiter.forget_room(room)
+            self.presence.mark(room)
 
     async def disconnect_client(self, username):
+        # Only forgets the user, so nothing new is queued to its outbox; handle_client
+        # closes (drains) the outbox once, after this
         if username in self.clients:
-            writer, room = self.clients[username]
-            writer.close()
-            await writer.wait_closed()
+            _, room = self.clients[username]
             del self.clients[username]
+            self.outboxes.pop(username, None)
             self.online_users.discard(username)
 
-            if room in self.rooms:
-                self.rooms[room].remove(username)
-                if not self.rooms[room]:
-                    del self.rooms[room]
+            self.leave_room(username, room)
 
             await self.send_to_room(room, f"[INFO] {username} has left the room")
 
 
 if __name__ == "__main__":
-    server = ChatServer("127.0.0.1", 5004)
+    server = ChatServer("127.0.0.1", 5004, metrics_port=METRICS_PORT)
     asyncio.run(server.start())